@@ -0,0 +1,84 @@
+"""
+Measures the time of Analitics.sleepAverage on the sleep activities of one
+and three years, for the whole period and day by day.
+
+Usage: python benchmarks/sleep_average.py [other/analitics.py]
+
+When the path of another version of analitics.py is given (e.g. extracted
+with git show), its sleepAverage is measured on the same activities too.
+"""
+
+import datetime as dt
+import importlib.util
+import os
+import random
+import sys
+import time
+import warnings
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src'))
+
+from analitics import Analitics
+
+COLUMNS = ['date', 'start_datetime', 'end_datetime',
+           'count_micro_awakenings', 'time_micro_awakenings',
+           'count_awakenings', 'time_awakenings']
+
+def activities(days, per_day=2, seed=1) :
+    """
+    Creates random sleep activities, per_day for each day.
+    """
+    generator = random.Random(seed)
+    rows = []
+    first_day = dt.date(2018, 1, 1)
+    for i in range(days * per_day) :
+        day = first_day + dt.timedelta(days=i // per_day)
+        start = dt.datetime.combine(day, dt.time(22)) \
+                + dt.timedelta(seconds=generator.randint(0, 3600))
+        end = start + dt.timedelta(seconds=generator.randint(1, 30000))
+        rows.append([day, start, end, generator.randint(0, 5),
+                     generator.randint(0, 500), generator.randint(0, 3),
+                     generator.randint(0, 900)])
+    return pd.DataFrame(rows, columns=COLUMNS)
+
+def analitics(path=None) :
+    """
+    Creates an Analitics without a client, of another version if a path is
+    given.
+    """
+    if path is None :
+        return Analitics(None)
+    spec = importlib.util.spec_from_file_location('other_analitics', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.Analitics(None)
+
+def measure(function, repeat) :
+    """
+    Gets the best time of some runs of a function, in seconds.
+    """
+    best = None
+    for _ in range(repeat) :
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+if __name__ == "__main__" :
+    warnings.simplefilter('ignore')
+    versions = [('current', analitics(), 10)]
+    if len(sys.argv) > 1 :
+        versions.append((sys.argv[1], analitics(sys.argv[1]), 1))
+    for years in (1, 3) :
+        sleep_activities = activities(365 * years)
+        for daily in (False, True) :
+            for name, version, repeat in versions :
+                elapsed = measure(lambda : version.sleepAverage(
+                    sleep_activities, daily), repeat)
+                print("%d years, %d rows, daily=%s, %s: %.1f ms"
+                      % (years, len(sleep_activities), daily, name,
+                         elapsed * 1000))
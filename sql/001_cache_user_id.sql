@@ -0,0 +1,24 @@
+-- Gives the cache of the sleep activities the user of each record, with the
+-- unique key the upsert of C2KRestClient.upsertSleepData relies on.
+-- The cache is named sleep_cache here: replace it with the value of 
+-- C2KRestClient.DB_TABLE_CACHE in src/client.py before running the script.
+
+-- The records stored before have no user: they are given the placeholder
+-- user '', which is never asked, so the service calculates them again.
+ALTER TABLE sleep_cache
+    ADD COLUMN user_id VARCHAR(64) NOT NULL DEFAULT '' FIRST;
+
+ALTER TABLE sleep_cache
+    ALTER COLUMN user_id DROP DEFAULT;
+
+-- Operator step: the records without a user were written without a key, so
+-- they can hold duplicates preventing the unique key. They are copied to
+-- sleep_cache_unassigned, to be kept or dropped by the operator, and then
+-- removed from the cache.
+CREATE TABLE sleep_cache_unassigned AS
+    SELECT * FROM sleep_cache WHERE user_id = '';
+
+DELETE FROM sleep_cache WHERE user_id = '';
+
+ALTER TABLE sleep_cache
+    ADD UNIQUE KEY user_date_start (user_id, date, start_datetime);
@@ -0,0 +1,39 @@
+-- Creates the sums of the weeks and months of the cache 
+-- (C2KRestClient.DB_TABLE_ROLLUP_WEEK and DB_TABLE_ROLLUP_MONTH, named 
+-- sleep_rollup_week and sleep_rollup_month here), with the primary key the
+-- upsert of C2KRestClient.updateSleepRollups relies on. Each row holds, for
+-- the week (from Monday) or month starting at period_start, the number of
+-- days in the cache, the number of them with a sleep duration, the first
+-- and last of these and the sums of their measures. The duration is in
+-- seconds. The periods are written with the cache, so the weeks and months
+-- cached before are summed when some of their days are written again.
+
+CREATE TABLE sleep_rollup_week (
+    user_id VARCHAR(64) NOT NULL,
+    period_start DATE NOT NULL,
+    cached_days INT NOT NULL,
+    days INT NOT NULL,
+    first_date DATE NULL,
+    last_date DATE NULL,
+    duration BIGINT NOT NULL,
+    count_micro_awakenings BIGINT NOT NULL,
+    time_micro_awakenings DOUBLE NOT NULL,
+    count_awakenings BIGINT NOT NULL,
+    time_awakenings DOUBLE NOT NULL,
+    PRIMARY KEY (user_id, period_start)
+);
+
+CREATE TABLE sleep_rollup_month (
+    user_id VARCHAR(64) NOT NULL,
+    period_start DATE NOT NULL,
+    cached_days INT NOT NULL,
+    days INT NOT NULL,
+    first_date DATE NULL,
+    last_date DATE NULL,
+    duration BIGINT NOT NULL,
+    count_micro_awakenings BIGINT NOT NULL,
+    time_micro_awakenings DOUBLE NOT NULL,
+    count_awakenings BIGINT NOT NULL,
+    time_awakenings DOUBLE NOT NULL,
+    PRIMARY KEY (user_id, period_start)
+);
@@ -0,0 +1,12 @@
+-- Creates the states of the sleep analysis at the end of each day 
+-- (C2KRestClient.DB_TABLE_CHECKPOINT, named sleep_checkpoint here), with
+-- the primary key the upsert of C2KRestClient.upsertSleepData relies on: a
+-- day analyzed again replaces its state. The state is the JSON of 
+-- Intelligence.getState.
+
+CREATE TABLE sleep_checkpoint (
+    user_id VARCHAR(64) NOT NULL,
+    date DATE NOT NULL,
+    state MEDIUMTEXT NOT NULL,
+    PRIMARY KEY (user_id, date)
+);
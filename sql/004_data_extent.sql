@@ -0,0 +1,13 @@
+-- Creates the period covered by the data of each user 
+-- (C2KRestClient.DB_TABLE_EXTENT, named sleep_data_extent here), with the 
+-- primary key the upsert of DataExtentIndex.update relies on to only
+-- extend the known period. checked_at is when the server was last asked for
+-- the measurements following the last one, NULL if never.
+
+CREATE TABLE sleep_data_extent (
+    user_id VARCHAR(64) NOT NULL,
+    first_measurement DATETIME NOT NULL,
+    last_measurement DATETIME NOT NULL,
+    checked_at DATETIME NULL,
+    PRIMARY KEY (user_id)
+);
@@ -0,0 +1,18 @@
+-- Creates the vector of the average sleep of each user 
+-- (C2KRestClient.DB_TABLE_COHORT, named sleep_cohort here), with the 
+-- primary key the upsert of CohortIndex.update relies on to replace the
+-- vector of a user. The measures are averaged over the days from 
+-- start_date to end_date; the duration is in seconds.
+
+CREATE TABLE sleep_cohort (
+    user_id VARCHAR(64) NOT NULL,
+    start_date DATE NOT NULL,
+    end_date DATE NOT NULL,
+    duration DOUBLE NOT NULL,
+    count_micro_awakenings DOUBLE NOT NULL,
+    time_micro_awakenings DOUBLE NOT NULL,
+    count_awakenings DOUBLE NOT NULL,
+    time_awakenings DOUBLE NOT NULL,
+    updated_at DATETIME NOT NULL,
+    PRIMARY KEY (user_id)
+);
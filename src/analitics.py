@@ -22,25 +22,49 @@ under the License.
 import datetime as dt
 import pandas as pd
 import numpy as np
-import math
-#import matplotlib.pyplot as plt
-import gc
+import threading
 
 from configuration import Configuration
 from intelligence import Sleep
+from intelligence import VectorizedSleep
 from device import DeviceStateValue
+from device import Event
+from plots import PlotRenderer
+from plots import PlotException
+from plots import FORMATS
 
 class Analitics :
+
+    # The measures of the sleep activities compared with the average and
+    # between days
+    measures = ['duration', 'count_micro_awakenings',
+                'time_micro_awakenings', 'count_awakenings',
+                'time_awakenings']
+
+    # The values of the states of a device that is not active in the plots
+    inactive_values = [DeviceStateValue.INACTIVE, DeviceStateValue.CLOSED,
+                       DeviceStateValue.NOT_PRESENT, 
+                       DeviceStateValue.NOT_IDENTIFIED,
+                       DeviceStateValue.DISCONNECTED, DeviceStateValue.LOW]
+
+    # The renderer of the plots, shared by all the instances
+    plot_renderer = None
+    plot_renderer_lock = threading.Lock()
     
     def __init__(self, client) :
         self.client = client
+        # The stored states of the sleep engine at the end of the days, the
+        # days they are read for and the day whose state the engine holds
+        self.sleep_checkpoints = None
+        self.checkpoint_range = None
+        self.checkpoint_day = None
 
     def execute(self, params):
         """
         Main function.
         @param argv CLI parameters.
         """
-        self.sleep = Sleep(self.client.mapping.devices)
+        self.sleep = self.createSleep()
         
         # ACTIVITY COMMAND
         if (params['sleep']['action'] == "activity"):
@@ -52,17 +76,22 @@ class Analitics :
         # AVERAGE COMMAND
         elif(params['sleep']['action'] == "average"):
             params['sleep']['action'] = 'activity'
-            sleep_activities = \
-                self.sleepActivities(self.sleep, params['sleep']['param_1'], 
-                                     params['sleep']['param_2'])  
-            average = self.sleepAverage(sleep_activities)
+            average = self.sleepAverageForDays(params['sleep']['param_1'], 
+                                               params['sleep']['param_2'])
             return average
     
         # ANALYZE COMMAND
         elif(params['sleep']['action'] == "analyze"):
             sleep_activities = self.sleepActivities(self.sleep, params['sleep']['param_1'], 
                                      params['sleep']['param_2'])
-            average = self.sleepAverage(sleep_activities)
+            if self.sameDay(params['sleep']['param_3'], 
+                            params['sleep']['param_1']) \
+             and self.sameDay(params['sleep']['param_4'], 
+                              params['sleep']['param_2']) :
+                average = self.sleepAverage(sleep_activities)
+            else :
+                average = self.sleepAverageForDays(params['sleep']['param_3'],
+                                                   params['sleep']['param_4'])
             analysis = self.sleep_analysis(sleep_activities, average)      
             return analysis
     
@@ -73,14 +102,64 @@ class Analitics :
                                            params['sleep']['param_3'], 
                                            params['sleep']['param_4'])       
             return cosine   
+        # COSINE similarity between all the nights
+        elif(params['sleep']['action'] == "similarity"):
+            return self.cosine_matrix(params['sleep']['param_1'],
+                                      params['sleep']['param_2'],
+                                      params['sleep']['param_3'])
+        # ANALYZE COMMAND with the average of the nights before each night
+        elif(params['sleep']['action'] == "rolling"):
+            return self.rolling_analysis(params['sleep']['param_1'],
+                                         params['sleep']['param_2'],
+                                         params['sleep']['param_3'])
+        # COSINE similarity with the users of a cohort
+        elif(params['sleep']['action'] == "cohort"):
+            return self.cohort_similarity(params['sleep']['param_1'],
+                                          params['sleep']['param_2'],
+                                          params['sleep']['param_3'],
+                                          params['sleep']['param_4'])
+        # TIMELINE of the states of the devices
+        elif(params['sleep']['action'] == "timeline"):
+            return self.timeline(params['sleep']['param_1'], 
+                                 params['sleep']['param_2'])
         # PLOT
         elif(params['sleep']['action'] == "plot"):
-            self.plot(params['sleep']['param_1'], 
-                            params['sleep']['param_2'])  
+            return self.plot(params['sleep']['param_1'], 
+                             params['sleep']['param_2'],
+                             params['sleep']['param_3'],
+                             params['sleep']['param_4'])
         
+    def sameDay(self, first, second):
+        """
+        Tells if two dates or datetimes are in the same day.
+        @type first date
+        @param first the first date.
+        @type second date
+        @param second the second date.
+        @rtype boolean
+        @return True if they are in the same day.
+        """
+        if isinstance(first, dt.datetime) :
+            first = first.date()
+        if isinstance(second, dt.datetime) :
+            second = second.date()
+        return first == second
+
+    def createSleep(self):
+        """
+        Creates the configured engine to recognize the sleep activities.
+        @rtype Sleep or VectorizedSleep
+        @return the engine.
+        """
+        if Configuration.SLEEP_ENGINE == 'vectorized' :
+            return VectorizedSleep(self.client.mapping.devices)
+        return Sleep(self.client.mapping.devices)
+
     def sleepActivities(self, sleep, start_date, end_date):
         """
         Takes and calculates the sleep activities for an interval of days.
+        @type sleep Sleep or VectorizedSleep
+        @param sleep the engine used to recognize the sleep activities.
         @type start_date date
         @param start_date the starting date of the time interval.
         @type end_date date
@@ -120,36 +199,208 @@ class Analitics :
             partial_end_datetime = \
              partial_start_datetime + dt.timedelta(days=1)
             data_for_day = start_date
+            # The cached data of the whole period are read at once and
+            # grouped by day
+            cached_data = self.client.getCachedSleepData(start_date, end_date)
+            cached_days = {}
+            if not cached_data.empty :
+                for day, day_data in cached_data.groupby(
+                    cached_data['date'].map(
+                        lambda date: date.strftime('%Y-%m-%d')), sort=False) :
+                    cached_days[day] = day_data
+            # The checkpoints are read from the server when the first day to
+            # calculate is found
+            self.sleep_checkpoints = None
+            self.checkpoint_range = (start_date - dt.timedelta(days=1),
+                                     end_date)
+            self.checkpoint_day = None
+            # The beginning of consecutive days without cached data, their
+            # events are fetched together
+            frames = []
+            missing_start_datetime = None
+            missing_days = 0
             # Loops in the period of interest taking as step a day
             while end_datetime >= partial_end_datetime:
                 # The requested day of interest in the period
                 cached_data = \
-                 self.client.getCachedSleepData(data_for_day, data_for_day)
-                if cached_data.empty :
-                    db_partial_dataframe = \
-                        self.client.getSleepEvents(partial_start_datetime, 
-                                                   partial_end_datetime)
-                    for event in db_partial_dataframe :
-                        if event.getDatetime().year != dt.MINYEAR :
-                            self.client.mapping.changeDeviceState(event)
-                        feedback = sleep.computeSleepActivities(event)
-                        if not feedback.empty :
-                            sleep_df = sleep_df.append(feedback)
-                            self.client.insertSleepDataToCache(feedback) 
+                 cached_days.get(data_for_day.strftime('%Y-%m-%d'))
+                if cached_data is None :
+                    if missing_days == 0 :
+                        missing_start_datetime = partial_start_datetime
+                    missing_days += 1
+                    if missing_days == Configuration.MAX_DAYS_PER_FETCH :
+                        frames.append(
+                            self.sleepActivitiesForDays(sleep, 
+                                                        missing_start_datetime,
+                                                        missing_days,
+                                                        cached_days))
+                        missing_days = 0
                 else :
-                    sleep_df = sleep_df.append(cached_data)
+                    if missing_days != 0 :
+                        frames.append(
+                            self.sleepActivitiesForDays(sleep, 
+                                                        missing_start_datetime,
+                                                        missing_days,
+                                                        cached_days))
+                        missing_days = 0
+                    frames.append(cached_data)
                 partial_start_datetime += dt.timedelta(days=1)
                 partial_end_datetime += dt.timedelta(days=1)
                 data_for_day += dt.timedelta(days=1)    
-        return sleep_df       
+            if missing_days != 0 :
+                frames.append(
+                    self.sleepActivitiesForDays(sleep, missing_start_datetime,
+                                                missing_days, cached_days))
+            self.client.flushSleepDataToCache()
+            sleep_df = self.concatFrames(frames, columns)
+        return sleep_df
+
+    def withoutCachedDays(self, sleep_df, cached_days):
+        """
+        Removes the calculated sleep activities already in the cache. A
+        sleep activity started before the day separator is closed in the
+        following day, so it is calculated again with it when its day is
+        cached. It is kept only if its day was cached before it was closed.
+        @type sleep_df dataframe
+        @param sleep_df the calculated sleep activities.
+        @type cached_days dict
+        @param cached_days the cached activities of each day, as YYYY-mm-dd.
+        @rtype dataframe
+        @return the sleep activities not in the cache.
+        """
+        if sleep_df.empty or not cached_days :
+            return sleep_df
+        # The activities are identified as in the cache, by day and start
+        cached = set()
+        for day, day_data in cached_days.items() :
+            cached.update((day, pd.Timestamp(start))
+                          for start in day_data['start_datetime'])
+        return sleep_df[[(date.strftime('%Y-%m-%d'), pd.Timestamp(start))
+                         not in cached for date, start
+                         in zip(sleep_df['date'], sleep_df['start_datetime'])]]
+
+    def concatFrames(self, frames, columns):
+        """
+        Concatenates with a single copy the sleep activities calculated or
+        cached in pieces.
+        @type frames list of dataframe
+        @param frames the pieces, in order.
+        @type columns list of String
+        @param columns the columns of the result when there are no 
+        activities.
+        @rtype dataframe
+        @return the sleep activities of all the pieces.
+        """
+        frames = [frame for frame in frames if not frame.empty]
+        if not frames :
+            return pd.DataFrame(columns=columns)
+        return pd.concat(frames)
+
+    def sleepActivitiesForDays(self, sleep, start_datetime, days,
+                               cached_days=None):
+        """
+        Calculates the sleep activities of consecutive days whose events are
+        fetched with a single request. 
+        The events are split in days on the day separators, closing each day
+        as if it was requested alone: the sleep activities crossing a 
+        separator are recognized as they are when the days are requested one
+        by one.
+        The calculated activities not already cached are buffered to be
+        stored in the cache.
+        @type sleep Sleep or VectorizedSleep
+        @param sleep the engine used to recognize the sleep activities.
+        @type start_datetime datetime
+        @param start_datetime the beginning of the first day.
+        @type days int
+        @param days the number of days.
+        @type cached_days dict
+        @param cached_days the cached activities of each day, as YYYY-mm-dd,
+        None if there are none.
+        @rtype dataframe
+        @return the dataframe containing the calculated sleep activities not
+        already cached.
+        """
+        separators = [start_datetime + dt.timedelta(days=i)
+                      for i in range(1, days + 1)]
+        self.resumeSleep(sleep, start_datetime.date())
+        if isinstance(sleep, VectorizedSleep) :
+            columns = self.client.getSleepColumns(start_datetime,
+                                                  separators[-1])
+            timestamps, present = sleep.measurementColumns(columns)
+            # The days are calculated one by one to keep the state of the
+            # engine at the end of each of them
+            ends = np.searchsorted(timestamps,
+                                   np.array(separators,
+                                            dtype='datetime64[us]'))
+            frames = []
+            begin = 0
+            for day, end in enumerate(ends) :
+                frames.append(sleep.computeSleepActivities(
+                    timestamps[begin:end], present[begin:end],
+                    np.array(separators[day:day + 1],
+                             dtype='datetime64[us]')))
+                self.checkpointSleep(sleep, separators[day].date())
+                begin = end
+        else :
+            frames = []
+            closing_event = Event(dt.datetime(dt.MINYEAR, 1, 1, 1, 0, 0), 
+                                  0, 0, 0)
+            events = self.client.getSleepEvents(start_datetime, 
+                                                separators[-1])
+            day_start = start_datetime
+            for day in range(days) :
+                for event in events.between(day_start, separators[day]) :
+                    self.client.mapping.changeDeviceState(event)
+                    feedback = sleep.computeSleepActivities(event)
+                    if not feedback.empty :
+                        frames.append(feedback)
+                frames.append(sleep.computeSleepActivities(closing_event))
+                self.checkpointSleep(sleep, separators[day].date())
+                day_start = separators[day]
+        sleep_df = self.withoutCachedDays(
+            self.concatFrames(frames, VectorizedSleep.columns), cached_days)
+        self.client.bufferSleepDataToCache(sleep_df)
+        return sleep_df
+
+    def resumeSleep(self, sleep, day):
+        """
+        Restores the state of the engine at the end of a day, if it was
+        stored and the engine does not hold it already.
+        @type sleep Sleep or VectorizedSleep
+        @param sleep the engine used to recognize the sleep activities.
+        @type day date
+        @param day the day preceding the ones to be calculated.
+        """
+        if self.checkpoint_day == day or self.checkpoint_range is None :
+            return
+        if self.sleep_checkpoints is None :
+            self.sleep_checkpoints = \
+             self.client.getSleepCheckpoints(*self.checkpoint_range)
+        if day in self.sleep_checkpoints :
+            sleep.setState(self.sleep_checkpoints[day])
+            self.checkpoint_day = day
+
+    def checkpointSleep(self, sleep, day):
+        """
+        Stores the state of the engine at the end of a day, so that the
+        following day can be calculated later without the previous ones.
+        @type sleep Sleep or VectorizedSleep
+        @param sleep the engine used to recognize the sleep activities.
+        @type day date
+        @param day the day just closed.
+        """
+        self.client.bufferSleepCheckpoint(day, sleep.getState())
+        self.checkpoint_day = day
 
     def sleepAverage(self, sleep_activities, daily=False):
         """
         Calculates the average giving an interval of days
+        The activities are summed for each day with grouped operations on
+        whole columns, then the means are taken over the days.
         @type sleep_activities: Dataframe
         @param sleep_activities: the data to be analyzed.
         @type daily: Boolean
-        @param daily: True to have, for each day, the summarize of sleep 
+        @param daily: True to have, for each day, the summarize of sleep
         activities. False, to have the summarize for the period.
         @rtype: Dataframe
         @return the dataframe containing a row with the averages.
@@ -157,312 +408,325 @@ class Analitics :
         columns = ['start_date', 'end_date', 'duration',
                    'count_micro_awakenings', 'time_micro_awakenings',
                    'count_awakenings', 'time_awakenings']
-        average = pd.DataFrame(columns=columns)
-        if not sleep_activities.empty:
-            start_date = None
-            end_date = None
-            current_date = 0
-    
-            amount_durations = 0
-            amount_count_micro_awakenings = 0
-            amount_time_micro_awakenings = 0
-            amount_count_awakenings = 0
-            amount_time_awakenings = 0
-            list_durations = []
-            list_count_micro_awakenings = []
-            list_time_micro_awakenings = []
-            list_count_awakenings = []            
-            list_time_awakenings = []
-    
-            # iterrows returns a couple (index, row) where index is the index
-            #  of the dataframe and row is the content of the current row.
-            # Even if index is not used, it is necessary to map it.
-            for _, row in sleep_activities.iterrows():
-                if current_date == 0:
-                    current_date = row['date']
-                    start_date = current_date
-                    end_date = current_date
-                    amount_durations = math.floor((row['end_datetime']
-                                                   - row['start_datetime'])
-                                                  .total_seconds())
-                    amount_count_micro_awakenings = \
-                     row['count_micro_awakenings']
-                    amount_time_micro_awakenings = \
-                     row['time_micro_awakenings']
-                    amount_count_awakenings = row['count_awakenings']
-                    amount_time_awakenings = row['time_awakenings']
-                else:
-                    if current_date == row['date']:
-                        amount_durations += \
-                         math.floor((row['end_datetime']
-                                     - row['start_datetime'])
-                                    .total_seconds())
-                        amount_count_micro_awakenings += \
-                         row['count_micro_awakenings']
-                        amount_time_micro_awakenings += \
-                         row['time_micro_awakenings']
-                        amount_count_awakenings += row['count_awakenings']
-                        amount_time_awakenings += row['time_awakenings']
-                    else:
-                        end_date = row['date']
-                        if amount_durations != 0:
-                            if(daily) :
-                                average.loc[len(average.index)] = \
-                                 np.array([current_date, current_date, 
-                                           amount_durations, 
-                                           amount_count_micro_awakenings,
-                                           amount_time_micro_awakenings,
-                                           amount_count_awakenings,
-                                           amount_time_awakenings])
-                            else :
-                                list_durations.append(
-                                    amount_durations)
-                                list_count_micro_awakenings.append(
-                                    amount_count_micro_awakenings)
-                                list_time_micro_awakenings.append(
-                                    amount_time_micro_awakenings)
-                                list_count_awakenings.append(
-                                    amount_count_awakenings)
-                                list_time_awakenings.append(
-                                    amount_time_awakenings)  
-                            current_date = row['date']
-                            amount_durations = \
-                             math.floor((row['end_datetime']
-                                         - row['start_datetime'])
-                                        .total_seconds())
-                            amount_count_micro_awakenings = \
-                             row['count_micro_awakenings']
-                            amount_time_micro_awakenings = \
-                             row['time_micro_awakenings']
-                            amount_count_awakenings = row['count_awakenings']
-                            amount_time_awakenings = row['time_awakenings']
-            if amount_durations != 0:
-                if(daily) :
-                    average.loc[len(average.index)] = \
-                    np.array([current_date, current_date, amount_durations,
-                              amount_count_micro_awakenings,
-                              amount_time_micro_awakenings,
-                              amount_count_awakenings, 
-                              amount_time_awakenings])
-                else :
-                    list_durations.append(amount_durations)
-                    list_count_micro_awakenings.append(
-                        amount_count_micro_awakenings)
-                    list_time_micro_awakenings.append(
-                        amount_time_micro_awakenings)
-                    list_count_awakenings.append(amount_count_awakenings)                    
-                    list_time_awakenings.append(amount_time_awakenings)
-                    
-                    average_durations = 0
-                    average_count_micro_awakenings = 0
-                    average_time_micro_awakenings = 0
-                    average_count_awakenings = 0
-                    average_time_awakenings = 0
-    
-                    if list_durations:
-                        average_durations = np.average(list_durations)
-                    if list_count_micro_awakenings:
-                        average_count_micro_awakenings = \
-                         np.average(list_count_micro_awakenings)
-                    if list_time_micro_awakenings:
-                        average_time_micro_awakenings = \
-                         np.average(list_time_micro_awakenings)
-                    if list_count_awakenings:
-                        average_count_awakenings = \
-                         np.average(list_count_awakenings)
-                    if list_time_awakenings:
-                        average_time_awakenings = \
-                         np.average(list_time_awakenings)    
-                    average.loc[len(average.index)] = \
-                        np.array([start_date, end_date, average_durations,
-                                  average_count_micro_awakenings, 
-                                  average_time_micro_awakenings,
-                                  average_count_awakenings, 
-                                  average_time_awakenings])
+        if sleep_activities.empty:
+            return pd.DataFrame(columns=columns)
+        dates = sleep_activities['date'].values
+        durations = np.floor(
+            (pd.to_datetime(sleep_activities['end_datetime'])
+             - pd.to_datetime(sleep_activities['start_datetime']))
+            .dt.total_seconds().values).astype(np.int64)
+        # The rows of a day are summed when they are consecutive
+        new_day = np.ones(len(dates), dtype=bool)
+        new_day[1:] = dates[1:] != dates[:-1]
+        day_starts = np.nonzero(new_day)[0]
+        day_of_row = np.cumsum(new_day) - 1
+        days, end_date = self.averagedDays(dates[day_starts],
+                                           np.add.reduceat(durations,
+                                                           day_starts))
+        groups = int(days.max()) + 1 if (days >= 0).any() else 0
+        group_of_row = days[day_of_row]
+        if groups == 0 \
+         or np.add.reduce(durations[group_of_row == groups - 1]) == 0:
+            # The last day is summarized only if it has a duration, and the
+            # period only if its last day is summarized
+            groups -= 1
+            if groups <= 0 or not daily:
+                return pd.DataFrame(columns=columns)
+        selected = (group_of_row >= 0) & (group_of_row < groups)
+        group_of_row = group_of_row[selected]
+        totals = [durations[selected]]
+        for column in columns[3:] :
+            totals.append(pd.to_numeric(sleep_activities[column]).values
+                          [selected])
+        # The values of each day are summed in the order of the rows
+        for i, values in enumerate(totals) :
+            summed = np.bincount(group_of_row, weights=values,
+                                 minlength=groups)
+            if np.issubdtype(values.dtype, np.integer) :
+                summed = summed.astype(np.int64)
+            totals[i] = summed
+        if daily :
+            # The date of a summarized day is the one of its first rows
+            labels, first_days = np.unique(days, return_index=True)
+            group_dates = dates[day_starts][first_days[labels >= 0][:groups]]
+            average = pd.DataFrame({'start_date': group_dates,
+                                    'end_date': group_dates},
+                                   columns=columns[:2])
+            for column, summed in zip(columns[2:], totals) :
+                average[column] = summed
+        else :
+            average = pd.DataFrame([[dates[0], end_date]
+                                    + [np.average(summed)
+                                       for summed in totals]],
+                                   columns=columns)
         return average
-    
+
+    def averagedDays(self, dates, durations):
+        """
+        Finds the days summarized by sleepAverage. A day whose activities
+        have no duration is not summarized and, as well as the following
+        days, it is not closed by the next day: the activities of the
+        following days are ignored except the ones of the same day.
+        @type dates: numpy array of date
+        @param dates: the day of each group of consecutive rows.
+        @type durations: numpy array of int
+        @param durations: the summed durations of each group of rows.
+        @rtype tuple
+        @return the index of the summarized day each group is added to (-1
+        if ignored) and the last day that closed a summarized day.
+        """
+        if (durations != 0).all() :
+            return np.arange(len(dates)), dates[-1]
+        days = np.full(len(dates), -1)
+        days[0] = 0
+        day = 0
+        current_date = dates[0]
+        end_date = dates[0]
+        amount_durations = durations[0]
+        for i in range(1, len(dates)) :
+            if dates[i] == current_date :
+                days[i] = day
+                amount_durations += durations[i]
+            else :
+                end_date = dates[i]
+                if amount_durations != 0 :
+                    day += 1
+                    days[i] = day
+                    current_date = dates[i]
+                    amount_durations = durations[i]
+        return days, end_date
+
+    def sleepAverageForDays(self, start_date, end_date):
+        """
+        Calculates the average of an interval of days, as sleepAverage does
+        with the sleep activities of the interval: there is no average if a
+        day has activities without duration.
+        The long intervals are summed from the sums of their weeks and 
+        months stored with the cache, calculating day by day only the days
+        at the edges and the weeks and months not entirely in the cache.
+        @type start_date date
+        @param start_date the starting date of the interval.
+        @type end_date date
+        @param end_date the ending date of the interval.
+        @rtype: Dataframe
+        @return the dataframe containing a row with the averages, as given
+        by sleepAverage.
+        """
+        columns = ['start_date', 'end_date'] + self.measures
+        if start_date is None or end_date is None :
+            return pd.DataFrame(columns=columns)
+        if (end_date - start_date).days + 1 < Configuration.ROLLUP_MIN_DAYS :
+            return self.sleepAverage(self.sleepActivities(self.sleep,
+                                                          start_date,
+                                                          end_date))
+        if isinstance(start_date, dt.datetime) :
+            start_date = start_date.date()
+        if isinstance(end_date, dt.datetime) :
+            end_date = end_date.date()
+        # The months, then the weeks, entirely in the interval with the 
+        # intervals of days between them, in time order
+        segments = [(start_date, end_date, None)]
+        for period in ('month', 'week') :
+            split = []
+            for first_day, last_day, rollup in segments :
+                if rollup is not None :
+                    split.append((first_day, last_day, rollup))
+                    continue
+                periods = self.rollupPeriods(period, first_day, last_day)
+                rollups = self.client.getSleepRollups(period, periods[0][0],
+                                                      periods[-1][0]) \
+                          if periods else {}
+                day = first_day
+                for period_start, period_end in periods :
+                    rollup = rollups.get(period_start)
+                    if rollup is None or rollup['cached_days'] \
+                     < (period_end - period_start).days + 1 :
+                        continue
+                    if day < period_start :
+                        split.append((day, period_start 
+                                      - dt.timedelta(days=1), None))
+                    split.append((period_start, period_end, rollup))
+                    day = period_end + dt.timedelta(days=1)
+                if day <= last_day :
+                    split.append((day, last_day, None))
+            segments = split
+        totals = np.zeros(len(self.measures))
+        days = 0
+        first_date = None
+        last_date = None
+        for first_day, last_day, rollup in segments :
+            if rollup is not None :
+                if rollup['days'] < rollup['cached_days'] :
+                    # A day of the period has no duration
+                    return pd.DataFrame(columns=columns)
+                totals += np.array([float(rollup[measure]) 
+                                    for measure in self.measures])
+                days += int(rollup['days'])
+                first_date = first_date or rollup['first_date']
+                last_date = rollup['last_date']
+                continue
+            sleep_activities = self.sleepActivities(self.sleep, first_day, 
+                                                    last_day)
+            length = (last_day - first_day).days + 1
+            features, summarized = self.dailyFeatures(sleep_activities,
+                                                      first_day, length)
+            present = np.zeros(length, dtype=bool)
+            if not sleep_activities.empty :
+                day_of_row = self.daysFrom(sleep_activities, first_day)
+                present[day_of_row[(day_of_row >= 0) 
+                                   & (day_of_row < length)]] = True
+            if (present & ~summarized).any() :
+                return pd.DataFrame(columns=columns)
+            present = np.nonzero(present)[0]
+            if len(present) == 0 :
+                continue
+            totals += features[present].sum(axis=0)
+            days += len(present)
+            first_date = first_date \
+                         or first_day + dt.timedelta(days=int(present[0]))
+            last_date = first_day + dt.timedelta(days=int(present[-1]))
+        if days == 0 :
+            return pd.DataFrame(columns=columns)
+        return pd.DataFrame([[first_date, last_date] + list(totals / days)],
+                            columns=columns)
+
+    def rollupPeriods(self, period, start_date, end_date):
+        """
+        Gets the weeks or months entirely contained in an interval of days.
+        @type period String
+        @param period 'week' or 'month'.
+        @type start_date date
+        @param start_date the starting date of the interval.
+        @type end_date date
+        @param end_date the ending date of the interval.
+        @rtype list of tuple
+        @return the first and last day of each period.
+        """
+        periods = []
+        period_start = self.client.periodStart(period, start_date)
+        if period_start < start_date :
+            period_start = self.client.nextPeriod(period, period_start)
+        while True :
+            period_end = self.client.nextPeriod(period, period_start) \
+                         - dt.timedelta(days=1)
+            if period_end > end_date :
+                return periods
+            periods.append((period_start, period_end))
+            period_start = period_end + dt.timedelta(days=1)
+
     def sleep_analysis(self, sleep_df, average_df):
         """
         Analyzes the sleep activities for each day of a certain interval and
         compares them with the average of a certain interval.
+        Each measure is compared on the whole column at once, the result has
+        a row for each day and measure that differs too much from the
+        average, in the order of the days.
         @type sleep_df: Dataframe
-        @param sleep_df: the dataframe containing the sleep activities to be 
+        @param sleep_df: the dataframe containing the sleep activities to be
             analyzed
         @type average_df: Dataframe
         @param average_df: the dataframe containing the average values
         @rtype Dataframe
-        @return the dataframe containing the result of the comparisons
-        """
-        columns = ['date', 'what', 'detected', 'average']
-        analysis = pd.DataFrame(columns=columns)
-        if not average_df.empty:
-            average_duration = float(average_df.loc[0]['duration'])
-            average_count_micro_awakenings = \
-             float(average_df.loc[0]['count_micro_awakenings'])
-            average_time_micro_awakenings = \
-             float(average_df.loc[0]['time_micro_awakenings'])
-            average_count_awakenings = \
-             float(average_df.loc[0]['count_awakenings'])
-            average_time_awakenings = \
-             float(average_df.loc[0]['time_awakenings'])
-    
-            # iterrows returns a couple (index, row) where index is the index of the
-            # dataframe and row is the content of the current row.
-            # Even if index is not used, it is necessary to map it.
-            for _, row in sleep_df.iterrows() :
-                if (row['end_datetime'] \
-                    - row['start_datetime']).total_seconds() \
-                    - average_duration \
-                 > average_duration * Configuration.DIFFERENCE_DURATION :                
-                    #print("Detected more abnormal sleep activity on " \
-                    #      + row['date'] \
-                    #      + ". Average: " + str(average_duration) \
-                    #      + " detected: " \
-                    #      + str((row['end_datetime'] \
-                    #             - row['start_datetime']).total_seconds()) \
-                    #      + " ( +" 
-                    #      + str((row['end_datetime'] \
-                    #             - row['start_datetime']).total_seconds() * 100 \
-                    #            / average_duration - 100) + "%).")
-                    analysis.loc[len(analysis.index)] = \
-                        np.array([row['date'], 'duration', 
-                                  (row['end_datetime'] 
-                                   - row['start_datetime']).total_seconds(), 
-                                  average_duration])
-                elif average_duration \
-                 - (row['end_datetime'] \
-                    - row['start_datetime']).total_seconds() \
-                 > average_duration * Configuration.DIFFERENCE_DURATION :
-                    ##print("Detected less abnormal sleep activity on " \
-                    #      + row['date'] \
-                    #      + ". Average: " + str(average_duration) \
-                    #      + " detected: " \
-                    #      +  str((row['end_datetime'] \
-                    #            - row['start_datetime']).total_seconds()) \
-                    #      )
-                    analysis.loc[len(analysis.index)] = \
-                        np.array([row['date'], 'duration', 
-                                  (row['end_datetime'] 
-                                   - row['start_datetime']).total_seconds(),
-                                  average_duration])
-                if row['count_micro_awakenings'] \
-                 - average_count_micro_awakenings \
-                 > average_count_micro_awakenings \
-                 * Configuration.DIFFERENCE_COUNT_MICRO_AWAKENING :
-                 
-                    #print("Detected more count micro awakenings activity on " +
-                    #      row['date'] +
-                    #      ". Average: " + str(average_count_micro_awakenings) +
-                    #      " detected: " + str(row['count_micro_awakenings']) +
-                    #      " ( +" + str(row['count_micro_awakenings'] * 100 /
-                    #                   average_count_micro_awakenings - 100) + "%).")
-                    analysis.loc[len(analysis.index)] = \
-                        np.array([row['date'], 
-                                  'count_micro_awakenings',
-                                  row['count_micro_awakenings'], 
-                                  average_count_micro_awakenings])
-                elif average_count_micro_awakenings \
-                 - row['count_micro_awakenings'] \
-                 > average_count_micro_awakenings \
-                 * Configuration.DIFFERENCE_COUNT_MICRO_AWAKENING :
-                    #print("Detected less abnormal count micro awakenings on " +
-                    #      row['date'] +
-                    #      ". Average: " + str(average_count_micro_awakenings) + " detected: "
-                    #      + str(row['count_micro_awakenings']) +
-                    #      " ( -" + str(100 - row['count_micro_awakenings'] *
-                    #                   100 / average_count_micro_awakenings) + "%).")
-                    analysis.loc[len(analysis.index)] = \
-                        np.array([row['date'], 
-                                  'count_micro_awakenings',
-                                  row['count_micro_awakenings'], 
-                                  average_count_micro_awakenings])
-                if row['time_micro_awakenings'] \
-                    - average_time_micro_awakenings \
-                 > average_time_micro_awakenings \
-                    * Configuration.DIFFERENCE_TIME_MICRO_AWAKENING :
-                    #print("Detected more time micro awakenings activity on " +
-                    #      row['date'] +
-                    #      ". Average: " + str(average_time_micro_awakenings) +
-                    #      " detected: " + str(row['time_micro_awakenings']) +
-                    #      " ( +" + str(row['time_micro_awakenings'] * 100 /
-                    #                   average_time_micro_awakenings - 100) + "%).")
-                    analysis.loc[len(analysis.index)] = \
-                        np.array([row['date'], 
-                                  'time_micro_awakenings',
-                                  row['time_micro_awakenings'], 
-                                  average_time_micro_awakenings])
-                elif average_time_micro_awakenings \
-                 - row['time_micro_awakenings'] \
-                 > average_time_micro_awakenings \
-                 * Configuration.DIFFERENCE_TIME_MICRO_AWAKENING :
-                    #print("Detected less abnormal time micro awakenings on " +
-                    #      row['date'] +
-                    #      ". Average: " + str(average_time_micro_awakenings) + " detected: "
-                    #      + str(row['time_micro_awakenings']) +
-                    #      " ( -" + str(100 - row['time_micro_awakenings'] *
-                    #                   100 / average_time_micro_awakenings) + "%).")
-                    analysis.loc[len(analysis.index)] = \
-                        np.array([row['date'], 
-                                  'time_micro_awakenings',
-                                  row['time_micro_awakenings'], 
-                                  average_time_micro_awakenings])
-                if row['count_awakenings'] - average_count_awakenings \
-                    > average_count_awakenings \
-                    * Configuration.DIFFERENCE_COUNT_AWAKENING :
-                    #print("Detected more count awakenings activity on " +
-                    #      row['date'] +
-                    #      ". Average: " + str(average_count_awakenings) +
-                    #      " detected: " + str(row['count_awakenings']) +
-                    #      " ( +" + str(row['count_awakenings'] * 100 /
-                    #                   average_count_awakenings - 100) + "%).")
-                    analysis.loc[len(analysis.index)] = \
-                        np.array([row['date'], 'count_awakenings', 
-                                  row['count_awakenings'], 
-                                  average_count_awakenings])
-                elif average_count_awakenings - row['count_awakenings'] \
-                 > average_count_awakenings \
-                 * Configuration.DIFFERENCE_COUNT_AWAKENING :
-                    #print("Detected less abnormal count awakenings on " +
-                    #      row['date'] +
-                    #      ". Average: " + str(average_count_awakenings) 
-                    # + " detected: " +
-                    #      str(row['count_awakenings']) +
-                    #      " ( -" + str(100 - row['count_awakenings'] *
-                    #                   100 / average_count_awakenings) + "%).")
-                    analysis.loc[len(analysis.index)] = \
-                        np.array([row['date'],
-                                  'count_awakenings', 
-                                  row['count_awakenings'],
-                                  average_count_awakenings])
-                if row['time_awakenings'] - average_time_awakenings \
-                 > average_time_awakenings \
-                 * Configuration.DIFFERENCE_TIME_AWAKENING :
-                    #print("Detected more time awakenings activity on " +
-                    #      row['date'] +
-                    #      ". Average: " + str(average_time_awakenings) +
-                    #      " detected: " + str(row['time_awakenings']) +
-                    #      " ( +" + str(row['time_awakenings'] * 100 /
-                    #                   average_time_awakenings - 100) + "%).")
-                    analysis.loc[len(analysis.index)] = \
-                        np.array([row['date'],
-                                  'time_awakenings', row['time_awakenings'],
-                                  average_time_awakenings])
-                elif average_time_awakenings - row['time_awakenings'] \
-                 > average_time_awakenings \
-                 * Configuration.DIFFERENCE_TIME_AWAKENING:                
-                    #print("Detected less abnormal count awakenings on " +
-                    #      row['date'] +
-                    #      ". Average: " + str(average_time_awakenings) + 
-                    #      " detected: " +
-                    #      str(row['time_awakenings']) +
-                    #      " ( -" + str(100 - row['time_awakenings'] *
-                    #                   100 / average_time_awakenings) + "%).")
-                    analysis.loc[len(analysis.index)] = \
-                        np.array([row['date'],
-                                   'time_awakenings', row['time_awakenings'],
-                                  average_time_awakenings])                    
-        return analysis
-    
+        @return the dataframe containing the result of the comparisons, with
+        the deviation from the average as a signed percentage.
+        """
+        columns = ['date', 'what', 'detected', 'average', 'deviation']
+        if average_df.empty or sleep_df.empty:
+            return pd.DataFrame(columns=columns)
+        averages = np.array([float(average_df.iloc[0][measure])
+                             for measure in self.measures])
+        # A row for each day and a column for each measure
+        detected = np.column_stack(
+            [(pd.to_datetime(sleep_df['end_datetime'])
+              - pd.to_datetime(sleep_df['start_datetime']))
+             .dt.total_seconds().values]
+            + [pd.to_numeric(sleep_df[measure]).values.astype(float)
+               for measure in self.measures[1:]])
+        return self.compareWithAverages(sleep_df['date'].values, detected,
+                                        averages)
+
+    def rolling_analysis(self, start_date, end_date, nights=None):
+        """
+        Analyzes the sleep activities for each night of a certain interval
+        and compares them with the average of the nights of the days before
+        it, so that the reference follows the changes of the habits.
+        The sums of the nights of the window are taken as differences of
+        running sums, so the cost does not depend on the size of the window.
+        @type start_date date
+        @param start_date the starting date of the interval.
+        @type end_date date
+        @param end_date the ending date of the interval.
+        @type nights int, None
+        @param nights the number of days before each night to average, None
+        for Configuration.ROLLING_NIGHTS.
+        @rtype Dataframe
+        @return the dataframe containing the result of the comparisons, as
+        given by sleep_analysis.
+        """
+        columns = ['date', 'what', 'detected', 'average', 'deviation']
+        if nights is None :
+            nights = Configuration.ROLLING_NIGHTS
+        if start_date is None or end_date is None or end_date < start_date \
+         or nights < 1 :
+            return pd.DataFrame(columns=columns)
+        first_day = start_date - dt.timedelta(days=nights)
+        days = (end_date - first_day).days + 1
+        features, summarized = self.dailyFeatures(
+            self.sleepActivities(self.sleep, first_day, end_date), first_day,
+            days)
+        sums = np.zeros((days + 1, len(self.measures)))
+        np.cumsum(features * summarized[:, None], axis=0, out=sums[1:])
+        counts = np.zeros(days + 1)
+        np.cumsum(summarized, out=counts[1:])
+        # The nights of the interval with at least a night in their window
+        current = np.arange(nights, days)
+        window_counts = counts[current] - counts[current - nights]
+        compared = summarized[current] & (window_counts > 0)
+        current = current[compared]
+        averages = (sums[current] - sums[current - nights]) \
+                   / window_counts[compared][:, None]
+        dates = np.array([first_day + dt.timedelta(days=int(day))
+                          for day in current], dtype=object)
+        return self.compareWithAverages(dates, features[current], averages)
+
+    def compareWithAverages(self, dates, detected, averages):
+        """
+        Compares the measures of the sleep activities with their averages,
+        using the Configuration.DIFFERENCE_* thresholds.
+        @type dates numpy array
+        @param dates the date of each row of detected.
+        @type detected numpy array
+        @param detected the (rows x measures) matrix of the measures.
+        @type averages numpy array
+        @param averages the averages of the measures, the same for all the
+        rows or a (rows x measures) matrix.
+        @rtype Dataframe
+        @return the dataframe with a row for each date and measure that
+        differs too much from the average, in the order of the rows, with
+        the deviation from the average as a signed percentage.
+        """
+        columns = ['date', 'what', 'detected', 'average', 'deviation']
+        differences = np.array([Configuration.DIFFERENCE_DURATION,
+                                Configuration.DIFFERENCE_COUNT_MICRO_AWAKENING,
+                                Configuration.DIFFERENCE_TIME_MICRO_AWAKENING,
+                                Configuration.DIFFERENCE_COUNT_AWAKENING,
+                                Configuration.DIFFERENCE_TIME_AWAKENING])
+        averages = np.broadcast_to(averages, detected.shape)
+        tolerances = averages * differences
+        abnormal = (detected - averages > tolerances) \
+                   | (averages - detected > tolerances)
+        rows, what = np.nonzero(abnormal)
+        with np.errstate(divide='ignore', invalid='ignore') :
+            deviations = np.where(averages == 0, np.nan,
+                                  (detected - averages) * 100 / averages)
+        return pd.DataFrame(
+            {'date': dates[rows],
+             'what': np.array(self.measures, dtype=object)[what],
+             'detected': detected[rows, what],
+             'average': averages[rows, what],
+             'deviation': deviations[rows, what]},
+            columns=columns)
+
     def cosine_for_days(self, day_1, day_2, param_1, param_2):
         """
         Calculates the cosine distance of the sleep activities between two 
@@ -488,243 +752,502 @@ class Analitics :
         it indicates the starting date of the second period to compare. 
         @type param_2 date, None
         @param it indicates the the ending date of the second period to 
-        compare.          
+        compare.
+        The sleep activities of the compared days are taken at once and
+        each day by day comparison is a row of the same matrix.
         """
         columns = ['start_date_1', 'end_date_1', \
                    'start_date_2', 'end_date_2', 'similarity']
-        similarity = pd.DataFrame(columns=columns) 
-        if day_1 != None and day_2 != None :
-            if param_1 == None :
-                param_1 = day_2
-                param_2 = day_2
-                day_2 = day_1
-                loop_for_days = 1
+        if day_1 is None or day_2 is None :
+            return pd.DataFrame(columns=columns)
+        if param_1 is None :
+            param_1 = day_2
+            param_2 = day_2
+            day_2 = day_1
+            loop_for_days = 1
+        elif param_2 is None :
+            loop_for_days = param_1
+            param_1 = day_2
+            param_2 = day_2
+            day_2 = day_1
+        else :
+            loop_for_days = 1
+        if loop_for_days < 1 :
+            return pd.DataFrame(columns=columns)
+        last_day = dt.timedelta(days=loop_for_days - 1)
+        loaded = self.sleepActivitiesForRanges(
+            [(day_1, day_2 + last_day), (param_1, param_2 + last_day)])
+        if day_1 == day_2 and param_1 == param_2 :
+            # Day by day: a row of features for each day of both periods
+            first_day = min(day_1, param_1)
+            features = np.zeros(((max(day_1, param_1) - first_day).days
+                                 + loop_for_days, len(self.measures)))
+            summarized = np.zeros(len(features), dtype=bool)
+            for start_date, end_date, sleep_activities in loaded :
+                begin = (start_date - first_day).days
+                end = (end_date - first_day).days + 1
+                features[begin:end], summarized[begin:end] = \
+                 self.dailyFeatures(sleep_activities, start_date, end - begin)
+            days_1 = np.arange(loop_for_days) + (day_1 - first_day).days
+            days_2 = np.arange(loop_for_days) + (param_1 - first_day).days
+            compared = summarized[days_1] & summarized[days_2]
+            similarities = self.cosineSimilarities(
+                features[days_1[compared]], features[days_2[compared]])
+            offsets = [dt.timedelta(days=int(i))
+                       for i in np.nonzero(compared)[0]]
+        else :
+            # Intervals: the averages of the two periods
+            vectors = []
+            for start_date, end_date in ((day_1, day_2),
+                                         (param_1, param_2)) :
+                for loaded_start, loaded_end, sleep_activities in loaded :
+                    if loaded_start <= start_date <= loaded_end :
+                        break
+                days = self.daysFrom(sleep_activities, start_date)
+                average = self.sleepAverage(sleep_activities[
+                    (days >= 0) & (days <= (end_date - start_date).days)])
+                if not average.empty :
+                    vectors.append(average.loc[0, self.measures]
+                                   .values.astype(float))
+            if len(vectors) < 2 :
+                return pd.DataFrame(columns=columns)
+            similarities = self.cosineSimilarities(np.array(vectors[:1]),
+                                                   np.array(vectors[1:]))
+            offsets = [dt.timedelta(0)]
+        return pd.DataFrame(
+            {'start_date_1': [day_1 + offset for offset in offsets],
+             'end_date_1': [day_2 + offset for offset in offsets],
+             'start_date_2': [param_1 + offset for offset in offsets],
+             'end_date_2': [param_2 + offset for offset in offsets],
+             'similarity': similarities},
+            columns=columns)
+
+    def cosine_matrix(self, start_date, end_date, top_k=None):
+        """
+        Calculates the cosine similarity between every couple of nights of an
+        interval of days, each night summarized with the same measures of
+        cosine_for_days. The similarities are calculated for blocks of
+        nights, so that a long interval does not need the whole matrix at
+        once when only the most similar nights are requested.
+        @type start_date date
+        @param start_date the starting date of the interval.
+        @type end_date date
+        @param end_date the ending date of the interval.
+        @type top_k int, None
+        @param top_k the number of the most similar nights to return for
+        each night, None to return all the couples of nights.
+        @rtype Dataframe
+        @return the dataframe with a row for each couple of nights; with
+        top_k, the nights other than the first one, sorted from the most
+        similar, and their rank.
+        """
+        columns = ['date_1', 'date_2', 'similarity']
+        if top_k is not None :
+            columns.append('rank')
+        if start_date is None or end_date is None or end_date < start_date :
+            return pd.DataFrame(columns=columns)
+        features, summarized = self.dailyFeatures(
+            self.sleepActivities(self.sleep, start_date, end_date),
+            start_date, (end_date - start_date).days + 1)
+        nights = np.nonzero(summarized)[0]
+        vectors = features[nights]
+        vectors /= np.sqrt(np.einsum('ij,ij->i', vectors, vectors))[:, None]
+        count = len(nights)
+        if top_k is not None :
+            top_k = min(top_k, count - 1)
+            if top_k <= 0 :
+                return pd.DataFrame(columns=columns)
+        nights_1, nights_2, similarities = [], [], []
+        for begin in range(0, count, Configuration.SIMILARITY_BLOCK_SIZE) :
+            end = min(begin + Configuration.SIMILARITY_BLOCK_SIZE, count)
+            block = np.dot(vectors[begin:end], vectors.T)
+            rows = np.arange(end - begin)[:, None]
+            if top_k is None :
+                nights_1.append(np.repeat(np.arange(begin, end), count))
+                nights_2.append(np.tile(np.arange(count), end - begin))
+                similarities.append(block.ravel())
             else :
-                if param_2 == None :
-                    loop_for_days = param_1
-                    param_1 = day_2
-                    param_2 =day_2
-                    day_2 = day_1
-                else :
-                    loop_for_days = 1
-            for i in range (0, loop_for_days) :
-                array_average_1 = []
-                array_average_2 = []   
-                sleep_activities_1 = \
-                 self.sleepActivities(self.sleep,
-                  day_1 + dt.timedelta(days=i),
-                  day_2 + dt.timedelta(days=i))
-                average_1 = self.sleepAverage(sleep_activities_1)
-                if not average_1.empty :
-                    array_average_1 = \
-                        np.array(average_1.loc[0, ['duration', 
-                                                   'count_micro_awakenings',
-                                                   'time_micro_awakenings',
-                                                   'count_awakenings', 
-                                                   'time_awakenings']])
-                sleep_activities_2 = \
-                 self.sleepActivities(self.sleep,
-                  param_1 + dt.timedelta(days=i),
-                  param_2 + dt.timedelta(days=i))
-                average_2 = self.sleepAverage(sleep_activities_2)
-                if not average_2.empty :
-                    array_average_2 = \
-                        np.array(average_2.loc[0, ['duration', 
-                                                   'count_micro_awakenings',
-                                                   'time_micro_awakenings',
-                                                   'count_awakenings', 
-                                                   'time_awakenings']])
-                if len(array_average_1) != 0 and len(array_average_2) != 0 : 
-                    similarity_tmp = \
-                     self.cosine_similarity(array_average_1, array_average_2)
-                    similarity.loc[len(similarity.index)] = \
-                     np.array(
-                        [(day_1 + dt.timedelta(days=i)),
-                         (day_2 + dt.timedelta(days=i)),
-                         (param_1 + dt.timedelta(days=i)),
-                         (param_2 + dt.timedelta(days=i)),                         
-                              similarity_tmp.loc[0]['similarity']])      
-        return similarity
-    
+                # A night is not compared with itself
+                block[rows[:, 0], np.arange(begin, end)] = -np.inf
+                best = np.argpartition(-block, top_k - 1, axis=1)[:, :top_k]
+                best = best[rows, np.argsort(-block[rows, best], axis=1,
+                                             kind='mergesort')]
+                nights_1.append(np.repeat(np.arange(begin, end), top_k))
+                nights_2.append(best.ravel())
+                similarities.append(block[rows, best].ravel())
+        dates = np.array([start_date + dt.timedelta(days=int(night))
+                          for night in nights], dtype=object)
+        matrix = pd.DataFrame(columns=columns)
+        if count :
+            matrix = pd.DataFrame(
+                {'date_1': dates[np.concatenate(nights_1)],
+                 'date_2': dates[np.concatenate(nights_2)],
+                 'similarity': np.concatenate(similarities)},
+                columns=columns[:3])
+            if top_k is not None :
+                matrix['rank'] = np.tile(np.arange(1, top_k + 1), count)
+        return matrix
+
+    def cohort_similarity(self, start_date, end_date, user_ids=None,
+                          top_k=None):
+        """
+        Compares the average sleep of the user in a period with the recent
+        average sleep of the users of a cohort, read from the index of the
+        vectors kept by refreshCohortVector.
+        @type start_date date
+        @param start_date the starting date of the period of the user.
+        @type end_date date
+        @param end_date the ending date of the period of the user.
+        @type user_ids list of String, None
+        @param user_ids the users of the cohort, None for all the users in
+        the index.
+        @type top_k int, None
+        @param top_k the number of the most similar users to return, None
+        for Configuration.COHORT_TOP_K.
+        @rtype Dataframe
+        @return the dataframe with the most similar users, from the most
+        similar, with the period of their averages.
+        """
+        columns = ['user_id', 'similarity', 'start_date', 'end_date', 'rank']
+        if top_k is None :
+            top_k = Configuration.COHORT_TOP_K
+        average = self.sleepAverage(self.sleepActivities(self.sleep,
+                                                         start_date,
+                                                         end_date))
+        if average.empty :
+            return pd.DataFrame(columns=columns)
+        index = self.client.getCohortIndex()
+        similar = index.search(average.loc[0, self.measures].values
+                               .astype(float), user_ids, top_k,
+                               self.client.user_id)
+        rows = []
+        for rank, (user_id, similarity) in enumerate(similar, 1) :
+            vector = index.get(user_id)
+            rows.append([user_id, similarity, vector[0], vector[1], rank])
+        return pd.DataFrame(rows, columns=columns)
+
+    def refreshCohortVector(self, end_date):
+        """
+        Updates the vector of the user compared by cohort_similarity with
+        the average of the Configuration.COHORT_DAYS days ending at a day.
+        @type end_date date
+        @param end_date the last day to average.
+        """
+        start_date = end_date - dt.timedelta(days=Configuration.COHORT_DAYS
+                                             - 1)
+        average = self.sleepAverage(self.sleepActivities(self.createSleep(),
+                                                         start_date,
+                                                         end_date))
+        if not average.empty :
+            self.client.updateCohortVector(start_date, end_date,
+                                           average.loc[0, self.measures]
+                                           .values.astype(float))
+
+    def sleepActivitiesForRanges(self, ranges):
+        """
+        Takes the sleep activities of some intervals of days, taking once the
+        days in more intervals.
+        @type ranges list of tuple
+        @param ranges the starting and ending dates of the intervals.
+        @rtype list of tuple
+        @return the starting date, the ending date and the sleep activities
+        of each interval of days taken, without overlaps and sorted by day.
+        """
+        merged = []
+        for start_date, end_date in sorted(ranges) :
+            if merged and start_date <= merged[-1][1] + dt.timedelta(days=1) :
+                merged[-1][1] = max(merged[-1][1], end_date)
+            else :
+                merged.append([start_date, end_date])
+        return [(start_date, end_date,
+                 self.sleepActivities(self.sleep, start_date, end_date))
+                for start_date, end_date in merged]
+
+    def dailyFeatures(self, sleep_activities, start_date, days):
+        """
+        Summarizes each day of an interval as a vector of measures, the same
+        taken by sleepAverage for a single day.
+        @type sleep_activities dataframe
+        @param sleep_activities the sleep activities of the days.
+        @type start_date date
+        @param start_date the first day of the interval.
+        @type days int
+        @param days the number of days of the interval.
+        @rtype tuple
+        @return the (days x measures) matrix and, for each day, if it is
+        summarized, that is if its activities have a duration.
+        """
+        features = np.zeros((days, len(self.measures)))
+        if sleep_activities.empty :
+            return features, np.zeros(days, dtype=bool)
+        day_of_row = self.daysFrom(sleep_activities, start_date)
+        selected = (day_of_row >= 0) & (day_of_row < days)
+        day_of_row = day_of_row[selected]
+        durations = np.floor(
+            (pd.to_datetime(sleep_activities['end_datetime'])
+             - pd.to_datetime(sleep_activities['start_datetime']))
+            .dt.total_seconds().values)[selected]
+        features[:, 0] = np.bincount(day_of_row, weights=durations,
+                                     minlength=days)
+        for i, measure in enumerate(self.measures[1:], 1) :
+            features[:, i] = np.bincount(
+                day_of_row,
+                weights=pd.to_numeric(sleep_activities[measure])
+                        .values[selected].astype(float),
+                minlength=days)
+        return features, features[:, 0] != 0
+
+    def daysFrom(self, sleep_activities, start_date):
+        """
+        Gets the day of the sleep activities as a number of days.
+        @type sleep_activities dataframe
+        @param sleep_activities the sleep activities.
+        @type start_date date
+        @param start_date the day numbered 0.
+        @rtype numpy array
+        @return the number of days from start_date of each row.
+        """
+        return (pd.to_datetime(sleep_activities['date']).values
+                .astype('datetime64[D]')
+                - np.datetime64(start_date, 'D')).astype(np.int64)
+
+    def cosineSimilarities(self, vectors_1, vectors_2):
+        """
+        Calculates the cosine similarity between the rows of two matrices,
+        (v1 dot v2)/(||v1||*||v2||) for each couple of rows.
+        @type vectors_1 numpy array
+        @param vectors_1 the (n x measures) matrix of the first vectors.
+        @type vectors_2 numpy array
+        @param vectors_2 the (n x measures) matrix of the second vectors.
+        @rtype numpy array
+        @return the n similarities.
+        """
+        vectors_1 = np.asarray(vectors_1, dtype=float)
+        vectors_2 = np.asarray(vectors_2, dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore') :
+            return np.einsum('ij,ij->i', vectors_1, vectors_2) \
+                   / np.sqrt(np.einsum('ij,ij->i', vectors_1, vectors_1)
+                             * np.einsum('ij,ij->i', vectors_2, vectors_2))
+
     def cosine_similarity(self, v1, v2):
-        columns = ['similarity']
-        similarity = pd.DataFrame(columns=columns)
         "compute cosine similarity of v1 to v2: (v1 dot v2)/{||v1||*||v2||)"
-        sumxx, sumxy, sumyy = 0, 0, 0
-        for i in range(len(v1)):
-            x = float(v1[i]); y = float(v2[i])
-            sumxx += x*x
-            sumyy += y*y
-            sumxy += x*y
-        similarity.loc[len(similarity.index)] = \
-                    np.array([sumxy/math.sqrt(sumxx*sumyy)])  
-        return similarity
+        return pd.DataFrame({'similarity': self.cosineSimilarities([v1],
+                                                                   [v2])},
+                            columns=['similarity'])
     
-    def plot(self, start_date, end_date) :
+    def timeline(self, start_date, end_date) :
         """
-        Takes and calculates the sleep activities for an interval of days.
+        Gets the states of the devices for an interval of days as intervals
+        of time: an interval for each change of the value of a state of a
+        device, lasting until the next change of the same state (or the end
+        of the time interval). The intervals of a state start from its first
+        change in the time interval, so their number is the number of the
+        changes, whatever the length of the time interval.
         @type start_date date
         @param start_date the starting date of the time interval.
         @type end_date date
         @param end_date the ending date of the time interval.
         @rtype dataframe
-        @return the dataframe containing for each day the data related the 
-        sleeping activities.
+        @return the dataframe containing for each interval the device, the
+        state, the beginning, the end and the value, ordered by state and
+        time.
+        """
+        columns = ['device', 'state', 'start_datetime', 'end_datetime', 
+                   'value']
+        start_datetime = dt.datetime.combine(start_date, 
+                                             dt.datetime.min.time())
+        end_datetime = dt.datetime.combine(end_date, dt.datetime.min.time()) \
+                       + dt.timedelta(days=1)
+        measurements = self.client.getSleepColumns(start_datetime, 
+                                                   end_datetime)
+        if len(measurements) == 0 :
+            return pd.DataFrame(columns=columns)
+        decoder = measurements.decoder
+        timeline_of_change, _ = self.stateTimelines(measurements)
+        # The measurements of each timeline in time order, where the value
+        # is the one of the measurement before are not changes
+        order = np.argsort(timeline_of_change, kind='stable')
+        timelines = timeline_of_change[order]
+        values = measurements.values[order]
+        changed = np.ones(len(order), dtype=bool)
+        changed[1:] = (timelines[1:] != timelines[:-1]) \
+                      | (values[1:] != values[:-1])
+        changes = order[changed]
+        timelines = timelines[changed]
+        starts = measurements.timestamps[changes]
+        ends = np.empty_like(starts)
+        ends[:-1] = starts[1:]
+        last_changes = np.ones(len(changes), dtype=bool)
+        last_changes[:-1] = timelines[1:] != timelines[:-1]
+        ends[last_changes] = decoder.toSeconds(end_datetime)
+        names = [getattr(name, 'name', name) for name in decoder.state_names]
+        value_names = [getattr(value, 'name', value) 
+                       for value in decoder.value_table]
+        return pd.DataFrame(
+            {'device': np.array(decoder.device_ids, dtype=object)[
+                 measurements.devices[changes]],
+             'state': np.array(names, dtype=object)[
+                 measurements.states[changes]],
+             'start_datetime': starts.astype('datetime64[s]'),
+             'end_datetime': ends.astype('datetime64[s]'),
+             'value': np.array(value_names, dtype=object)[
+                 measurements.values[changes]]}, columns=columns)
+
+    def plot(self, start_date, end_date, image_format=None, hour=None) :
+        """
+        Plots the states of the devices for an interval of days, with an
+        image for each hour.
+        @type start_date date
+        @param start_date the starting date of the time interval.
+        @type end_date date
+        @param end_date the ending date of the time interval.
+        @type image_format String
+        @param image_format the format of the images, 'png' (if None) or
+        'svg'.
+        @type hour datetime
+        @param hour the beginning of the only hour to plot, None to plot all
+        the hours.
+        @rtype tuple
+        @return the mime type and the bytes of the image of the hour or of a
+        zip archive with the images of all the hours.
         """
 
         start_datetime = dt.datetime.combine(start_date, dt.datetime.min.time())                              
         end_datetime = dt.datetime.combine(end_date, dt.datetime.max.time())  
 
-        # Gets the interesting Events from data source.
-        db_dataframe = \
-            self.client.getSleepEvents(start_datetime, 
-                                       end_datetime)
-            
-        #for event in db_dataframe :
-        #    if event.getNameId() == DeviceStateName.PRESENCE :
-        #        event.prettyPrint()
-            
-        # To store the devices that have generated the data to be displayed
-        devices = {}
-        for event in db_dataframe :
-            # The MINYEAR event is to signal the start end end of interesting
-            # data
-            if event.getDatetime().year != dt.MINYEAR :
-                # Fills the structure of the available devices.
-                # Each device contains a dict of detected changed states with
-                # a dataframe that contains pairs of datetime and value.
-                if not event.getDeviceId() in devices :
-                    devices[event.getDeviceId()] = {}
-                if not event.getNameId() in devices[event.getDeviceId()] :
-                    columns = ['datetime', 'value']
-                    devices[event.getDeviceId()][event.getNameId()] = \
-                     pd.DataFrame(columns=columns)
-                devices[event.getDeviceId()][event.getNameId()] \
-                 .loc[len(devices[event.getDeviceId()][event.getNameId()])] = \
-                 [event.getDatetime(), event.getValueId()]
-               
-        time_range = pd.date_range(start_datetime, end_datetime, freq='min')
-        columns=[]
-    
-        for device_id, states in devices.items() :
-            for state_id, df_state in states.items() :
-                columns.append(device_id + "-" + str(state_id))
+        # Gets the interesting measurements from data source.
+        columns = self.client.getSleepColumns(start_datetime, end_datetime)
+        dest = self.deviceTimelines(columns, start_datetime, end_datetime)
+        return self.createPlots(start_datetime, end_datetime, dest,
+                                image_format or 'png', hour)
 
-        dest = pd.DataFrame(index=time_range, columns=columns)
+    def deviceTimelines(self, columns, start_datetime, end_datetime):
+        """
+        Builds the dataframe of the states of the devices for each minute of
+        a time interval.
+        The dataframe has:
+          * as index: a time series that generates the measuring of time with
+            a frequencies of a minute;
+          * as columns: a column for each state of a device that changed in
+            the interval, named with the device and the state, in the order
+            of the first changes of the devices and of their states.
+        Each column is a step function valued 1 when the device is active
+        (present, open, ...) and 0 otherwise: the value of a change is valid
+        from the minute of the change until the minute of the next one and,
+        before the first change, the device is supposed to be in the other
+        state. When a state changes more times in a minute, the last change
+        is taken.
+        The changes of all the devices are placed in the minutes with a 
+        binary search and held until the next ones by a single forward fill.
+        @type columns MeasurementColumns
+        @param columns the measurements of the interval.
+        @type start_datetime datetime
+        @param start_datetime the beginning of the interval.
+        @type end_datetime datetime
+        @param end_datetime the end of the interval.
+        @rtype dataframe
+        @return the states of the devices for each minute.
+        """
+        time_range = pd.date_range(start_datetime, end_datetime, freq='min')
+        decoder = columns.decoder
+        timeline_of_change, first_changes = self.stateTimelines(columns)
+        names = [decoder.device_ids[columns.devices[i]] + "-" 
+                 + str(decoder.state_names[columns.states[i]])
+                 for i in first_changes]
+        active = np.array([value not in self.inactive_values 
+                           for value in decoder.value_table], 
+                          dtype=float)[columns.values]
+        # The minute of each change, keeping the last change of a timeline
+        # in a minute
+        minutes = np.searchsorted(time_range.values, 
+                                  columns.datetimes('ns'), side='right') - 1
+        changes = minutes * len(names) + timeline_of_change
+        _, last_changes = np.unique(changes[::-1], return_index=True)
+        last_changes = len(changes) - 1 - last_changes
+        steps = np.full((len(time_range), len(names)), np.nan)
+        steps[minutes[last_changes], timeline_of_change[last_changes]] = \
+         active[last_changes]
+        dest = pd.DataFrame(steps, index=time_range, columns=names).ffill()
+        dest = dest.fillna(pd.Series(1 - active[first_changes], 
+                                     index=names)).astype(int)
         dest.index.name = 'datetime'
-        dest = dest.fillna(0)
-
-        for device_id, states in devices.items() :
-            for state_id, df_state in states.items() :
-                self.fill_dataframe(df_state, dest, device_id + "-" + str(state_id))
-        self.createPlots(start_datetime, end_datetime, dest)
-        columns = ['result']
-        result = pd.DataFrame(columns=columns)
-        result.append("Plots created")
-        return result
-
-    def fill_dataframe(self, source, dest, column_name):
-        """
-        Fills the dataframe (dest) that have to contain the read value of
-        sensors, with data coming from the dataframe that contains the 
-        information (source).
-        The dest dataframe is created using:
-          * as index: a time series that generates the measuring of time with a 
-            frequencies of a minute;
-          * as name of columns: the names of the data of interest.
-        The source dataframe is iterated and it is read each row.
-        Each row represents the change of the state of a sensor. In each row is
-        indicated the timestamp of the event and the new value related the change 
-        of state.
-        From a point of view to plot data, the timestamp read in the current row 
-        indicates:
-          * the time until the value read in the previous row is valid;
-          * the time from which the value read in the current row is valid.
-        This means that to obtain a range of time of validity of a value, it is 
-        mandatory to read two rows and the correct value for that range is in 
-        the first one. 
-        The procedure must be invoked for each sensor of interest.
-        @param source the source of the data.
-        @param dest the destination of the data.
-        @param column_name the name of the column where data have to be stored.
-        """
-        current_value = None
-        start_datetime = None
-        # Loop each row in the source dataframe
-        #print(source)
-        for _, row in source.iterrows():
-            current_datetime = row['datetime']
-            readed_value = row['value']
-            if (readed_value == DeviceStateValue.INACTIVE) \
-             or (readed_value == DeviceStateValue.CLOSED) \
-             or (readed_value == DeviceStateValue.NOT_PRESENT) \
-             or (readed_value == DeviceStateValue.NOT_IDENTIFIED) \
-             or (readed_value == DeviceStateValue.DISCONNECTED) \
-             or (readed_value == DeviceStateValue.LOW) :
-                event_value = 0
-            else :
-                event_value = 1
- 
-            # First line of the source
-            if current_value == None :
-                current_datetime = current_datetime.replace(second=0, microsecond=0)
-                # Supposes that values can be 0 or 1. 
-                # If a value is changed, it is supposed that before the value was
-                # not the current value read
-                if event_value == 0 :
-                    current_value = 1
-                else :
-                    current_value = 0
-                dest.loc[:current_datetime, column_name] = current_value
-                print("Modifying " + column_name + " to " + 
-                    current_datetime.strftime('%Y-%m-%d %H:%M:%S') + 
-                      " with value " + str(current_value))
-                # Takes the value read in the row for the next iteration            
-                current_value = readed_value
-                # 
-                start_datetime = current_datetime
-            else :
-                current_datetime = current_datetime.replace(second=0, microsecond=0)
-                dest.loc[start_datetime:current_datetime,column_name] = current_value
-                print("Modifying " + column_name + " from " + 
-                          start_datetime.strftime('%Y-%m-%d %H:%M:%S') + 
-                          " to " + current_datetime.strftime('%Y-%m-%d %H:%M:%S') + 
-                          " with value " + str(current_value))
-                current_value = event_value
-                start_datetime = current_datetime
-        # If no more rows are available, it can be supposed that last read value
-        # is valid until the rest of the period of interest        
-        if (current_value != None) & (start_datetime != None) :
-            dest.loc[start_datetime:,column_name] = current_value
-            print("Modifying " + column_name + " from " + 
-                start_datetime.strftime('%Y-%m-%d %H:%M:%S') +  
-                " with value " + str(current_value))
+        return dest
+
+    def stateTimelines(self, columns):
+        """
+        Finds the timelines of the measurements: a timeline for each pair of
+        device and state, ordered by the first change of the device and
+        then by the first change of the state.
+        @type columns MeasurementColumns
+        @param columns the measurements.
+        @rtype tuple
+        @return the timeline of each measurement and the first measurement
+        of each timeline.
+        """
+        pairs = columns.devices.astype(np.int64) \
+                * len(columns.decoder.state_names) + columns.states
+        _, first_changes, timeline_of_change = \
+         np.unique(pairs, return_index=True, return_inverse=True)
+        device_ids, first_devices = np.unique(columns.devices, 
+                                              return_index=True)
+        device_first_changes = first_devices[
+            np.searchsorted(device_ids, columns.devices[first_changes])]
+        order = np.lexsort((first_changes, device_first_changes))
+        return np.argsort(order)[timeline_of_change], first_changes[order]
                 
-                        
-    def createPlots(self, start_date, end_date, result_df)  :
-        # Creates a different plot for each hour of activity
-        time_ranges = pd.date_range(start_date, end_date, freq='H')
-    
-        i = 0
-        while(i < time_ranges.size - 1) :
-            if i == 0 :
-                start = time_ranges[i]
-                i = i + 1;
-                end = time_ranges[i]
-            else :
-                start = end
-                i = i + 1
-                end = time_ranges[i]
-            print("Creating dataframe from " + 
-              start.strftime('%Y-%m-%d %H:%M:%S') + " to " + 
-              end.strftime('%Y-%m-%d %H:%M:%S'))
-            fig = result_df[start:end].plot.bar(subplots=True, figsize=(20, 20))
-            #plt.show()
-            plt.savefig("../data_plots/devices_" + 
-                    start.strftime('%Y-%m-%d_%H:%M:%S') + ".png")
-            # Free memory for the current plot
-            plt.close()
-            gc.collect()                         
-                    
-                    
-                            
\ No newline at end of file
+    def createPlots(self, start_date, end_date, result_df, 
+                    image_format='png', hour=None) :
+        """
+        Renders a bar chart of the states of the devices for each hour of
+        activity, in memory.
+        @type start_date datetime
+        @param start_date the beginning of the plotted interval.
+        @type end_date datetime
+        @param end_date the end of the plotted interval.
+        @type result_df dataframe
+        @param result_df the states of the devices for each minute.
+        @type image_format String
+        @param image_format the format of the images, 'png' or 'svg'.
+        @type hour datetime
+        @param hour the beginning of the hour to render, None for all the
+        hours.
+        @rtype tuple
+        @return the mime type and the bytes of the image of the hour or, 
+        for all the hours, of a zip archive with an image for each hour.
+        @raise PlotException when the hour cannot be rendered.
+        """
+        renderer = self.getPlotRenderer()
+        if len(result_df.columns) == 0 :
+            panels = []
+        else :
+            panels = renderer.panels(result_df, start_date, end_date)
+        if hour is not None :
+            panels = [(start, panel) for start, panel in panels 
+                      if start == hour]
+            if not panels :
+                raise PlotException('{"ERROR": "No states of devices to '
+                                    + 'plot at ' 
+                                    + hour.strftime('%Y-%m-%dT%H') + '."}')
+        images = renderer.render([panel for _, panel in panels], 
+                                 image_format)
+        if hour is not None :
+            return (FORMATS[image_format], images[0])
+        names = ["devices_" + start.strftime('%Y-%m-%d_%H-%M-%S') 
+                 for start, _ in panels]
+        return ('application/zip', 
+                renderer.archive(names, images, image_format))
+
+    @classmethod
+    def getPlotRenderer(cls) :
+        """
+        Gets the renderer of the plots, creating it the first time.
+        @rtype PlotRenderer
+        @return the renderer shared by all the instances.
+        """
+        with cls.plot_renderer_lock :
+            if cls.plot_renderer is None :
+                cls.plot_renderer = PlotRenderer(
+                    Configuration.PLOT_WORKERS, 
+                    Configuration.PLOT_CACHE_SIZE,
+                    Configuration.PLOT_CACHE_BYTES)
+        return cls.plot_renderer
@@ -0,0 +1,222 @@
+"""
+Copyright 2018 Dario Russo <dario.russo@isti.cnr.it>
+
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+"""
+In-process caches shared by the requests.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+class LRUCache :
+    """
+    A cache with a maximum number of entries. When it is full, the least
+    recently used entry is evicted. Entries can expire after a time to live.
+    Hits and misses are counted to measure the effectiveness of the cache.
+    """
+
+    def __init__(self, max_entries=1000, ttl=None) :
+        """
+        Creates an instance of the class.
+        @type max_entries: int
+        @param max_entries: the maximum number of entries.
+        @type ttl: int
+        @param ttl: the seconds an entry is valid, None to never expire.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # The values with their expiration time
+        self.entries = OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0,
+                      'invalidations': 0}
+
+    def get(self, key, default=None) :
+        """
+        Gets the value of a key.
+        @type key: hashable
+        @param key: the key of the value.
+        @type default: object
+        @param default: the value returned if the key is not cached.
+        @rtype object
+        @return the cached value, default if not found or expired.
+        """
+        with self.lock :
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] is not None \
+             and entry[1] < time.time() :
+                self.remove(key)
+                self.stats['expired'] += 1
+                entry = None
+            if entry is None :
+                self.stats['misses'] += 1
+                return default
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry[0]
+
+    def put(self, key, value, ttl=None) :
+        """
+        Stores the value of a key, evicting the least recently used entries
+        if the cache is full.
+        @type key: hashable
+        @param key: the key of the value.
+        @type value: object
+        @param value: the value to store.
+        @type ttl: int
+        @param ttl: the seconds the entry is valid, the ttl of the cache if
+        not given.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        with self.lock :
+            if key in self.entries :
+                self.remove(key)
+            self.entries[key] = \
+             (value, None if ttl is None else time.time() + ttl)
+            self.added(key, value)
+            while self.isFull() :
+                self.remove(next(iter(self.entries)))
+                self.stats['evictions'] += 1
+
+    def invalidate(self, key) :
+        """
+        Removes a key from the cache.
+        @type key: hashable
+        @param key: the key to remove.
+        """
+        with self.lock :
+            if key in self.entries :
+                self.remove(key)
+                self.stats['invalidations'] += 1
+
+    def invalidateIf(self, condition) :
+        """
+        Removes the keys satisfying a condition.
+        @type condition: function
+        @param condition: the function that takes a key and returns True if
+        it has to be removed.
+        """
+        with self.lock :
+            for key in [key for key in self.entries if condition(key)] :
+                self.remove(key)
+                self.stats['invalidations'] += 1
+
+    def clear(self) :
+        """
+        Removes all the entries.
+        """
+        with self.lock :
+            for key in list(self.entries) :
+                self.remove(key)
+
+    def added(self, key, value) :
+        """
+        Called when an entry is added, with the lock held.
+        @type key: hashable
+        @param key: the key of the added entry.
+        @type value: object
+        @param value: the added value.
+        """
+        pass
+
+    def remove(self, key) :
+        """
+        Removes an entry, with the lock held.
+        @type key: hashable
+        @param key: the key of the entry to remove.
+        """
+        del self.entries[key]
+
+    def isFull(self) :
+        """
+        Checks if entries have to be evicted, with the lock held.
+        @rtype bool
+        @return True if the cache holds too many entries.
+        """
+        return len(self.entries) > self.max_entries
+
+    def getStats(self) :
+        """
+        Gets the usage statistics of the cache.
+        @rtype dict
+        @return the number of entries, hits, misses, expired, evicted and
+        invalidated entries.
+        """
+        with self.lock :
+            stats = dict(self.stats)
+            stats['entries'] = len(self.entries)
+        return stats
+
+class SizedLRUCache(LRUCache) :
+    """
+    An LRUCache that also limits the total size of the cached values,
+    evicting the least recently used entries when it is exceeded.
+    """
+
+    def __init__(self, max_entries=1000, max_bytes=64 * 1024 * 1024,
+                 ttl=None, size=len) :
+        """
+        Creates an instance of the class.
+        @type max_entries: int
+        @param max_entries: the maximum number of entries.
+        @type max_bytes: int
+        @param max_bytes: the maximum total size of the values.
+        @type ttl: int
+        @param ttl: the seconds an entry is valid, None to never expire.
+        @type size: function
+        @param size: the function giving the size in bytes of a value.
+        """
+        LRUCache.__init__(self, max_entries, ttl)
+        self.max_bytes = max_bytes
+        self.size = size
+        self.bytes = 0
+
+    def put(self, key, value, ttl=None) :
+        """
+        Stores the value of a key as LRUCache does. Values larger than the
+        whole cache are not stored, as they would evict all the others.
+        """
+        if self.size(value) > self.max_bytes :
+            self.invalidate(key)
+            return
+        LRUCache.put(self, key, value, ttl)
+
+    def added(self, key, value) :
+        self.bytes += self.size(value)
+
+    def remove(self, key) :
+        self.bytes -= self.size(self.entries[key][0])
+        LRUCache.remove(self, key)
+
+    def isFull(self) :
+        return LRUCache.isFull(self) or self.bytes > self.max_bytes
+
+    def getStats(self) :
+        """
+        Gets the usage statistics of the cache.
+        @rtype dict
+        @return the statistics of LRUCache and the total size of the values.
+        """
+        stats = LRUCache.getStats(self)
+        with self.lock :
+            stats['bytes'] = self.bytes
+        return stats
@@ -20,25 +20,35 @@ under the License.
 """
 
 
+import os
 import pymysql
-from pandas.io import sql
 
 
 import datetime as dt # to calculate the elapsed time
 
-from device import Event
 from device import DeviceType
-from mapping import MappingException
+from pool import ConnectionPool
+from rest import RestSession
+from cache import LRUCache
+from cache import SizedLRUCache
+from extent import DataExtentIndex
+from cohort import CohortIndex
+from measurements import MeasurementStream
+from measurements import MeasurementDecoder
 
-import requests
 import json
 
 import pandas as pd
+import threading
+import queue
 #from tables.tests.create_backcompat_indexes import row
 
 class Client :
     def getSleepEvents(self, start_date, end_date):
         raise NotImplementedError
+
+    def getSleepColumns(self, start_date, end_date):
+        raise NotImplementedError
     
 class C2KRestClient(Client) :
     
@@ -49,14 +59,95 @@ class C2KRestClient(Client) :
     DB_PASSWORD = 'xxx'
     DB_NAME = 'xxx'
     DB_TABLE_DATA = 'xxx'
+    # The cache table needs a unique key on (user_id, date, start_datetime):
+    # records calculated again are updated instead of being duplicated (see
+    # sql/001_cache_user_id.sql).
     DB_TABLE_CACHE = 'xxx'
+    # The table storing the state of the sleep analysis at the end of each
+    # day, with a primary key on (user_id, date) (see 
+    # sql/003_checkpoints.sql)
+    DB_TABLE_CHECKPOINT = 'xxx'
+    # The table storing the period covered by the data of each user (see
+    # sql/004_data_extent.sql)
+    DB_TABLE_EXTENT = 'xxx'
+    # The table storing the vector of the average sleep of each user (see
+    # sql/005_cohort.sql)
+    DB_TABLE_COHORT = 'xxx'
+    # The tables storing for each week (from Monday) and month of the cache
+    # the sums of the measures of the days with a sleep duration, their 
+    # number and the number of days in the cache. They have a primary key on
+    # (user_id, period_start) and are updated with the cache (see 
+    # sql/002_rollups.sql).
+    DB_TABLE_ROLLUP_WEEK = 'xxx'
+    DB_TABLE_ROLLUP_MONTH = 'xxx'
+    ROLLUP_MEASURES = ['duration', 'count_micro_awakenings', 
+                       'time_micro_awakenings', 'count_awakenings', 
+                       'time_awakenings']
     LEN_TO_CACHE = 3
+    # True to write the sleep data in the cache in background, without 
+    # making the requests wait for the database.
+    CACHE_WRITE_BEHIND = False
+    
+    # The size of the pool of database connections, the seconds after that
+    # a connection is replaced and the maximum seconds to wait for a free one
+    DB_POOL_SIZE = 5
+    DB_POOL_RECYCLE = 3600
+    DB_POOL_TIMEOUT = 30
+    
+    # The background writer of the cache and the pool of database 
+    # connections, shared by all the instances
+    cache_writer = None
+    cache_writer_lock = threading.Lock()
+    connection_pool = None
+    connection_pool_lock = threading.Lock()
     
     """
     Defines the client application to connect to C2K server.
     """
     
-    BASE_REST_URL = "http://xxx/xxx/xxx"
+    BASE_REST_URL = os.getenv('C2K_REST_URL', "http://xxx/xxx/xxx")
+    # The seconds to wait to connect and to read a response, the retries of
+    # a failed call with the factor of the waiting time between them and 
+    # the maximum number of connections to the server
+    REST_TIMEOUT = (5, 120)
+    REST_RETRIES = 3
+    REST_BACKOFF = 0.5
+    REST_MAX_CONNECTIONS = 10
+    
+    # The session to the server, shared by all the instances
+    rest_session = None
+    rest_session_lock = threading.Lock()
+    
+    # The mapped devices of the users are cached for DEVICE_MAP_TTL seconds,
+    # keeping at most DEVICE_MAP_CACHE_SIZE users
+    DEVICE_MAP_CACHE_SIZE = 1000
+    DEVICE_MAP_TTL = 24 * 60 * 60
+    device_map_cache = LRUCache(DEVICE_MAP_CACHE_SIZE, DEVICE_MAP_TTL)
+
+    # The responses of the service are cached for RESPONSE_CACHE_TTL seconds,
+    # keeping at most RESPONSE_CACHE_SIZE responses and RESPONSE_CACHE_BYTES
+    # bytes. The keys start with the user and the first and last day the
+    # response depends on (None if unbounded), so the responses are 
+    # invalidated when the sleep data of those days change.
+    RESPONSE_CACHE_SIZE = 1000
+    RESPONSE_CACHE_BYTES = 64 * 1024 * 1024
+    RESPONSE_CACHE_TTL = 60 * 60
+    response_cache = SizedLRUCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_BYTES,
+                                   RESPONSE_CACHE_TTL,
+                                   lambda response : len(response['body']))
+    
+    # The seconds after that the server is asked again for measurements
+    # following the last known one
+    EXTENT_REFRESH = 60 * 60
+    # The period covered by the data of each user, shared by all the 
+    # instances
+    data_extent_index = None
+    data_extent_index_lock = threading.Lock()
+    
+    # The vectors of the average sleep of the users, shared by all the 
+    # instances
+    cohort_index = None
+    cohort_index_lock = threading.Lock()
     
     def __init__(self, params, mapping):
         """
@@ -67,6 +158,9 @@ class C2KRestClient(Client) :
         @param params: the parameters passed with the invoke of the service. 
         """
         self.user_id = params['sleep']['user_id']
+        self.sleep_data_buffer = []
+        self.checkpoint_buffer = []
+        self.measurement_decoder = None
         params = self.fixInputParams(params) 
         self.mapping = mapping
         self.createDeviceMap()
@@ -86,63 +180,140 @@ class C2KRestClient(Client) :
          or params['sleep']['param_2'] == "None" :
             params['sleep']['param_2'] = self.getAvailableDay('last')
         if params['sleep']['action'] == 'analyze' : 
+            # The average is taken over the analyzed period if no other
+            # period is given
             if params['sleep']['param_3'] == None:
-                params['sleep']['param_3'] = self.getAvailableDay('first')
+                params['sleep']['param_3'] = params['sleep']['param_1']
             if params['sleep']['param_4'] == None:
-                params['sleep']['param_4'] = self.getAvailableDay('last')
+                params['sleep']['param_4'] = params['sleep']['param_2']
         return params
     
     def getAvailableDay(self, day) :
         """
         Gets the first or last day of available data.
+        The days are read from the index of the data extents. The data of the
+        user are downloaded only the first time, then only the data 
+        following the last known measurement are asked, at most every 
+        EXTENT_REFRESH seconds.
         @type day: String
         @param day: can be 'fist' for the first day of data, 'last' for the last 
                day of data.
         @rtype date
-        @return the requested date.     
+        @return the requested date, None if there are no data.     
+        """
+        extent = self.getDataExtentIndex().get(self.user_id)
+        if extent is None :
+            extent = self.scanDataExtent(dt.datetime(2018, 1, 30, 10, 30))
+        elif day != 'first' and (extent.checked is None 
+         or (dt.datetime.now() - extent.checked).total_seconds() 
+          > self.EXTENT_REFRESH) :
+            extent = self.scanDataExtent(extent.last)
+        if extent is None :
+            return None
+        if day == 'first' :
+            requested_date = extent.first.date()
+        else :
+            requested_date = extent.last.date()
+        return requested_date                           
+
+    def scanDataExtent(self, date_from) :
+        """
+        Reads the measurements of the user from a datetime and updates the
+        index of the data extents.
+        @type date_from: datetime
+        @param date_from: the datetime the measurements are read from.
+        @rtype DataExtent
+        @return the updated extent, None if the user has no data.
         """
+        checked = dt.datetime.now()
         data =   '{' \
                 + '   "sensor": {' \
                 + '     "id":""' \
                 + '   },' \
-                + '   "dateFrom":"30-01-2018 10:30",' \
+                + '   "dateFrom":"' + date_from.strftime("%d-%m-%Y %H:%M") \
+                + '",' \
                 + '   "dateTo":"",' \
                 + '   "patientId": "' + self.user_id + '"' \
                 + '}'
         headers = {'Content-type': 'application/json'}
-        response = \
-         requests.post(self.BASE_REST_URL + '/measurements',
-                       headers=headers, data=data)    
-        loaded_json = json.loads(response.text)['RESULTS']
-        loaded_json = sorted(loaded_json, key=lambda x: 
-                             dt.datetime(x['timestamp']['year'],
-                                        x['timestamp']['monthValue'],
-                                        x['timestamp']['dayOfMonth'],
-                                        x['timestamp']['hour'],
-                                        x['timestamp']['minute'],
-                                        x['timestamp']['second']))
-        if day == 'first' :
-            requested_date = dt.date(loaded_json[0]['timestamp']['year'],
-                                     loaded_json[0]['timestamp']['monthValue'],
-                                     loaded_json[0]['timestamp']['dayOfMonth'])
-        else :
-            requested_date = dt.date(loaded_json[len(loaded_json) - 1]
-                                                ['timestamp']['year'],
-                                     loaded_json[len(loaded_json) - 1]
-                                                ['timestamp']['monthValue'],
-                                     loaded_json[len(loaded_json) - 1]
-                                                ['timestamp']['dayOfMonth'])
-        return requested_date                           
+        response = self.getRestSession().post('/measurements',
+                                              headers=headers, data=data,
+                                              stream=True)
+        try :
+            measurements = MeasurementStream(
+                response.iter_content(MeasurementStream.CHUNK_SIZE))
+            measurements.consume()
+        finally :
+            response.close()
+        index = self.getDataExtentIndex()
+        if measurements.first is None :
+            extent = index.get(self.user_id)
+            if extent is None :
+                return None
+            return index.update(self.user_id, extent.first, extent.last, 
+                                checked)
+        return index.update(self.user_id, measurements.first, 
+                            measurements.last, checked)
 
     def getSleepEvents(self, start_datetime, end_datetime) :
         """
         Gets the events occurred in a certain period.
+        The events are stored in typed columns, iterated as views with the
+        attributes of Event, so each event takes a few bytes while the 
+        period is analyzed.
+        @type start_date date
+        @param start_date the starting date of the time interval.
+        @type end_date date
+        @param end_date the ending date of the time interval.
+        @rtype MeasurementColumns
+        @return the events that occurred, in time order.
+        """
+        return self.getSleepColumns(start_datetime, end_datetime)
+
+    def getSleepColumns(self, start_datetime, end_datetime) :
+        """
+        Gets the measurements occurred in a certain period, decoded into 
+        typed columns.
+        @type start_date date
+        @param start_date the starting date of the time interval.
+        @type end_date date
+        @param end_date the ending date of the time interval.
+        @rtype MeasurementColumns
+        @return the measurements that occurred, in time order.
+        """
+        if self.measurement_decoder is None :
+            self.measurement_decoder = \
+             MeasurementDecoder(self.mapping.device_map)
+        unmapped = self.measurement_decoder.stats['unmapped']
+        response = self.requestSleepMeasurements(start_datetime, end_datetime)
+        try :
+            measurements = MeasurementStream(
+                response.iter_content(MeasurementStream.CHUNK_SIZE))
+            columns = self.measurement_decoder.decode(
+                measurements.rows(), start_datetime, end_datetime)
+        finally :
+            response.close()
+        unmapped = self.measurement_decoder.stats['unmapped'] - unmapped
+        if unmapped > 0 :
+            print("ERROR: %d measurements of not supported devices." 
+                  % unmapped)
+        if len(columns) > 0 :
+            datetimes = columns.datetimes()
+            self.getDataExtentIndex().update(self.user_id, 
+                                             datetimes[0].item(),
+                                             datetimes[-1].item(), 
+                                             create=False)
+        return columns
+
+    def requestSleepMeasurements(self, start_datetime, end_datetime) :
+        """
+        Asks the server for the measurements of the bed in a certain period.
         @type start_date date
         @param start_date the starting date of the time interval.
         @type end_date date
         @param end_date the ending date of the time interval.
-        @rtype list of Event
-        @return the list of Event that occurred. 
+        @rtype Response
+        @return the streamed response of the server.
         """
         # There is only one device for type so it is taken the first one.
         bed_device = self.mapping.searchDevice(DeviceType.BED)[0]
@@ -150,7 +321,6 @@ class C2KRestClient(Client) :
             sensor_id = ""
         else :
             sensor_id = bed_device.id
-        events = []          
         data = \
               '{' \
             + '   "sensor": {' \
@@ -163,48 +333,44 @@ class C2KRestClient(Client) :
             + '   "patientId":"' + self.user_id + '"' \
             + '}'
         headers = {'Content-type': 'application/json'}
-        response = requests.post(self.BASE_REST_URL + '/measurements',
-                     data=data, headers=headers)
-        
-        loaded_json = json.loads(response.text)['RESULTS']
-        for x in loaded_json :
-            x['compact_timestamp'] = dt.datetime(x['timestamp']['year'],
-                                                 x['timestamp']['monthValue'],
-                                                 x['timestamp']['dayOfMonth'],
-                                                 x['timestamp']['hour'],
-                                                 x['timestamp']['minute'],
-                                                 x['timestamp']['second']) 
-        loaded_json = sorted(loaded_json, key=lambda x: x['compact_timestamp'])
-        selected_data = []
-        for row in loaded_json :
-            if (row['compact_timestamp'] >= start_datetime) \
-                & (row['compact_timestamp'] < end_datetime) :
-                selected_data.append(row)
-        for row in selected_data :
-            try : 
-                events.append(self.mapping.mapEvent(row))
-            except MappingException as e:
-                print(e.getMessage())
-                pass                     
-        closing_event = Event(dt.datetime(dt.MINYEAR, 1, 1, 1, 0, 0), 
-                                  0, 0, 0)
-        events.append(closing_event)
-        return events  
-    
+        return self.getRestSession().post('/measurements', data=data, 
+                                          headers=headers, stream=True)
+
     def createDeviceMap(self) :
         """
         Creates the virtual representation of devices.
+        The mapped devices of the user are taken from the cache when 
+        available, otherwise they are read from the server and cached.
         """
-        headers = {'Content-type': 'application/json'}
-        response = \
-         requests.get(self.BASE_REST_URL + "/person/" 
-                      + self.user_id + "/sensor.json",
-                      headers=headers)
-        loaded_json = json.loads(response.text)['RESULTS']
-        for row in loaded_json :
-            self.mapping.mapAndAddDeviceMap(row)
+        device_map = self.device_map_cache.get(self.user_id)
+        if device_map is None :
+            headers = {'Content-type': 'application/json'}
+            response = \
+             self.getRestSession().get("/person/" + self.user_id 
+                                       + "/sensor.json",
+                                       name="/person/sensor.json",
+                                       headers=headers)
+            loaded_json = json.loads(response.text)['RESULTS']
+            for row in loaded_json :
+                self.mapping.mapAndAddDeviceMap(row)
+            self.device_map_cache.put(self.user_id, self.mapping.device_map)
+        else :
+            self.mapping.device_map = device_map
         self.mapping.createDevices()    
 
+    @classmethod
+    def invalidateDeviceMap(cls, user_id=None) :
+        """
+        Removes from the cache the mapped devices of a user, so that they are
+        read again from the server.
+        @type user_id: String
+        @param user_id: the user, None to remove the devices of all users.
+        """
+        if user_id is None :
+            cls.device_map_cache.clear()
+        else :
+            cls.device_map_cache.invalidate(user_id)
+
     def getCachedSleepData(self, start_date, end_date) :
         """
         Gets calculated sleep activities data that are stored in the server.
@@ -220,47 +386,438 @@ class C2KRestClient(Client) :
                    'count_awakenings', 'time_awakenings']
         cached_df = pd.DataFrame(columns=columns) 
         
-        mysql_cn = \
-         pymysql.connect(host=self.DB_HOST, port=self.DB_PORT, \
-                         user=self.DB_USERNAME, passwd=self.DB_PASSWORD,
-                         db=self.DB_NAME)
         sql_query = "SELECT date, start_datetime, end_datetime," \
                     + " count_micro_awakenings, time_micro_awakenings," \
                     + " count_awakenings, time_awakenings FROM " \
-                    + self.DB_TABLE_CACHE + " WHERE date >= " \
-                    + "'" + start_date.strftime('%Y-%m-%d') + "'"  \
-                    + "and date <= " + "'" + end_date.strftime('%Y-%m-%d') \
-                    + "'" + "order by date"  
-        db_cache_dataframe = pd.read_sql(sql_query, mysql_cn)
-        mysql_cn.close()
+                    + self.DB_TABLE_CACHE + " WHERE user_id = %s" \
+                    + " AND date >= %s AND date <= %s order by date"  
+        with self.getConnectionPool().connection() as mysql_cn :
+            db_cache_dataframe = pd.read_sql(
+                sql_query, mysql_cn, 
+                params=(self.user_id, start_date.strftime('%Y-%m-%d'),
+                        end_date.strftime('%Y-%m-%d')))
         
         cached_df = db_cache_dataframe       
         return cached_df
     
-    def insertSleepDataToCache(self, df_sleep_data) :
+    def getSleepRollups(self, period, first_start, last_start) :
+        """
+        Gets the sums of the cached sleep activities of weeks or months.
+        @type period: String
+        @param period: 'week' or 'month'.
+        @type first_start: date
+        @param first_start: the first day of the first period.
+        @type last_start: date
+        @param last_start: the first day of the last period.
+        @rtype dict
+        @return for each first day of a period, the number of days in the 
+        cache ('cached_days') and of the days with a sleep duration 
+        ('days'), the first and last of them ('first_date', 'last_date') and
+        the sum of each measure.
+        """
+        columns = ['period_start', 'cached_days', 'days', 'first_date', 
+                   'last_date'] + self.ROLLUP_MEASURES
+        sql_query = "SELECT " + ", ".join(columns) + " FROM " \
+                    + self.rollupTable(period) \
+                    + " WHERE user_id = %s" \
+                    + " AND period_start >= %s AND period_start <= %s"
+        rollups = {}
+        with self.getConnectionPool().connection() as mysql_cn :
+            with mysql_cn.cursor() as cursor :
+                cursor.execute(sql_query, 
+                               (self.user_id, 
+                                first_start.strftime('%Y-%m-%d'),
+                                last_start.strftime('%Y-%m-%d')))
+                for row in cursor.fetchall() :
+                    rollups[row[0]] = dict(zip(columns[1:], row[1:]))
+        return rollups
+
+    def getSleepCheckpoints(self, start_date, end_date) :
+        """
+        Gets the states of the sleep analysis stored at the end of the days.
+        @type start_date: date
+        @param start_date: the beginning of the searched period of time.
+        @type end_date: date
+        @param end_date: the end of the searched period of time.
+        @rtype dict
+        @return the states, as given by Intelligence.getState, by day.
+        """
+        sql_query = "SELECT date, state FROM " + self.DB_TABLE_CHECKPOINT \
+                    + " WHERE user_id = %s AND date >= %s AND date <= %s"
+        checkpoints = {}
+        with self.getConnectionPool().connection() as mysql_cn :
+            with mysql_cn.cursor() as cursor :
+                cursor.execute(sql_query, (self.user_id,
+                                           start_date.strftime('%Y-%m-%d'),
+                                           end_date.strftime('%Y-%m-%d')))
+                for date, state in cursor.fetchall() :
+                    checkpoints[date] = json.loads(state)
+        return checkpoints
+
+    def bufferSleepCheckpoint(self, day, state) :
+        """
+        Keeps the state of the sleep analysis at the end of a day to be
+        stored in the server with the next flushSleepDataToCache.
+        @type day: date
+        @param day: the day.
+        @type state: dict
+        @param state: the state, as given by Intelligence.getState.
+        """
+        self.checkpoint_buffer.append((self.user_id, day.strftime('%Y-%m-%d'),
+                                       json.dumps(state)))
+
+    def insertSleepDataToCache(self, df_sleep_data, checkpoints=()) :
         """
         Store the calculated sleep activities in the server.
+        Records already stored are updated.
+        @type df_sleep_data: dataframe
+        @param df_sleep_data: the dataframe containing data to be stored.
+        @type checkpoints: list of tuple
+        @param checkpoints: the states of the sleep analysis at the end of
+        the days to be stored with the data.
+        """
+        rows = []
+        if not df_sleep_data.empty :
+            for row in df_sleep_data.itertuples(index=False) :
+                rows.append((self.user_id, row.date.strftime('%Y-%m-%d'),
+                             row.start_datetime.strftime('%Y-%m-%d %H:%M:%S'),
+                             row.end_datetime.strftime('%Y-%m-%d %H:%M:%S'),
+                             int(row.count_micro_awakenings),
+                             float(row.time_micro_awakenings),
+                             int(row.count_awakenings),
+                             float(row.time_awakenings)))
+        if rows or checkpoints :
+            if self.CACHE_WRITE_BEHIND :
+                C2KRestClient.getCacheWriter().put(rows, checkpoints)
+            else :
+                C2KRestClient.upsertSleepData(rows, checkpoints)
+
+    def bufferSleepDataToCache(self, df_sleep_data) :
+        """
+        Keeps the calculated sleep activities to be stored in the server with
+        the next flushSleepDataToCache.
         @type df_sleep_data: dataframe
         @param df_sleep_data: the dataframe containing data to be stored.
         """
-                #start_time = dt.datetime.now()
         if not df_sleep_data.empty :
-            mysql_cn = pymysql.connect(host=self.DB_HOST, port=self.DB_PORT, 
-                                       user=self.DB_USERNAME, 
-                                       passwd=self.DB_PASSWORD, db=self.DB_NAME)
-            for _, row in df_sleep_data.iterrows() :                
-                sql_query = "INSERT INTO " + self.DB_TABLE_CACHE \
-                + " (date, start_datetime, end_datetime,"\
-                + " count_micro_awakenings, time_micro_awakenings, "\
-                + " count_awakenings, time_awakenings) VALUES" \
-                + " ('" + row['date'].strftime('%Y-%m-%d') \
-                + "', '" \
-                + row['start_datetime'].strftime('%Y-%m-%d %H:%M:%S') + "', '"\
-                + row['end_datetime'].strftime('%Y-%m-%d %H:%M:%S') + "', '" \
-                + str(row['count_micro_awakenings']) + "', '"\
-                + str(row['time_micro_awakenings']) + "', '"\
-                + str(row['count_awakenings']) + "', '"\
-                + str(row['time_awakenings']) + "');"
-                sql.execute(sql_query, mysql_cn)
+            self.sleep_data_buffer.append(df_sleep_data)
+
+    def flushSleepDataToCache(self) :
+        """
+        Stores with a single write the sleep activities kept by
+        bufferSleepDataToCache and the states kept by bufferSleepCheckpoint.
+        """
+        if self.sleep_data_buffer or self.checkpoint_buffer :
+            if self.sleep_data_buffer :
+                df_sleep_data = pd.concat(self.sleep_data_buffer)
+            else :
+                df_sleep_data = pd.DataFrame()
+            checkpoints = self.checkpoint_buffer
+            self.sleep_data_buffer = []
+            self.checkpoint_buffer = []
+            self.insertSleepDataToCache(df_sleep_data, checkpoints)
+
+    @classmethod
+    def upsertSleepData(cls, rows, checkpoints=()) :
+        """
+        Writes sleep activities in the cache with a single multi-row
+        statement, in the same transaction of the states of the analysis at
+        the end of the days. Records already stored are updated.
+        Once the transaction is committed, the cached responses depending on
+        the written days are removed.
+        @type rows: list of tuple
+        @param rows: the user and the values of the records in the order of
+        the columns of the cache.
+        @type checkpoints: list of tuple
+        @param checkpoints: the user, day and JSON state of the checkpoints.
+        """
+        sql_query = "INSERT INTO " + cls.DB_TABLE_CACHE \
+            + " (user_id, date, start_datetime, end_datetime," \
+            + " count_micro_awakenings, time_micro_awakenings," \
+            + " count_awakenings, time_awakenings)" \
+            + " VALUES (%s, %s, %s, %s, %s, %s, %s, %s)" \
+            + " ON DUPLICATE KEY UPDATE end_datetime = VALUES(end_datetime)," \
+            + " count_micro_awakenings = VALUES(count_micro_awakenings)," \
+            + " time_micro_awakenings = VALUES(time_micro_awakenings)," \
+            + " count_awakenings = VALUES(count_awakenings)," \
+            + " time_awakenings = VALUES(time_awakenings)"
+        checkpoint_query = "INSERT INTO " + cls.DB_TABLE_CHECKPOINT \
+            + " (user_id, date, state) VALUES (%s, %s, %s)" \
+            + " ON DUPLICATE KEY UPDATE state = VALUES(state)"
+        with cls.getConnectionPool().connection() as mysql_cn :
+            with mysql_cn.cursor() as cursor :
+                if rows :
+                    cursor.executemany(sql_query, rows)
+                    cls.updateSleepRollups(cursor, 
+                                           set(row[:2] for row in rows))
+                if checkpoints :
+                    cursor.executemany(checkpoint_query, checkpoints)
             mysql_cn.commit()
-            mysql_cn.close()   
+        written_days = {}
+        for row in rows :
+            first_day, last_day = written_days.get(row[0], (row[1], row[1]))
+            written_days[row[0]] = (min(first_day, row[1]), 
+                                    max(last_day, row[1]))
+        for user_id, (first_day, last_day) in written_days.items() :
+            cls.invalidateResponses(user_id, first_day, last_day)
+
+    @classmethod
+    def updateSleepRollups(cls, cursor, days) :
+        """
+        Calculates again from the cache the weeks and months containing 
+        some days of users, so that records updated in the cache are not 
+        counted twice.
+        @type cursor: Cursor
+        @param cursor: the cursor of the transaction writing the cache.
+        @type days: set of tuple
+        @param days: the user and the written day, as YYYY-mm-dd.
+        """
+        periods = set()
+        for user_id, day in days :
+            day = dt.datetime.strptime(day, '%Y-%m-%d').date()
+            for period in ('week', 'month') :
+                periods.add((user_id, period, cls.periodStart(period, day)))
+        # The measures of each day with a sleep duration are summed
+        summed = lambda value : "COALESCE(SUM(CASE WHEN duration <> 0" \
+                                + " THEN " + value + " END), 0)"
+        for user_id, period, period_start in sorted(periods) :
+            period_end = cls.nextPeriod(period, period_start)
+            sql_query = "INSERT INTO " + cls.rollupTable(period) \
+                + " (user_id, period_start, cached_days, days, first_date," \
+                + " last_date, " + ", ".join(cls.ROLLUP_MEASURES) + ")" \
+                + " SELECT %s, %s, COUNT(*), " + summed("1") + "," \
+                + " MIN(CASE WHEN duration <> 0 THEN date END)," \
+                + " MAX(CASE WHEN duration <> 0 THEN date END), " \
+                + ", ".join(summed(measure) 
+                            for measure in cls.ROLLUP_MEASURES) \
+                + " FROM (SELECT date, SUM(TIMESTAMPDIFF(SECOND," \
+                + " start_datetime, end_datetime)) AS duration, " \
+                + ", ".join("SUM(" + measure + ") AS " + measure 
+                            for measure in cls.ROLLUP_MEASURES[1:]) \
+                + " FROM " + cls.DB_TABLE_CACHE \
+                + " WHERE user_id = %s AND date >= %s AND date < %s" \
+                + " GROUP BY date) AS daily" \
+                + " ON DUPLICATE KEY UPDATE" \
+                + " cached_days = VALUES(cached_days)," \
+                + " days = VALUES(days), first_date = VALUES(first_date)," \
+                + " last_date = VALUES(last_date), " \
+                + ", ".join(measure + " = VALUES(" + measure + ")"
+                            for measure in cls.ROLLUP_MEASURES)
+            cursor.execute(sql_query, 
+                           (user_id, period_start.strftime('%Y-%m-%d'),
+                            user_id, period_start.strftime('%Y-%m-%d'),
+                            period_end.strftime('%Y-%m-%d')))
+
+    @classmethod
+    def periodStart(cls, period, day) :
+        """
+        Gets the first day of the week or month containing a day.
+        @type period: String
+        @param period: 'week' or 'month'.
+        @type day: date
+        @param day: the day.
+        @rtype date
+        @return the Monday of the week or the first day of the month.
+        """
+        if period == 'week' :
+            return day - dt.timedelta(days=day.weekday())
+        return day.replace(day=1)
+
+    @classmethod
+    def nextPeriod(cls, period, period_start) :
+        """
+        Gets the first day of the week or month following another.
+        @type period: String
+        @param period: 'week' or 'month'.
+        @type period_start: date
+        @param period_start: the first day of a week or month.
+        @rtype date
+        @return the first day of the following week or month.
+        """
+        if period == 'week' :
+            return period_start + dt.timedelta(days=7)
+        return (period_start + dt.timedelta(days=31)).replace(day=1)
+
+    @classmethod
+    def rollupTable(cls, period) :
+        """
+        Gets the table of the sums of the weeks or of the months.
+        @type period: String
+        @param period: 'week' or 'month'.
+        @rtype String
+        @return the name of the table.
+        """
+        if period == 'week' :
+            return cls.DB_TABLE_ROLLUP_WEEK
+        return cls.DB_TABLE_ROLLUP_MONTH
+
+    @classmethod
+    def invalidateResponses(cls, user_id, first_day, last_day) :
+        """
+        Removes from the cache the responses of a user depending on days
+        whose sleep data changed.
+        @type user_id: String
+        @param user_id: the user.
+        @type first_day: String
+        @param first_day: the first changed day, as YYYY-mm-dd.
+        @type last_day: String
+        @param last_day: the last changed day, as YYYY-mm-dd.
+        """
+        cls.response_cache.invalidateIf(
+            lambda key : key[0] == user_id
+                         and (key[1] is None or key[1] <= last_day)
+                         and (key[2] is None or key[2] >= first_day))
+
+    def updateCohortVector(self, start_date, end_date, vector) :
+        """
+        Stores the vector of the average sleep of the user, removing from 
+        the cache the responses comparing the users.
+        @type start_date: date
+        @param start_date: the first day of the averaged period.
+        @type end_date: date
+        @param end_date: the last day of the averaged period.
+        @type vector: numpy array
+        @param vector: the averages of the measures.
+        """
+        self.getCohortIndex().update(self.user_id, start_date, end_date, 
+                                     vector)
+        self.response_cache.invalidateIf(lambda key : key[3][1] == 'cohort')
+
+    @classmethod
+    def connect(cls) :
+        """
+        Opens a new connection to the database.
+        @rtype Connection
+        @return the connection.
+        """
+        return pymysql.connect(host=cls.DB_HOST, port=cls.DB_PORT, 
+                               user=cls.DB_USERNAME, passwd=cls.DB_PASSWORD,
+                               db=cls.DB_NAME)
+
+    @classmethod
+    def getConnectionPool(cls) :
+        """
+        Gets the pool of database connections, creating it the first time.
+        @rtype ConnectionPool
+        @return the pool shared by all the instances.
+        """
+        with cls.connection_pool_lock :
+            if cls.connection_pool is None :
+                cls.connection_pool = ConnectionPool(cls.connect, 
+                                                     cls.DB_POOL_SIZE,
+                                                     cls.DB_POOL_RECYCLE,
+                                                     cls.DB_POOL_TIMEOUT)
+        return cls.connection_pool
+
+    @classmethod
+    def getRestSession(cls) :
+        """
+        Gets the session to the server, creating it the first time.
+        @rtype RestSession
+        @return the session shared by all the instances.
+        """
+        with cls.rest_session_lock :
+            if cls.rest_session is None :
+                cls.rest_session = RestSession(cls.BASE_REST_URL,
+                                               cls.REST_TIMEOUT,
+                                               cls.REST_RETRIES,
+                                               cls.REST_BACKOFF,
+                                               cls.REST_MAX_CONNECTIONS)
+        return cls.rest_session
+
+    @classmethod
+    def getDataExtentIndex(cls) :
+        """
+        Gets the index of the periods covered by the data of the users,
+        creating it the first time.
+        @rtype DataExtentIndex
+        @return the index shared by all the instances.
+        """
+        with cls.data_extent_index_lock :
+            if cls.data_extent_index is None :
+                cls.data_extent_index = \
+                 DataExtentIndex(cls.getConnectionPool(), cls.DB_TABLE_EXTENT)
+        return cls.data_extent_index
+
+    @classmethod
+    def getCohortIndex(cls) :
+        """
+        Gets the index of the vectors of the average sleep of the users,
+        creating it the first time.
+        @rtype CohortIndex
+        @return the index shared by all the instances.
+        """
+        with cls.cohort_index_lock :
+            if cls.cohort_index is None :
+                cls.cohort_index = CohortIndex(cls.getConnectionPool(), 
+                                               cls.DB_TABLE_COHORT)
+        return cls.cohort_index
+
+    @classmethod
+    def getCacheWriter(cls) :
+        """
+        Gets the background writer of the cache, starting it the first time.
+        @rtype CacheWriter
+        @return the writer shared by all the instances.
+        """
+        with cls.cache_writer_lock :
+            if cls.cache_writer is None :
+                cls.cache_writer = CacheWriter(cls.upsertSleepData)
+                cls.cache_writer.start()
+        return cls.cache_writer
+
+class CacheWriter(threading.Thread) :
+    """
+    Writes data in the cache in background. 
+    The rows waiting in the queue are written together.
+    """
+
+    def __init__(self, write) :
+        """
+        Creates an instance of the class.
+        @type write: function
+        @param write: the function writing a list of rows and a list of
+        checkpoints in the cache.
+        """
+        threading.Thread.__init__(self, name='CacheWriter')
+        self.daemon = True
+        self.write = write
+        self.queue = queue.Queue()
+
+    def put(self, rows, checkpoints=()) :
+        """
+        Queues rows to be written.
+        @type rows: list
+        @param rows: the rows to write.
+        @type checkpoints: list
+        @param checkpoints: the checkpoints to write with the rows.
+        """
+        self.queue.put((rows, checkpoints))
+
+    def waitForWrites(self) :
+        """
+        Waits until the queued rows are written.
+        """
+        self.queue.join()
+
+    def run(self) :
+        while True :
+            batches = [self.queue.get()]
+            try :
+                while True :
+                    batches.append(self.queue.get_nowait())
+            except queue.Empty :
+                pass
+            rows = []
+            checkpoints = []
+            for batch_rows, batch_checkpoints in batches :
+                rows.extend(batch_rows)
+                checkpoints.extend(batch_checkpoints)
+            try :
+                self.write(rows, checkpoints)
+            except Exception as e :
+                print("ERROR: writing %d rows in the cache: %s" 
+                      % (len(rows), e))
+            finally :
+                for _ in batches :
+                    self.queue.task_done()
@@ -0,0 +1,206 @@
+"""
+Copyright 2018 Dario Russo <dario.russo@isti.cnr.it>
+
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+"""
+Keeps the average sleep of each user to compare the users with each other.
+"""
+
+import threading
+
+import numpy as np
+
+class CohortIndex :
+    """
+    Stores for each user the vector of the average sleep activities of a
+    recent period, to find the users sleeping like a given one without
+    calculating the averages of all of them.
+    The vectors are kept in memory as a matrix of unit rows and persisted
+    in a database table, read at the first use; each user is updated on its
+    own when its sleep activities are calculated.
+    """
+
+    # The measures of the vectors, in the order of the columns
+    measures = ['duration', 'count_micro_awakenings', 'time_micro_awakenings',
+                'count_awakenings', 'time_awakenings']
+
+    def __init__(self, pool, table) :
+        """
+        Creates an instance of the class.
+        @type pool: ConnectionPool
+        @param pool: the pool of connections to the database.
+        @type table: String
+        @param table: the table storing the vectors. It has the columns
+        user_id (primary key), start_date, end_date, a column for each
+        measure and updated_at.
+        """
+        self.pool = pool
+        self.table = table
+        self.lock = threading.Lock()
+        self.loaded = False
+        # The period and the vector of each user
+        self.vectors = {}
+        # The matrix of the unit vectors, built again after the updates
+        self.user_ids = []
+        self.rows = {}
+        self.matrix = None
+
+    def load(self) :
+        """
+        Reads the vectors of all the users from the database, the first
+        time only.
+        """
+        with self.lock :
+            if self.loaded :
+                return
+        sql_query = "SELECT user_id, start_date, end_date, " \
+                    + ", ".join(self.measures) + " FROM " + self.table
+        with self.pool.connection() as mysql_cn :
+            with mysql_cn.cursor() as cursor :
+                cursor.execute(sql_query)
+                rows = cursor.fetchall()
+        with self.lock :
+            if not self.loaded :
+                for row in rows :
+                    self.vectors.setdefault(
+                        row[0], (row[1], row[2],
+                                 np.array(row[3:], dtype=float)))
+                self.loaded = True
+                self.matrix = None
+
+    def get(self, user_id) :
+        """
+        Gets the vector of a user.
+        @type user_id: String
+        @param user_id: the user.
+        @rtype tuple
+        @return the first and last day of the averaged period and the
+        vector, None if the user is not known.
+        """
+        self.load()
+        with self.lock :
+            return self.vectors.get(user_id)
+
+    def update(self, user_id, start_date, end_date, vector) :
+        """
+        Replaces the vector of a user.
+        @type user_id: String
+        @param user_id: the user.
+        @type start_date: date
+        @param start_date: the first day of the averaged period.
+        @type end_date: date
+        @param end_date: the last day of the averaged period.
+        @type vector: numpy array
+        @param vector: the averages of the measures.
+        """
+        self.load()
+        vector = np.asarray(vector, dtype=float)
+        with self.lock :
+            self.vectors[user_id] = (start_date, end_date, vector)
+            if self.matrix is not None and user_id in self.rows :
+                norm = np.sqrt(np.dot(vector, vector))
+                self.matrix[self.rows[user_id]] = vector / norm if norm \
+                                                  else 0.0
+            else :
+                self.matrix = None
+        sql_query = "INSERT INTO " + self.table \
+            + " (user_id, start_date, end_date, " + ", ".join(self.measures) \
+            + ", updated_at) VALUES (%s, %s, %s, " \
+            + ", ".join(["%s"] * len(self.measures)) + ", NOW())" \
+            + " ON DUPLICATE KEY UPDATE start_date = VALUES(start_date)," \
+            + " end_date = VALUES(end_date), " \
+            + ", ".join(measure + " = VALUES(" + measure + ")"
+                        for measure in self.measures) \
+            + ", updated_at = VALUES(updated_at)"
+        with self.pool.connection() as mysql_cn :
+            with mysql_cn.cursor() as cursor :
+                cursor.execute(sql_query,
+                               (user_id, start_date.strftime('%Y-%m-%d'),
+                                end_date.strftime('%Y-%m-%d'))
+                               + tuple(float(value) for value in vector))
+            mysql_cn.commit()
+
+    def search(self, vector, user_ids=None, top_k=10, exclude=None) :
+        """
+        Finds the users whose vectors are the most similar to a vector, by
+        cosine similarity.
+        @type vector: numpy array
+        @param vector: the averages of the measures to compare.
+        @type user_ids: list of String
+        @param user_ids: the users to compare, None for all the known ones.
+        Unknown users are skipped.
+        @type top_k: int
+        @param top_k: the maximum number of users returned.
+        @type exclude: String
+        @param exclude: a user not to be returned, usually the compared one.
+        @rtype list of tuple
+        @return the users with their similarity, from the most similar.
+        """
+        self.load()
+        vector = np.asarray(vector, dtype=float)
+        norm = np.sqrt(np.dot(vector, vector))
+        if not norm or top_k <= 0 :
+            return []
+        with self.lock :
+            if self.matrix is None :
+                self.buildMatrix()
+            known_ids = self.user_ids
+            if user_ids is None :
+                rows = np.arange(len(known_ids))
+            else :
+                rows = np.unique([self.rows[user_id] for user_id in user_ids
+                                  if user_id in self.rows]).astype(np.int64)
+            if exclude in self.rows :
+                rows = rows[rows != self.rows[exclude]]
+            if len(rows) == 0 :
+                return []
+            # The rows are replaced in place by update, so they are read
+            # holding the lock
+            similarities = np.dot(self.matrix[rows], vector / norm)
+        if top_k < len(rows) :
+            best = np.argpartition(-similarities, top_k - 1)[:top_k]
+        else :
+            best = np.arange(len(rows))
+        best = best[np.argsort(-similarities[best], kind='mergesort')]
+        return [(known_ids[rows[i]], float(similarities[i])) for i in best]
+
+    def buildMatrix(self) :
+        """
+        Builds the matrix of the unit vectors of the users, holding the
+        lock.
+        """
+        self.user_ids = list(self.vectors)
+        self.rows = dict((user_id, row)
+                         for row, user_id in enumerate(self.user_ids))
+        matrix = np.array([self.vectors[user_id][2]
+                           for user_id in self.user_ids],
+                          dtype=float).reshape(-1, len(self.measures))
+        with np.errstate(divide='ignore', invalid='ignore') :
+            matrix /= np.sqrt(np.einsum('ij,ij->i', matrix, matrix))[:, None]
+        self.matrix = np.nan_to_num(matrix)
+
+    def getStats(self) :
+        """
+        Gets the number of the users in the index.
+        @rtype dict
+        @return the number of the known users.
+        """
+        with self.lock :
+            return {'users': len(self.vectors), 'loaded': self.loaded}
@@ -38,6 +38,48 @@ class Configuration :
     # The minimum required time to consider a rest time
     MIN_TIME_INTERVAL_FOR_SLEEPING = 60 * 60 * 1.5
     
+    # The engine used to recognize sleep activities: 'event' analyzes one
+    # event at time (Sleep), 'vectorized' analyzes whole columns of bed 
+    # sensor data (VectorizedSleep). They give the same results.
+    SLEEP_ENGINE = 'event'
+    
+    # The maximum number of consecutive days whose events are fetched with a
+    # single request to the server. 1 fetches the events day by day.
+    MAX_DAYS_PER_FETCH = 31
+
+    # The averages of intervals of at least this number of days are summed
+    # from the sums of their weeks and months, stored with the cache
+    ROLLUP_MIN_DAYS = 28
+
+    # The number of users analyzed at the same time by the batches of the
+    # /post endpoint. More workers than the connections to the server
+    # (C2KRestClient.REST_MAX_CONNECTIONS) only wait for a free one.
+    BATCH_WORKERS = 4
+    # The maximum number of batches whose status is kept
+    BATCH_MAX_JOBS = 100
+
+    # The nightly precompute of the sleep activities of the day before: the
+    # time it starts at as HH:MM (None to disable it), the users as a list
+    # and/or as a file with a user for line, the users analyzed at the same
+    # time, the retries of a failed user and the seconds waited before the
+    # first retry (doubled at each retry)
+    NIGHTLY_TIME = '02:00'
+    NIGHTLY_USERS = []
+    NIGHTLY_USERS_FILE = None
+    NIGHTLY_WORKERS = 4
+    NIGHTLY_RETRIES = 3
+    NIGHTLY_BACKOFF = 30
+
+    # The number of nights whose similarities with all the others are
+    # calculated at once by the similarity action
+    SIMILARITY_BLOCK_SIZE = 512
+
+    # The days, up to the last analyzed one, averaged in the vector of each
+    # user compared by the cohort action, and the number of most similar
+    # users it returns by default
+    COHORT_DAYS = 30
+    COHORT_TOP_K = 10
+    
     # Differences expressed as value [0..1] to signal an anomaly in sleep
     # activities
     DIFFERENCE_DURATION = 0.1
@@ -45,4 +87,14 @@ class Configuration :
     DIFFERENCE_TIME_MICRO_AWAKENING = 0.1
     DIFFERENCE_COUNT_AWAKENING = 0.1
     DIFFERENCE_TIME_AWAKENING = 0.1
-    
\ No newline at end of file
+    
+    # The days before each night whose nights are averaged to compare it by
+    # the rolling action
+    ROLLING_NIGHTS = 14
+
+    # The processes rendering the hourly images of the plot action (0 to
+    # render them in the process of the request), and the number and total
+    # bytes of the rendered images kept in memory
+    PLOT_WORKERS = 2
+    PLOT_CACHE_SIZE = 1000
+    PLOT_CACHE_BYTES = 128 * 1024 * 1024
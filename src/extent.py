@@ -0,0 +1,148 @@
+"""
+Copyright 2018 Dario Russo <dario.russo@isti.cnr.it>
+
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+"""
+Keeps track of the period of time covered by the data of each user.
+"""
+
+import threading
+
+class DataExtent :
+    """
+    The period of time covered by the data of a user.
+    """
+    def __init__(self, first, last, checked=None) :
+        """
+        Creates an instance of the class.
+        @type first: datetime
+        @param first: the datetime of the first measurement.
+        @type last: datetime
+        @param last: the datetime of the last measurement.
+        @type checked: datetime
+        @param checked: when the server was last asked for measurements
+        following the last one, None if never.
+        """
+        self.first = first
+        self.last = last
+        self.checked = checked
+
+class DataExtentIndex :
+    """
+    Stores for each user the datetimes of the first and last measurement,
+    to know the available data without downloading them.
+    The extents are kept in memory and persisted in a database table, they
+    can only grow as new data are seen.
+    """
+
+    def __init__(self, pool, table) :
+        """
+        Creates an instance of the class.
+        @type pool: ConnectionPool
+        @param pool: the pool of connections to the database.
+        @type table: String
+        @param table: the table storing the extents. It has the columns
+        user_id (primary key), first_measurement, last_measurement and
+        checked_at.
+        """
+        self.pool = pool
+        self.table = table
+        self.lock = threading.Lock()
+        self.extents = {}
+
+    def get(self, user_id) :
+        """
+        Gets the extent of the data of a user.
+        @type user_id: String
+        @param user_id: the user.
+        @rtype DataExtent
+        @return the extent, None if it is not known.
+        """
+        with self.lock :
+            if user_id in self.extents :
+                return self.extents[user_id]
+        sql_query = "SELECT first_measurement, last_measurement, checked_at" \
+                    + " FROM " + self.table + " WHERE user_id = %s"
+        with self.pool.connection() as mysql_cn :
+            with mysql_cn.cursor() as cursor :
+                cursor.execute(sql_query, (user_id,))
+                row = cursor.fetchone()
+        if row is None :
+            return None
+        with self.lock :
+            return self.extents.setdefault(user_id, DataExtent(*row))
+
+    def update(self, user_id, first, last, checked=None, create=True) :
+        """
+        Extends the extent of the data of a user with newly seen data. It is
+        persisted only if it changes.
+        @type user_id: String
+        @param user_id: the user.
+        @type first: datetime
+        @param first: the first datetime of the seen data.
+        @type last: datetime
+        @param last: the last datetime of the seen data.
+        @type checked: datetime
+        @param checked: when the server was asked for all the data following
+        the known ones, None if it was not.
+        @type create: bool
+        @param create: False to only extend a known extent, when the seen 
+        data may not be all the data of the user.
+        @rtype DataExtent
+        @return the updated extent, None if it is not known and not created.
+        """
+        extent = self.get(user_id)
+        with self.lock :
+            if extent is None :
+                if not create :
+                    return None
+                extent = DataExtent(first, last, checked)
+            elif first >= extent.first and last <= extent.last \
+             and checked is None :
+                return extent
+            else :
+                extent = DataExtent(min(first, extent.first),
+                                    max(last, extent.last),
+                                    checked or extent.checked)
+            self.extents[user_id] = extent
+        sql_query = "INSERT INTO " + self.table \
+            + " (user_id, first_measurement, last_measurement, checked_at)" \
+            + " VALUES (%s, %s, %s, %s) ON DUPLICATE KEY UPDATE" \
+            + " first_measurement = LEAST(first_measurement," \
+            + " VALUES(first_measurement))," \
+            + " last_measurement = GREATEST(last_measurement," \
+            + " VALUES(last_measurement))," \
+            + " checked_at = COALESCE(VALUES(checked_at), checked_at)"
+        with self.pool.connection() as mysql_cn :
+            with mysql_cn.cursor() as cursor :
+                cursor.execute(sql_query, (user_id, extent.first, extent.last,
+                                           extent.checked))
+            mysql_cn.commit()
+        return extent
+
+    def invalidate(self, user_id) :
+        """
+        Forgets the extent of a user kept in memory, so that it is read
+        again from the database.
+        @type user_id: String
+        @param user_id: the user.
+        """
+        with self.lock :
+            self.extents.pop(user_id, None)
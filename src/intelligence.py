@@ -25,7 +25,9 @@ information about his habits.
 """
 
 import pandas as pd
+import numpy as np
 import datetime as dt
+from enum import Enum
 
 from device import DeviceType
 from device import DeviceStateName
@@ -51,6 +53,51 @@ class Intelligence:
         self.sleep.sleep.compute_sleep_activities(event)
         #self.countUsers(data)  
 
+    # The attributes holding the state kept between the analyzed events
+    state_attributes = []
+
+    def getState(self) :
+        """
+        Gets the state kept between the analyzed events, to be stored and
+        restored later with setState.
+        @rtype dict
+        @return the values of the state_attributes, as JSON serializable 
+        values.
+        """
+        state = {}
+        for name in self.state_attributes :
+            value = getattr(self, name)
+            if isinstance(value, (dt.date, dt.datetime)) :
+                value = value.isoformat()
+            elif isinstance(value, Enum) :
+                value = value.name
+            elif isinstance(value, np.generic) :
+                value = value.item()
+            state[name] = value
+        return state
+
+    def setState(self, state) :
+        """
+        Restores a state got with getState. The values are converted to the
+        types of the defaults of the class.
+        @type state: dict
+        @param state: the values of the state_attributes.
+        """
+        for name in self.state_attributes :
+            if name not in state :
+                continue
+            default = getattr(type(self), name)
+            value = state[name]
+            if isinstance(default, dt.datetime) :
+                value = dt.datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%f' 
+                                             if '.' in value 
+                                             else '%Y-%m-%dT%H:%M:%S')
+            elif isinstance(default, dt.date) :
+                value = dt.datetime.strptime(value, '%Y-%m-%d').date()
+            elif isinstance(default, Enum) :
+                value = type(default)[value]
+            setattr(self, name, value)
+
 class PartialSleepData :
     result = None
     to_cache = None
@@ -58,7 +105,24 @@ class PartialSleepData :
     def __init__(self, result, to_cache):
         self.result = result
         self.to_cache = to_cache
-        
+
+def sleepingDay(start_bed) :
+    """
+    Gets the day a sleep activity belongs to. Sleep activities starting after
+    the day separator are referred to the following day.
+    @type start_bed: datetime
+    @param start_bed: the beginning of the sleep activity.
+    @rtype date
+    @return the day of the sleep activity.
+    """
+    if start_bed.time() >= \
+        dt.time(Configuration.HH_DAY_SLEEP_SEPARATOR,
+                Configuration.MM_DAY_SLEEP_SEPARATOR,
+                Configuration.SS_DAY_SLEEP_SEPARATOR) \
+        and start_bed.time() <= dt.time(23,59,59) :
+        return start_bed.date() + dt.timedelta(days=1)
+    return start_bed.date()
+
 class Sleep(Intelligence) :
     """
     Analyzes and learn user's sleep habits.
@@ -93,6 +157,11 @@ class Sleep(Intelligence) :
     
     current_sleep_day = dt.date(dt.MINYEAR, 1, 1)
     beginning_of_data = dt.datetime(dt.MAXYEAR, 1, 1, 0, 0, 0)
+
+    state_attributes = ['start_bed', 'tmp_start_bed', 'end_bed', 
+                        'count_micro_awakening', 'count_awakening',
+                        'time_micro_awakening', 'time_awakening', 
+                        'last_bed_value', 'current_sleep_day']
                   
     def computeSleepActivities(self, event) :
         """
@@ -171,14 +240,7 @@ class Sleep(Intelligence) :
             self.count_awakening += 1
             self.event_awakening = False
         elif self.event_sleep :
-            if self.start_bed.time() >= \
-                dt.time(Configuration.HH_DAY_SLEEP_SEPARATOR,
-                        Configuration.MM_DAY_SLEEP_SEPARATOR,
-                        Configuration.SS_DAY_SLEEP_SEPARATOR) \
-                and self.start_bed.time() <= dt.time(23,59,59) :
-                self.current_sleep_day = self.start_bed.date() + dt.timedelta(days=1)
-            else :
-                self.current_sleep_day = self.start_bed.date()
+            self.current_sleep_day = sleepingDay(self.start_bed)
             #print("Sleeping day: " + self.current_sleep_day.strftime('%Y-%m-%d')
             #    + " sleeping from: "
             #    + self.start_bed.strftime('%Y-%m-%d %H:%M:%S') 
@@ -213,3 +275,297 @@ class Sleep(Intelligence) :
             self.event_discard_sleep = False
         return sleep_df 
 
+class VectorizedSleep(Intelligence) :
+    """
+    Analyzes user's sleep habits like Sleep, but working on whole columns of
+    bed sensor data instead of one event at time.
+    The presses and the releases of the bed sensor are found at once and the
+    gaps between them are classified with array operations. Only the 
+    boundaries of the sleep activities (awakenings longer than
+    TIME_INTERVAL_FOR_AWAKENING and the day separators) are visited one by 
+    one.
+    The state is kept between calls exactly as Sleep does, so the two engines
+    produce the same records on the same events.
+    """
+
+    columns = ['date', 'start_datetime', 'end_datetime',
+               'count_micro_awakenings', 'time_micro_awakenings', 
+               'count_awakenings', 'time_awakenings']
+
+    # Same meaning of the homonymous attributes of Sleep
+    start_bed = dt.datetime(dt.MINYEAR, 1, 1, 1, 0, 0)
+    tmp_start_bed = dt.datetime(dt.MINYEAR, 1, 1, 1, 0, 0)
+    end_bed = dt.datetime(dt.MINYEAR, 1, 1, 1, 0, 0)
+    count_micro_awakening = 0
+    count_awakening = 0
+    time_micro_awakening = 0
+    time_awakening = 0
+    last_bed_value = DeviceStateValue.NOT_PRESENT
+    current_sleep_day = dt.date(dt.MINYEAR, 1, 1)
+
+    state_attributes = Sleep.state_attributes
+
+    def bedColumns(self, events) :
+        """
+        Extracts from a list of events the columns used by 
+        computeSleepActivities: only the presence events of bed devices are 
+        kept.
+        @type events: list of Event
+        @param events: the events to be analyzed.
+        @rtype tuple
+        @return a couple of numpy arrays: the datetimes (datetime64) and the
+        presence values (True when PRESENT, False when NOT_PRESENT).
+        """
+        timestamps = []
+        present = []
+        for event in events :
+            if event.datetime.year != dt.MINYEAR \
+             and event.device_id in self.devices \
+             and self.devices[event.device_id].type == DeviceType.BED \
+             and event.name_id == DeviceStateName.PRESENCE :
+                if event.value_id == DeviceStateValue.PRESENT :
+                    timestamps.append(event.datetime)
+                    present.append(True)
+                elif event.value_id == DeviceStateValue.NOT_PRESENT :
+                    timestamps.append(event.datetime)
+                    present.append(False)
+        return (np.array(timestamps, dtype='datetime64[us]'),
+                np.array(present, dtype=bool))
+
+    def measurementColumns(self, columns) :
+        """
+        Extracts from decoded measurements the columns used by 
+        computeSleepActivities, as bedColumns does from events.
+        @type columns: MeasurementColumns
+        @param columns: the decoded measurements.
+        @rtype tuple
+        @return a couple of numpy arrays: the datetimes (datetime64) and the
+        presence values (True when PRESENT, False when NOT_PRESENT).
+        """
+        decoder = columns.decoder
+        beds = decoder.deviceIndexes(
+            [device_id for device_id, device in self.devices.items()
+             if device.type == DeviceType.BED])
+        present_code = decoder.valueCode(DeviceStateValue.PRESENT)
+        not_present_code = decoder.valueCode(DeviceStateValue.NOT_PRESENT)
+        selected = np.isin(columns.devices, beds) \
+                   & (columns.states 
+                      == decoder.stateCode(DeviceStateName.PRESENCE)) \
+                   & ((columns.values == present_code) 
+                      | (columns.values == not_present_code))
+        return (columns.datetimes()[selected],
+                columns.values[selected] == present_code)
+
+    def computeSleepActivities(self, timestamps, present, separators=None) :
+        """
+        Analyzes sleeping habits on a sequence of bed presence values.
+        Each separator plays the role of the closing event that ends the 
+        events of a day in Sleep.
+        @type timestamps: numpy array of datetime64
+        @param timestamps: the ordered datetimes of the bed presence events.
+        @type present: numpy array of bool
+        @param present: True where the bed is PRESENT, False where it is 
+        NOT_PRESENT.
+        @type separators: numpy array of datetime64
+        @param separators: the ordered datetimes closing the days of data. 
+        The events before a separator are analyzed before closing it. None 
+        to close once after the last event.
+        @rtype dataframe
+        @return the dataframe containing the recognized sleep activities.
+        """
+        times = np.asarray(timestamps, dtype='datetime64[us]') \
+                  .astype(np.int64)
+        present = np.asarray(present, dtype=bool)
+        if separators is None :
+            closings = np.array([len(times)])
+        else :
+            closings = np.searchsorted(
+                times, np.asarray(separators, dtype='datetime64[us]')
+                            .astype(np.int64), side='left')
+        
+        # Keeps only the changes of value: a press follows a release and 
+        # vice versa.
+        previous = np.empty(len(present), dtype=bool)
+        if len(present) :
+            previous[0] = self.last_bed_value == DeviceStateValue.PRESENT
+            previous[1:] = present[:-1]
+        changes = np.nonzero(present != previous)[0]
+        edge_times = times[changes]
+        presses = present[changes]
+        closings = np.searchsorted(changes, closings, side='left')
+        releases = np.nonzero(~presses)[0]
+        
+        # The datetime of the release preceding each edge
+        end_bed = self.toMicroseconds(self.end_bed)
+        previous_release = np.empty(len(edge_times), dtype=np.int64)
+        if len(edge_times) :
+            previous_release[0] = 0 if end_bed is None else end_bed
+            previous_release[1:] = edge_times[:-1]
+        valid = presses.copy()
+        if end_bed is None and len(valid) :
+            valid[0] = False
+        gaps = edge_times - previous_release
+        seconds = gaps / 1e6
+        micro = valid \
+         & (seconds < Configuration.TIME_INTERVAL_FOR_MICRO_AWAKENING)
+        awakening = valid & ~micro \
+         & (seconds < Configuration.TIME_INTERVAL_FOR_AWAKENING)
+        breaks = np.nonzero(valid & ~micro & ~awakening)[0]
+        
+        # Cumulated counters to sum them between two boundaries
+        zero = np.zeros(1, dtype=np.int64)
+        count_micro = np.concatenate((zero, np.cumsum(micro)))
+        time_micro = np.concatenate((zero, np.cumsum(np.where(micro, gaps, 0))))
+        count_awakening = np.concatenate((zero, np.cumsum(awakening)))
+        time_awakening = \
+         np.concatenate((zero, np.cumsum(np.where(awakening, gaps, 0))))
+        press_indexes = np.nonzero(presses)[0]
+        
+        # The boundaries are visited in order; a separator is closed before 
+        # the edge having its same index.
+        boundaries = sorted([(int(i), 0) for i in closings]
+                            + [(int(i), 1) for i in breaks])
+        
+        start = self.toMicroseconds(self.start_bed)
+        first = 0
+        base = [self.count_micro_awakening, self.time_micro_awakening,
+                self.count_awakening, self.time_awakening]
+        position = 0
+        records = []
+        for index, is_break in boundaries :
+            if start is None :
+                # The first press after a recognized sleep starts a new one
+                found = np.searchsorted(press_indexes, position)
+                if found < len(press_indexes) \
+                 and press_indexes[found] < index :
+                    first = int(press_indexes[found])
+                    start = int(edge_times[first])
+            if is_break :
+                if start is not None :
+                    end = int(previous_release[index])
+                    if (end - start) / 1e6 >= \
+                     Configuration.MIN_TIME_INTERVAL_FOR_SLEEPING :
+                        records.append(self.createRecord(start, end, base,
+                          count_micro[index] - count_micro[first],
+                          time_micro[index] - time_micro[first],
+                          count_awakening[index] - count_awakening[first],
+                          time_awakening[index] - time_awakening[first]))
+                start = int(edge_times[index])
+                first = index
+                base = [0, 0, 0, 0]
+                position = index + 1
+            else :
+                if start is not None :
+                    found = np.searchsorted(releases, index) - 1
+                    if found >= 0 :
+                        end = int(edge_times[releases[found]])
+                    else :
+                        end = end_bed
+                    if end is not None and (end - start) / 1e6 >= \
+                     Configuration.MIN_TIME_INTERVAL_FOR_SLEEPING :
+                        records.append(self.createRecord(start, end, base,
+                          count_micro[index] - count_micro[first],
+                          time_micro[index] - time_micro[first],
+                          count_awakening[index] - count_awakening[first],
+                          time_awakening[index] - time_awakening[first]))
+                        start = None
+                        base = [0, 0, 0, 0]
+                position = index
+        
+        # Keeps the state for the next call
+        last = len(edge_times)
+        if start is None :
+            found = np.searchsorted(press_indexes, position)
+            if found < len(press_indexes) :
+                first = int(press_indexes[found])
+                start = int(edge_times[first])
+        if start is None :
+            self.start_bed = dt.datetime(dt.MINYEAR, 1, 1, 1, 0, 0)
+            self.count_micro_awakening = 0
+            self.time_micro_awakening = 0
+            self.count_awakening = 0
+            self.time_awakening = 0
+        else :
+            self.start_bed = self.fromMicroseconds(start)
+            (self.count_micro_awakening, self.time_micro_awakening,
+             self.count_awakening, self.time_awakening) = \
+             self.sumCounters(base,
+                              count_micro[last] - count_micro[first],
+                              time_micro[last] - time_micro[first],
+                              count_awakening[last] - count_awakening[first],
+                              time_awakening[last] - time_awakening[first])
+        if len(releases) :
+            self.end_bed = self.fromMicroseconds(edge_times[releases[-1]])
+        if len(press_indexes) :
+            self.tmp_start_bed = \
+             self.fromMicroseconds(edge_times[press_indexes[-1]])
+        if len(present) :
+            self.last_bed_value = DeviceStateValue.PRESENT if present[-1] \
+             else DeviceStateValue.NOT_PRESENT
+        if records :
+            self.current_sleep_day = records[-1][0]
+        return pd.DataFrame(records, columns=self.columns)
+
+    def sumCounters(self, base, micro_count, micro_time, awakening_count,
+                    awakening_time) :
+        """
+        Adds the counters of a part of a sleep activity to the ones already 
+        collected. Times are given in microseconds and summed in seconds, as
+        done by Sleep.
+        @type base: list
+        @param base: the collected counters of micro awakenings and 
+        awakenings (count and time in seconds).
+        @rtype tuple
+        @return the summed counters.
+        """
+        count_micro_awakening, time_micro_awakening, \
+         count_awakening, time_awakening = base
+        if micro_count :
+            count_micro_awakening += int(micro_count)
+            time_micro_awakening += micro_time / 1e6
+        if awakening_count :
+            count_awakening += int(awakening_count)
+            time_awakening += awakening_time / 1e6
+        return (count_micro_awakening, time_micro_awakening,
+                count_awakening, time_awakening)
+
+    def createRecord(self, start, end, base, count_micro, time_micro,
+                     count_awakening, time_awakening) :
+        """
+        Creates the record of a recognized sleep activity.
+        @type start: int
+        @param start: the beginning of the activity in microseconds.
+        @type end: int
+        @param end: the end of the activity in microseconds.
+        @rtype list
+        @return the values of the record in the order of columns.
+        """
+        start_bed = self.fromMicroseconds(start)
+        return [sleepingDay(start_bed), start_bed, self.fromMicroseconds(end)] \
+            + list(self.sumCounters(base, count_micro, time_micro,
+                                    count_awakening, time_awakening))
+
+    @staticmethod
+    def toMicroseconds(datetime) :
+        """
+        Converts a datetime in microseconds from the epoch.
+        @type datetime: datetime
+        @param datetime: the datetime to convert.
+        @rtype int
+        @return the microseconds or None if the datetime is not set (MINYEAR).
+        """
+        if datetime.year == dt.MINYEAR :
+            return None
+        return int(np.datetime64(datetime, 'us').astype(np.int64))
+
+    @staticmethod
+    def fromMicroseconds(microseconds) :
+        """
+        Converts microseconds from the epoch in a datetime.
+        @type microseconds: int
+        @param microseconds: the microseconds to convert.
+        @rtype datetime
+        @return the converted datetime.
+        """
+        return dt.datetime(1970, 1, 1) \
+            + dt.timedelta(microseconds=int(microseconds))
@@ -0,0 +1,189 @@
+"""
+Copyright 2018 Dario Russo <dario.russo@isti.cnr.it>
+
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+"""
+Runs batches of analyses in background.
+"""
+
+import threading
+import time
+import uuid
+import datetime as dt
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+class Job :
+    """
+    A batch of analyses, one for each user, whose progress can be followed
+    while it runs.
+    """
+
+    def __init__(self, user_ids, run) :
+        """
+        Creates an instance of the class.
+        @type user_ids: list of String
+        @param user_ids: the users to be analyzed.
+        @type run: function
+        @param run: the function taking a user and running its analysis.
+        """
+        self.id = uuid.uuid4().hex
+        self.run = run
+        self.created = dt.datetime.now()
+        self.lock = threading.Lock()
+        self.users = OrderedDict()
+        for user_id in user_ids :
+            self.users[user_id] = {'status': 'queued', 'started': None,
+                                   'finished': None, 'duration': None,
+                                   'error': None}
+
+    def runUser(self, user_id) :
+        """
+        Runs the analysis of a user, recording its duration and error.
+        @type user_id: String
+        @param user_id: the user to be analyzed.
+        """
+        user = self.users[user_id]
+        with self.lock :
+            user['status'] = 'running'
+            user['started'] = dt.datetime.now()
+        start = time.time()
+        error = None
+        try :
+            self.run(user_id)
+        except Exception as e :
+            error = e.getMessage() if hasattr(e, 'getMessage') else repr(e)
+            print("ERROR: analyzing user %s: %s" % (user_id, error))
+        with self.lock :
+            user['status'] = 'done' if error is None else 'failed'
+            user['finished'] = dt.datetime.now()
+            user['duration'] = time.time() - start
+            user['error'] = error
+
+    def isFinished(self) :
+        """
+        Checks if the analyses of all the users are finished.
+        @rtype bool
+        @return True if no user is queued or running.
+        """
+        with self.lock :
+            return all(user['finished'] is not None
+                       for user in self.users.values())
+
+    def getStatus(self) :
+        """
+        Gets the progress of the job.
+        @rtype dict
+        @return the status of the job, the counts of users by status and for
+        each user its status, datetimes, duration in seconds and error.
+        """
+        with self.lock :
+            counts = {'queued': 0, 'running': 0, 'done': 0, 'failed': 0}
+            users = {}
+            for user_id, user in self.users.items() :
+                counts[user['status']] += 1
+                users[user_id] = {
+                    'status': user['status'],
+                    'started': None if user['started'] is None
+                               else user['started'].isoformat(),
+                    'finished': None if user['finished'] is None
+                                else user['finished'].isoformat(),
+                    'duration': user['duration'],
+                    'error': user['error']}
+        if counts['queued'] + counts['running'] > 0 :
+            status = 'running' if counts['queued'] < len(users) else 'queued'
+        else :
+            status = 'done' if counts['failed'] == 0 else 'failed'
+        return {'job_id': self.id, 'status': status,
+                'created': self.created.isoformat(), 'users': len(users),
+                'progress': counts, 'results': users}
+
+class JobManager :
+    """
+    Runs jobs with a bounded pool of workers shared by all of them. The
+    finished jobs are kept to be queried, up to a maximum number.
+    """
+
+    def __init__(self, workers=4, max_jobs=100) :
+        """
+        Creates an instance of the class.
+        @type workers: int
+        @param workers: the number of users analyzed at the same time.
+        @type max_jobs: int
+        @param max_jobs: the maximum number of jobs kept.
+        """
+        self.workers = workers
+        self.max_jobs = max_jobs
+        self.lock = threading.Lock()
+        self.executor = None
+        self.jobs = OrderedDict()
+
+    def submit(self, user_ids, run) :
+        """
+        Queues a job, returning without waiting for it.
+        @type user_ids: list of String
+        @param user_ids: the users to be analyzed.
+        @type run: function
+        @param run: the function taking a user and running its analysis.
+        @rtype Job
+        @return the queued job.
+        """
+        job = Job(user_ids, run)
+        with self.lock :
+            if self.executor is None :
+                self.executor = ThreadPoolExecutor(
+                    max_workers=self.workers)
+            self.jobs[job.id] = job
+            # Forgets the oldest finished jobs
+            for job_id in list(self.jobs) :
+                if len(self.jobs) <= self.max_jobs :
+                    break
+                if self.jobs[job_id].isFinished() :
+                    del self.jobs[job_id]
+            for user_id in job.users :
+                self.executor.submit(job.runUser, user_id)
+        return job
+
+    def get(self, job_id) :
+        """
+        Gets a job.
+        @type job_id: String
+        @param job_id: the identifier of the job.
+        @rtype Job
+        @return the job, None if not found.
+        """
+        with self.lock :
+            return self.jobs.get(job_id)
+
+    def getStats(self) :
+        """
+        Gets the usage statistics of the workers.
+        @rtype dict
+        @return the number of workers, of kept jobs and of queued, running,
+        done and failed users.
+        """
+        with self.lock :
+            jobs = list(self.jobs.values())
+        stats = {'workers': self.workers, 'jobs': len(jobs), 'queued': 0,
+                 'running': 0, 'done': 0, 'failed': 0}
+        for job in jobs :
+            for status, count in job.getStatus()['progress'].items() :
+                stats[status] += count
+        return stats
@@ -26,7 +26,8 @@ Defines the introduction points to use the application.
 """
 
 import os
-from flask import Flask, jsonify, request
+import hashlib
+from flask import Flask, jsonify, request, make_response
 
 app = Flask(__name__, static_folder=os.path.join('/home/vcap/app/static'), static_url_path='')
 
@@ -35,6 +36,15 @@ import datetime as dt
 from client import C2KRestClient
 from mapping import C2KEventMapping
 from analitics import Analitics
+from plots import PlotException
+from plots import FORMATS
+from configuration import Configuration
+from jobs import JobManager
+from scheduler import NightlyScheduler
+
+# Runs the batches of analyses requested with /post
+batch_jobs = JobManager(Configuration.BATCH_WORKERS, 
+                        Configuration.BATCH_MAX_JOBS)
 
 class InputParamsException(Exception) :
     def __init__(self, message) :
@@ -69,8 +79,8 @@ def fixInputParams(argv) :
         params['sleep']['action'] = argv[1]
         params['sleep']['param_1'] = argv[2]
         params['sleep']['param_2'] = argv[3]
-        params['sleep']['param_4'] = argv[4]
-        params['sleep']['param_5'] = argv[5]
+        params['sleep']['param_3'] = argv[4]
+        params['sleep']['param_4'] = argv[5]
     except IndexError :
         pass
                                     
@@ -97,6 +107,9 @@ def fixInputParams(argv) :
                     + 'The date must be in the following format: '
                     + 'YYYY-mm-dd (e.g. 2017-07-29)."}')
     if params['sleep']['action'] == 'analyze' : 
+        for param in ('param_3', 'param_4') :
+            if params['sleep'][param] == "None" :
+                params['sleep'][param] = None
         if params['sleep']['param_3'] != None:
             try :
                 params['sleep']['param_3'] =  \
@@ -114,7 +127,7 @@ def fixInputParams(argv) :
                                       '%Y-%m-%d')
             except ValueError :
                 raise InputParamsException('{"ERROR": ' 
-                    + params['sleep']['param_1'] + ' is not a valid date. ' 
+                    + params['sleep']['param_4'] + ' is not a valid date. ' 
                     + 'The date must be in the following format: '
                     + 'YYYY-mm-dd (e.g. 2017-07-29)."}')
     if params['sleep']['action'] == 'cosine' :
@@ -153,6 +166,55 @@ def fixInputParams(argv) :
                         + params['sleep']['param_4'] + ' is not a valid date. ' 
                         + 'The date must be in the following format: '
                         + 'YYYY-mm-dd (e.g. 2017-07-29)."}')
+    if params['sleep']['action'] == 'cohort' :
+        if params['sleep']['param_3'] == None \
+         or params['sleep']['param_3'] == "None" :
+            params['sleep']['param_3'] = None
+        else :
+            params['sleep']['param_3'] = \
+             [user_id.strip() for user_id in 
+              params['sleep']['param_3'].split(',') if user_id.strip()]
+        if params['sleep']['param_4'] == None \
+         or params['sleep']['param_4'] == "None" :
+            params['sleep']['param_4'] = None
+        else :
+            try :
+                params['sleep']['param_4'] = int(params['sleep']['param_4'])
+            except ValueError :
+                raise InputParamsException('{"ERROR": ' 
+                    + params['sleep']['param_4'] + ' is not an integer."}')
+    if params['sleep']['action'] in ('similarity', 'rolling') :
+        if params['sleep']['param_3'] == None \
+         or params['sleep']['param_3'] == "None" :
+            params['sleep']['param_3'] = None
+        else :
+            try :
+                params['sleep']['param_3'] = int(params['sleep']['param_3'])
+            except ValueError :
+                raise InputParamsException('{"ERROR": ' 
+                    + params['sleep']['param_3'] + ' is not an integer."}')
+    if params['sleep']['action'] == 'plot' :
+        if params['sleep']['param_3'] == None \
+         or params['sleep']['param_3'] == "None" :
+            params['sleep']['param_3'] = None
+        elif params['sleep']['param_3'] not in FORMATS :
+            raise InputParamsException('{"ERROR": ' 
+                + params['sleep']['param_3'] + ' is not a valid format. '
+                + 'The format must be one of: ' 
+                + ', '.join(sorted(FORMATS)) + '."}')
+        if params['sleep']['param_4'] == None \
+         or params['sleep']['param_4'] == "None" :
+            params['sleep']['param_4'] = None
+        else :
+            try :
+                params['sleep']['param_4'] = \
+                 dt.datetime.strptime(params['sleep']['param_4'], 
+                                      '%Y-%m-%dT%H')
+            except ValueError :
+                raise InputParamsException('{"ERROR": ' 
+                    + params['sleep']['param_4'] + ' is not a valid hour. ' 
+                    + 'The hour must be in the following format: '
+                    + 'YYYY-mm-ddTHH (e.g. 2017-07-29T23)."}')
     return params
 
 def main(argv):
@@ -162,7 +224,8 @@ def main(argv):
     @type argv: array
     @param argv CLI parameters.
     @rtype string
-    @return the result of the requested analytic or an error message.
+    @return the result of the requested analytic, None for an error. The
+    result of plot is a tuple with the mime type and the bytes.
     """
     try :
         params = fixInputParams(argv)
@@ -172,8 +235,105 @@ def main(argv):
         mapping = C2KEventMapping()
         client = C2KRestClient(params, mapping)
         analitics = Analitics(client)
-        return(analitics.execute(params) \
-            .to_json(None, 'records', 'iso', 12, True, 's'))     
+        try :
+            result = analitics.execute(params)
+        except PlotException as e:
+            print(e.getMessage())
+            return None
+        # The plots are given as the mime type and the bytes of the images
+        if params['sleep']['action'] == 'plot' :
+            return result
+        return(result.to_json(None, 'records', 'iso', 12, True, 's'))     
+
+def respond(argv):
+    """
+    Runs main, answering from the cache of the responses when possible.
+    The responses carry ETag and Last-Modified headers: when the caller
+    already has the current version, 304 is answered without the body.
+    @type argv: array
+    @param argv CLI parameters.
+    @rtype Response
+    @return the response with the result of the requested analytic.
+    """
+    key = responseKey(argv)
+    cached = C2KRestClient.response_cache.get(key)
+    if cached is None :
+        result = main(argv)
+        if result is None :
+            return result
+        if isinstance(result, tuple) :
+            mimetype, body = result
+        else :
+            mimetype, body = None, result.encode('utf-8')
+        cached = {'body': body, 'etag': hashlib.sha1(body).hexdigest(),
+                  'last_modified': dt.datetime.utcnow().replace(microsecond=0),
+                  'mimetype': mimetype}
+        C2KRestClient.response_cache.put(key, cached)
+    response = make_response(cached['body'])
+    if cached['mimetype'] is not None :
+        response.mimetype = cached['mimetype']
+    response.set_etag(cached['etag'])
+    response.last_modified = cached['last_modified']
+    return response.make_conditional(request)
+
+def responseKey(argv):
+    """
+    Gets the key of the cached response of a request.
+    @type argv: array
+    @param argv CLI parameters.
+    @rtype tuple
+    @return the user, the first and the last day the response depends on 
+    (None when they are not known before the request is run) and the 
+    parameters.
+    """
+    first_day, last_day = responseDays(argv)
+    return (argv[0], first_day, last_day, tuple(str(param) for param in argv))
+
+def responseDays(argv):
+    """
+    Gets the interval of days whose sleep data are read by a request.
+    @type argv: array
+    @param argv CLI parameters.
+    @rtype tuple
+    @return the first and the last day, as YYYY-mm-dd, None when they 
+    depend on the first or last available day or the parameters are not
+    valid.
+    """
+    try :
+        start_date, end_date = [None if param is None or param == "None" 
+                                else dt.datetime.strptime(param, '%Y-%m-%d')
+                                for param in argv[2:4]]
+        # Missing dates are replaced by the first and last available days
+        if start_date is None or end_date is None :
+            return (None, None)
+        ranges = [(start_date, end_date)]
+        params = [None if param == "None" else param for param in argv[4:6]]
+        if argv[1] == 'analyze' :
+            # The average is taken over the analyzed days if no other days
+            # are given
+            ranges.append(tuple(end if param is None 
+                                else dt.datetime.strptime(param, '%Y-%m-%d')
+                                for param, end in zip(params, ranges[0])))
+        elif argv[1] == 'cosine' :
+            if params[0] is None :
+                ranges = [(start_date, start_date), (end_date, end_date)]
+            elif params[1] is None :
+                # Day by day for param_3 days from both dates
+                last_day = dt.timedelta(days=max(int(params[0]), 1) - 1)
+                ranges = [(start_date, start_date + last_day), 
+                          (end_date, end_date + last_day)]
+            else :
+                ranges.append((dt.datetime.strptime(params[0], '%Y-%m-%d'),
+                               dt.datetime.strptime(params[1], '%Y-%m-%d')))
+        elif argv[1] == 'rolling' :
+            # Each night is compared with the nights before it
+            nights = Configuration.ROLLING_NIGHTS if params[0] is None \
+                     else int(params[0])
+            ranges = [(start_date - dt.timedelta(days=nights), end_date)]
+    except (TypeError, ValueError) :
+        return (None, None)
+    days = [day for day_range in ranges for day in day_range]
+    return (min(days).strftime('%Y-%m-%d'), max(days).strftime('%Y-%m-%d'))
 
 @app.route('/')
 def Welcome():
@@ -197,45 +357,116 @@ def Help():
 def catch_all(path):
     return app.send_static_file(path)
 
+@app.route('/stats')
+def stats():
+    """
+    Returns the usage statistics of the resources shared by the requests.
+    """
+    return jsonify({'db_pool': C2KRestClient.getConnectionPool().getStats(),
+                    'rest': C2KRestClient.getRestSession().getStats(),
+                    'device_maps': C2KRestClient.device_map_cache.getStats(),
+                    'responses': C2KRestClient.response_cache.getStats(),
+                    'jobs': batch_jobs.getStats(),
+                    'cohort': C2KRestClient.getCohortIndex().getStats(),
+                    'plots': Analitics.getPlotRenderer().getStats(),
+                    'nightly': nightly_scheduler.last_summary})
+
+def analyzeDay(user_id, day):
+    """
+    Calculates the sleep activities of a user for a day, storing them in the
+    cache.
+    @type user_id: String
+    @param user_id: the user.
+    @type day: date
+    @param day: the day to analyze.
+    @raise InputParamsException when the parameters are not valid, so that
+    the user is recorded as failed.
+    """
+    params = fixInputParams([user_id, 'activity', day.strftime("%Y-%m-%d"),
+                             day.strftime("%Y-%m-%d"), None, None])
+    client = C2KRestClient(params, C2KEventMapping())
+    Analitics(client).execute(params)
+    refreshCohortVector(user_id, day)
+
+def refreshCohortVector(user_id, day):
+    """
+    Updates the vector of the recent average sleep of a user, compared with
+    the other users by the cohort action.
+    @type user_id: String
+    @param user_id: the user.
+    @type day: date
+    @param day: the last day to average.
+    """
+    params = fixInputParams([user_id, 'average', day.strftime("%Y-%m-%d"),
+                             day.strftime("%Y-%m-%d"), None, None])
+    client = C2KRestClient(params, C2KEventMapping())
+    Analitics(client).refreshCohortVector(day)
+
+# Precomputes every night the day before of the configured users. It is
+# started when the module is run as a script; a WSGI server imports the
+# module instead, so the WSGI entry has to start it once per process:
+#   from main import app, nightly_scheduler
+#   nightly_scheduler.start()
+nightly_scheduler = NightlyScheduler(analyzeDay)
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """
+    Returns the progress of a batch started with /post.
+    """
+    job = batch_jobs.get(job_id)
+    if job is None :
+        return jsonify({'ERROR': 'Job ' + job_id + ' not found.'}), 404
+    return jsonify(job.getStatus())
+
 @app.route('/<user_id>/<action>')
 def action_no_params(user_id, action):
     argv = [user_id, action, None, None, None, None]
-    return main(argv)
+    return respond(argv)
 
 @app.route('/<user_id>/<action>/<param_1>')
 def action_one_param(user_id, action, param_1):
     argv = [user_id, action, param_1, None, None, None]
-    return main(argv)
+    return respond(argv)
 
 @app.route('/<user_id>/<action>/<param_1>/<param_2>')
 def action_two_params(user_id, action, param_1, param_2):
     argv = [user_id, action, param_1, param_2, None, None]
-    return main(argv)
+    return respond(argv)
 
 
 @app.route('/<user_id>/<action>/<param_1>/<param_2>/<param_3>')
 def action_three_params(user_id, action, param_1, param_2, param_3):
     argv = [user_id, action, param_1, param_2, param_3, None]
-    return main(argv)
+    return respond(argv)
 
-@app.route('/<user_id>/<action>/<param_1>/<param_2>/<param_3>')
+@app.route('/<user_id>/<action>/<param_1>/<param_2>/<param_3>/<param_4>')
 def action_four_params(user_id, action, param_1, param_2, param_3, param_4):
     argv = [user_id, action, param_1, param_2, param_3, param_4]
-    return main(argv)
+    return respond(argv)
 
 @app.route('/post', methods=['POST'])
 def post():
+    """
+    Starts in background the analysis of the day before for a list of 
+    users. The progress can be followed with /jobs/<job_id>.
+    """
     users = request.values.get('users')
-    user_ids = users.split(',')
+    user_ids = [user_id.strip() for user_id in users.split(',') 
+                if user_id.strip()]
     yesterday = dt.datetime.now().date()
     yesterday -= dt.timedelta(days=1)
-    for user_id in user_ids :
-        argv = [user_id, 'activity', yesterday.strftime("%Y-%m-%d"),
-                yesterday.strftime("%Y-%m-%d"), None, None]
-        main(argv)
-    return '{"RESULT": "OK"}'
+    job = batch_jobs.submit(user_ids, 
+                            lambda user_id : analyzeDay(user_id, yesterday))
+    return jsonify({'RESULT': 'OK', 'JOB_ID': job.id}), 202
         
     
 port = os.getenv('PORT', '5000')
+# The debug mode, with the reloader, unless FLASK_DEBUG is 0
+debug = os.getenv('FLASK_DEBUG', '1') != '0'
 if __name__ == "__main__":
-    app.run(host='0.0.0.0', port=int(port), debug=True)
+    # In debug mode the application is run by a child process of the 
+    # reloader: only there the scheduler is started
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true' :
+        nightly_scheduler.start()
+    app.run(host='0.0.0.0', port=int(port), debug=debug)
@@ -172,7 +172,12 @@ class C2KEventMapping(EventMapping) :
     Implements the EventMapping class for C2K server.
     """
 
-    device_map = {}
+    def __init__(self) :
+        """
+        Creates an instance of the class. Each instance has its own mapped 
+        devices, so instances created for different users don't mix them.
+        """
+        self.device_map = {}
         
     def mapAndAddDeviceMap(self, row) :
         device_functions = {}
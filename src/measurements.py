@@ -0,0 +1,435 @@
+"""
+Copyright 2018 Dario Russo <dario.russo@isti.cnr.it>
+
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+"""
+Reads the measurements sent by the C2K server.
+"""
+
+import codecs
+import datetime as dt
+import json
+import re
+from array import array
+
+import numpy as np
+
+class MeasurementStream :
+    """
+    Parses a response of the server while it is received, without loading
+    it all in memory.
+    The rows of the RESULTS list are decoded one at a time, in the order 
+    they are received: they are given to MeasurementDecoder, or only 
+    consumed to know the period of time they cover.
+    """
+
+    # The bytes read from the response at a time
+    CHUNK_SIZE = 64 * 1024
+
+    RESULTS_START = re.compile(r'"RESULTS"\s*:\s*\[')
+    SEPARATORS = re.compile(r'[\s,]*')
+
+    def __init__(self, chunks) :
+        """
+        Creates an instance of the class.
+        @type chunks: iterable of bytes
+        @param chunks: the content of the response, as it is received.
+        """
+        self.chunks = chunks
+        # The datetimes of the first and last consumed rows
+        self.first = None
+        self.last = None
+        self.stats = {'rows': 0}
+
+    def consume(self) :
+        """
+        Parses all the rows only to know the first and last datetime.
+        @rtype int
+        @return the number of parsed rows.
+        """
+        for row in self.rows() :
+            timestamp = row['timestamp']
+            datetime = dt.datetime(timestamp['year'], timestamp['monthValue'],
+                                   timestamp['dayOfMonth'], timestamp['hour'],
+                                   timestamp['minute'], timestamp['second'])
+            if self.first is None or datetime < self.first :
+                self.first = datetime
+            if self.last is None or datetime > self.last :
+                self.last = datetime
+            self.stats['rows'] += 1
+        return self.stats['rows']
+
+    def rows(self) :
+        """
+        Decodes the rows of the RESULTS list in the order they are received.
+        @rtype generator of dict
+        @return the rows as sent by the server.
+        @raise ValueError when the response is not a list of results.
+        """
+        decoder = json.JSONDecoder()
+        texts = self.texts()
+        buffer = ''
+        ended = False
+        # Skips everything up to the beginning of the list
+        match = self.RESULTS_START.search(buffer)
+        while match is None :
+            if ended :
+                raise ValueError('{"ERROR": "No RESULTS in the response."}')
+            # The tail is kept as it can hold the beginning of the key
+            buffer = buffer[-64:]
+            text = next(texts, None)
+            ended = text is None
+            buffer += text or ''
+            match = self.RESULTS_START.search(buffer)
+        position = match.end()
+        while True :
+            position = self.SEPARATORS.match(buffer, position).end()
+            if position < len(buffer) :
+                if buffer[position] == ']' :
+                    return
+                try :
+                    row, position = decoder.raw_decode(buffer, position)
+                    yield row
+                    continue
+                except json.JSONDecodeError :
+                    # The row is not received yet if the response goes on
+                    if ended :
+                        raise
+            elif ended :
+                raise ValueError('{"ERROR": "Truncated response."}')
+            buffer = buffer[position:]
+            position = 0
+            text = next(texts, None)
+            ended = text is None
+            buffer += text or ''
+
+    def texts(self) :
+        """
+        Decodes the received bytes.
+        @rtype generator of String
+        @return the decoded text of each chunk.
+        """
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        for chunk in self.chunks :
+            if chunk :
+                yield decoder.decode(chunk)
+        yield decoder.decode(b'', final=True)
+
+class MeasurementColumns :
+    """
+    Measurements decoded into typed columns. The devices, states and values
+    are stored as codes, indexes of the tables of the decoder, so an event
+    takes 20 bytes.
+    The measurements can be sliced by time with a binary search and are
+    iterated as MeasurementEvent views, that can be used in place of the
+    events.
+    """
+
+    def __init__(self, timestamps, devices, states, values, decoder) :
+        """
+        Creates an instance of the class.
+        @type timestamps: numpy array of int64
+        @param timestamps: the seconds from the epoch of the measurements.
+        @type devices: numpy array of int32
+        @param devices: the indexes of the devices in decoder.device_ids.
+        @type states: numpy array of int32
+        @param states: the indexes of the states in decoder.state_names.
+        @type values: numpy array of int32
+        @param values: the indexes of the values in decoder.value_table.
+        @type decoder: MeasurementDecoder
+        @param decoder: the decoder holding the tables of the codes.
+        """
+        self.timestamps = timestamps
+        self.devices = devices
+        self.states = states
+        self.values = values
+        self.decoder = decoder
+
+    def __len__(self) :
+        return len(self.timestamps)
+
+    def __getitem__(self, index) :
+        if index < 0 :
+            index += len(self.timestamps)
+        if index < 0 or index >= len(self.timestamps) :
+            raise IndexError(index)
+        return MeasurementEvent(self, index)
+
+    def __iter__(self) :
+        for index in range(len(self.timestamps)) :
+            yield MeasurementEvent(self, index)
+
+    def between(self, start_datetime=None, end_datetime=None) :
+        """
+        Gets the measurements in a time interval, found with a binary
+        search. The columns of the result are views of these ones.
+        @type start_datetime: datetime
+        @param start_datetime: the measurements before are skipped, None to
+        keep them.
+        @type end_datetime: datetime
+        @param end_datetime: the measurements from it on are skipped, None
+        to keep them.
+        @rtype MeasurementColumns
+        @return the measurements in the time interval.
+        """
+        begin = 0 if start_datetime is None \
+         else np.searchsorted(self.timestamps,
+                              self.decoder.toSeconds(start_datetime))
+        end = len(self.timestamps) if end_datetime is None \
+         else np.searchsorted(self.timestamps,
+                              self.decoder.toSeconds(end_datetime))
+        return MeasurementColumns(self.timestamps[begin:end],
+                                  self.devices[begin:end],
+                                  self.states[begin:end],
+                                  self.values[begin:end], self.decoder)
+
+    def datetimes(self, unit='us') :
+        """
+        Gets the datetimes of the measurements.
+        @type unit: String
+        @param unit: the unit of the datetime64 values.
+        @rtype numpy array of datetime64
+        @return the datetimes.
+        """
+        return self.timestamps.astype('datetime64[s]') \
+         .astype('datetime64[' + unit + ']')
+
+class MeasurementEvent :
+    """
+    A view of a measurement of MeasurementColumns with the attributes and 
+    the methods of an Event, decoded when they are read.
+    """
+
+    __slots__ = ('columns', 'index')
+
+    EPOCH = dt.datetime(1970, 1, 1)
+
+    def __init__(self, columns, index) :
+        """
+        Creates an instance of the class.
+        @type columns: MeasurementColumns
+        @param columns: the measurements.
+        @type index: int
+        @param index: the position of the measurement.
+        """
+        self.columns = columns
+        self.index = index
+
+    @property
+    def datetime(self) :
+        return self.EPOCH + dt.timedelta(
+            seconds=int(self.columns.timestamps[self.index]))
+
+    @property
+    def device_id(self) :
+        return self.columns.decoder.device_ids[
+            self.columns.devices[self.index]]
+
+    @property
+    def name_id(self) :
+        return self.columns.decoder.state_names[
+            self.columns.states[self.index]]
+
+    @property
+    def value_id(self) :
+        return self.columns.decoder.value_table[
+            self.columns.values[self.index]]
+
+    def getDatetime(self) :
+        return self.datetime
+
+    def getDeviceId(self) :
+        return self.device_id
+
+    def getNameId(self) :
+        return self.name_id
+
+    def getValueId(self) :
+        return self.value_id
+
+    def prettyPrint(self):
+        """
+        Outputs the event for debugging.
+        """
+        print("[%s] %s %s %s" % (self.datetime.strftime('%Y-%m-%d %H:%M:%S'),
+                                 self.device_id, self.name_id, self.value_id))
+
+class MeasurementDecoder :
+    """
+    Decodes measurements into typed columns, using lookup tables compiled
+    from the mapped devices of a C2KEventMapping.
+    The rows of devices or states that are not mapped are counted and
+    skipped. Values not mapped by a known state are kept as they are, as 
+    mapEvent does.
+    """
+
+    EPOCH_ORDINAL = dt.date(1970, 1, 1).toordinal()
+
+    def __init__(self, device_map) :
+        """
+        Creates an instance of the class.
+        @type device_map: dict
+        @param device_map: the DeviceMapping of the devices, by identifier.
+        """
+        self.device_ids = list(device_map)
+        self.state_names = []
+        self.value_table = []
+        self.value_codes = {}
+        # The device index, state code and value codes of each pair of
+        # device identifier and measurement type
+        self.lookup = {}
+        state_codes = {}
+        for device_index, device_id in enumerate(self.device_ids) :
+            for service_id, state in device_map[device_id].states.items() :
+                if state.name not in state_codes :
+                    state_codes[state.name] = len(self.state_names)
+                    self.state_names.append(state.name)
+                value_codes = {}
+                for value_id, value in state.values.items() :
+                    value_codes[value_id] = self.valueCode(value)
+                self.lookup[(device_id, service_id)] = \
+                 (device_index, state_codes[state.name], value_codes)
+        # The seconds from the epoch of the beginning of the seen days
+        self.days = {}
+        self.stats = {'rows': 0, 'decoded': 0, 'unmapped': 0, 'sorted': 0}
+
+    def decode(self, rows, start_datetime=None, end_datetime=None) :
+        """
+        Decodes measurements, keeping those in a time interval. The columns
+        are sorted by time only if the measurements are not.
+        @type rows: iterable of dict
+        @param rows: the measurements as sent by the server.
+        @type start_datetime: datetime
+        @param start_datetime: the measurements before are skipped, None to
+        keep them.
+        @type end_datetime: datetime
+        @param end_datetime: the measurements from it on are skipped, None
+        to keep them.
+        @rtype MeasurementColumns
+        @return the decoded measurements.
+        """
+        start = None if start_datetime is None \
+         else self.toSeconds(start_datetime)
+        end = None if end_datetime is None else self.toSeconds(end_datetime)
+        timestamps = array('q')
+        devices = array('i')
+        states = array('i')
+        values = array('i')
+        lookup = self.lookup
+        days = self.days
+        rows_count = 0
+        unmapped = 0
+        for row in rows :
+            rows_count += 1
+            mapped = lookup.get((row['sensor']['id'],
+                                 row['measurementTypeDesc']))
+            if mapped is None :
+                unmapped += 1
+                continue
+            timestamp = row['timestamp']
+            day = (timestamp['year'], timestamp['monthValue'],
+                   timestamp['dayOfMonth'])
+            seconds = days.get(day)
+            if seconds is None :
+                seconds = (dt.date(*day).toordinal() - self.EPOCH_ORDINAL) \
+                          * 86400
+                days[day] = seconds
+            seconds += timestamp['hour'] * 3600 + timestamp['minute'] * 60 \
+                       + timestamp['second']
+            if (start is not None and seconds < start) \
+             or (end is not None and seconds >= end) :
+                continue
+            device_index, state_code, value_codes = mapped
+            value_code = value_codes.get(row['value'])
+            if value_code is None :
+                value_code = self.valueCode(row['value'])
+            timestamps.append(seconds)
+            devices.append(device_index)
+            states.append(state_code)
+            values.append(value_code)
+        columns = MeasurementColumns(
+            np.frombuffer(timestamps, dtype=np.int64).copy(),
+            np.frombuffer(devices, dtype=np.int32).copy(),
+            np.frombuffer(states, dtype=np.int32).copy(),
+            np.frombuffer(values, dtype=np.int32).copy(), self)
+        if len(columns) > 1 and (np.diff(columns.timestamps) < 0).any() :
+            # Stable, as the order of the server is kept for equal times
+            order = np.argsort(columns.timestamps, kind='stable')
+            columns.timestamps = columns.timestamps[order]
+            columns.devices = columns.devices[order]
+            columns.states = columns.states[order]
+            columns.values = columns.values[order]
+            self.stats['sorted'] += 1
+        self.stats['rows'] += rows_count
+        self.stats['decoded'] += len(columns)
+        self.stats['unmapped'] += unmapped
+        return columns
+
+    def valueCode(self, value) :
+        """
+        Gets the code of a value, adding it to the table if new.
+        @type value: DeviceStateValue or String
+        @param value: the mapped value or the value sent by the server.
+        @rtype int
+        @return the index of the value in value_table.
+        """
+        code = self.value_codes.get(value)
+        if code is None :
+            code = len(self.value_table)
+            self.value_codes[value] = code
+            self.value_table.append(value)
+        return code
+
+    def deviceIndexes(self, device_ids) :
+        """
+        Gets the indexes of devices.
+        @type device_ids: iterable
+        @param device_ids: the identifiers of the devices.
+        @rtype list of int
+        @return the indexes of the mapped devices.
+        """
+        return [index for index, device_id in enumerate(self.device_ids)
+                if device_id in device_ids]
+
+    def stateCode(self, state_name) :
+        """
+        Gets the code of a state.
+        @type state_name: DeviceStateName
+        @param state_name: the name of the state.
+        @rtype int
+        @return the code, -1 if no device has the state.
+        """
+        if state_name in self.state_names :
+            return self.state_names.index(state_name)
+        return -1
+
+    def toSeconds(self, datetime) :
+        """
+        Converts a datetime in seconds from the epoch, with no time zone.
+        Fractions of second are rounded up, so the measurements (that have
+        no fractions) compare with the result as with the datetime.
+        @type datetime: datetime
+        @param datetime: the datetime to convert.
+        @rtype int
+        @return the seconds from the epoch.
+        """
+        return (datetime.toordinal() - self.EPOCH_ORDINAL) * 86400 \
+               + datetime.hour * 3600 + datetime.minute * 60 \
+               + datetime.second + (1 if datetime.microsecond else 0)
@@ -0,0 +1,226 @@
+"""
+Copyright 2018 Dario Russo <dario.russo@isti.cnr.it>
+
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+"""
+Renders the plots of the states of the devices in memory.
+Matplotlib is needed only to render the plots.
+"""
+
+import hashlib
+import io
+import multiprocessing
+import threading
+import zipfile
+
+import pandas as pd
+
+from cache import SizedLRUCache
+
+# The formats the panels can be rendered in, with their mime types
+FORMATS = {'png': 'image/png', 'svg': 'image/svg+xml'}
+
+class PlotException(Exception) :
+    def __init__(self, message) :
+        self.message = message
+
+    def getMessage(self) :
+        return self.message
+
+def renderPanel(panel, image_format, figsize) :
+    """
+    Renders a panel as a bar chart for each column, without the global
+    state of pyplot. It is run by the processes of the pool.
+    @type panel: dataframe
+    @param panel: the states of the devices for each minute of the panel.
+    @type image_format: String
+    @param image_format: the format of the image, 'png' or 'svg'.
+    @type figsize: tuple
+    @param figsize: the width and height of the image in inches.
+    @rtype bytes
+    @return the image.
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    figure = Figure(figsize=figsize)
+    FigureCanvasAgg(figure)
+    axes = [figure.add_subplot(len(panel.columns), 1, i + 1)
+            for i in range(len(panel.columns))]
+    panel.plot.bar(subplots=True, ax=axes)
+    image = io.BytesIO()
+    figure.savefig(image, format=image_format)
+    return image.getvalue()
+
+class PlotRenderer :
+    """
+    Renders the hourly panels of the states of the devices in a pool of
+    processes, straight to the bytes of the images.
+    The rendered panels are cached by the digest of their content, so the
+    panels already seen are not rendered again, whatever the request that
+    asks them.
+    """
+
+    # The size in inches of a panel
+    FIGSIZE = (20, 20)
+
+    def __init__(self, workers=2, cache_size=1000,
+                 cache_bytes=128 * 1024 * 1024) :
+        """
+        Creates an instance of the class.
+        @type workers: int
+        @param workers: the processes rendering the panels, 0 to render them
+        in the calling process.
+        @type cache_size: int
+        @param cache_size: the maximum number of cached panels.
+        @type cache_bytes: int
+        @param cache_bytes: the maximum total size of the cached panels.
+        """
+        self.workers = workers
+        self.pool = None
+        self.lock = threading.Lock()
+        self.cache = SizedLRUCache(cache_size, cache_bytes)
+        self.stats = {'rendered': 0}
+
+    def panels(self, dest, start_datetime, end_datetime) :
+        """
+        Splits the states of the devices in a panel for each hour.
+        @type dest: dataframe
+        @param dest: the states of the devices for each minute.
+        @type start_datetime: datetime
+        @param start_datetime: the beginning of the plotted interval.
+        @type end_datetime: datetime
+        @param end_datetime: the end of the plotted interval.
+        @rtype list of tuple
+        @return the beginning of each hour with the states of its minutes,
+        up to the first minute of the next hour.
+        """
+        return [(start, dest[start:start + pd.Timedelta(hours=1)])
+                for start in pd.date_range(start_datetime, end_datetime,
+                                           freq='H')]
+
+    def render(self, panels, image_format='png') :
+        """
+        Renders panels, taking from the cache the ones already rendered.
+        @type panels: list of dataframe
+        @param panels: the states of the devices of each panel.
+        @type image_format: String
+        @param image_format: the format of the images, 'png' or 'svg'.
+        @rtype list of bytes
+        @return the image of each panel.
+        @raise PlotException when matplotlib is not available.
+        """
+        keys = [self.panelKey(panel, image_format) for panel in panels]
+        images = [self.cache.get(key) for key in keys]
+        missing = [i for i, image in enumerate(images) if image is None]
+        if not missing :
+            return images
+        try :
+            import matplotlib
+        except ImportError :
+            raise PlotException('{"ERROR": "matplotlib is needed to render '
+                                + 'the plots."}')
+        arguments = ([panels[i] for i in missing],
+                     [image_format] * len(missing),
+                     [self.FIGSIZE] * len(missing))
+        if self.workers > 0 :
+            rendered = self.getPool().starmap(renderPanel, zip(*arguments))
+        else :
+            rendered = map(renderPanel, *arguments)
+        for i, image in zip(missing, rendered) :
+            images[i] = image
+            self.cache.put(keys[i], image)
+        with self.lock :
+            self.stats['rendered'] += len(missing)
+        return images
+
+    def panelKey(self, panel, image_format) :
+        """
+        Gets the digest of the content of a panel.
+        @type panel: dataframe
+        @param panel: the states of the devices of the panel.
+        @type image_format: String
+        @param image_format: the format of the image.
+        @rtype String
+        @return the digest of the format, the columns, the minutes and the
+        states of the panel.
+        """
+        digest = hashlib.sha1()
+        digest.update((image_format + "\n" + "\n".join(panel.columns)
+                       + "\n").encode('utf-8'))
+        digest.update(panel.index.values.tobytes())
+        digest.update(panel.values.astype('int64').tobytes())
+        return digest.hexdigest()
+
+    def archive(self, names, images, image_format) :
+        """
+        Puts images in a zip archive.
+        @type names: list of String
+        @param names: the names of the images, without extension.
+        @type images: list of bytes
+        @param images: the images.
+        @type image_format: String
+        @param image_format: the format of the images.
+        @rtype bytes
+        @return the archive.
+        """
+        # The PNG images are already compressed
+        compression = zipfile.ZIP_STORED if image_format == 'png' \
+                      else zipfile.ZIP_DEFLATED
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w', compression) as zip_file :
+            for name, image in zip(names, images) :
+                zip_file.writestr(name + "." + image_format, image)
+        return archive.getvalue()
+
+    def getPool(self) :
+        """
+        Gets the pool of processes, starting it the first time. The
+        processes are spawned: a fork would copy the locks held by the
+        threads of the server, as the scheduler and the jobs.
+        @rtype Pool
+        @return the pool.
+        """
+        with self.lock :
+            if self.pool is None :
+                self.pool = multiprocessing.get_context('spawn').Pool(
+                    self.workers)
+        return self.pool
+
+    def close(self) :
+        """
+        Stops the pool of processes, if it was started.
+        """
+        with self.lock :
+            pool, self.pool = self.pool, None
+        if pool is not None :
+            pool.terminate()
+            pool.join()
+
+    def getStats(self) :
+        """
+        Gets the usage statistics of the renderer.
+        @rtype dict
+        @return the number of rendered panels and the statistics of the
+        cache.
+        """
+        with self.lock :
+            stats = dict(self.stats)
+        stats['cache'] = self.cache.getStats()
+        return stats
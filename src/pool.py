@@ -0,0 +1,236 @@
+"""
+Copyright 2018 Dario Russo <dario.russo@isti.cnr.it>
+
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+"""
+Keeps database connections open to be reused by the requests.
+"""
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+class PoolException(Exception) :
+    """
+    Defines an exception that can be raised borrowing a connection.
+    """
+    def __init__(self, message) :
+        self.message = message
+
+    def getMessage(self) :
+        return self.message
+
+class ConnectionPool :
+    """
+    A pool of connections to a database.
+    The connections are created when needed up to a maximum number, checked
+    before being borrowed and replaced when they are too old.
+    Any DB-API connection can be pooled (e.g. pymysql, sqlite3).
+    """
+
+    def __init__(self, connect, size=5, recycle=3600, timeout=30) :
+        """
+        Creates an instance of the class.
+        @type connect: function
+        @param connect: the function creating a new connection.
+        @type size: int
+        @param size: the maximum number of open connections.
+        @type recycle: int
+        @param recycle: the seconds after that a connection is closed and
+        replaced by a new one.
+        @type timeout: int
+        @param timeout: the maximum seconds to wait for a free connection.
+        """
+        self.connect = connect
+        self.size = size
+        self.recycle = recycle
+        self.timeout = timeout
+        self.condition = threading.Condition()
+        # The idle connections with their creation time
+        self.idle = deque()
+        # The creation time of the borrowed connections
+        self.borrowed = {}
+        self.opened = 0
+        self.in_use = 0
+        self.stats = {'borrowed': 0, 'created': 0, 'recycled': 0,
+                      'broken': 0, 'waits': 0, 'wait_time': 0.0,
+                      'max_wait_time': 0.0}
+
+    def borrow(self) :
+        """
+        Takes a connection from the pool, waiting if all of them are in use.
+        The connection must be given back with release.
+        @rtype connection
+        @return a working connection.
+        @raise PoolException when no connection is free before the timeout.
+        """
+        with self.condition :
+            if not self.idle and self.opened >= self.size :
+                start_wait = time.time()
+                self.stats['waits'] += 1
+                while not self.idle and self.opened >= self.size :
+                    remaining = self.timeout - (time.time() - start_wait)
+                    if remaining <= 0 :
+                        raise PoolException('{"ERROR": "No database '
+                            + 'connection available after '
+                            + str(self.timeout) + ' seconds."}')
+                    self.condition.wait(remaining)
+                waited = time.time() - start_wait
+                self.stats['wait_time'] += waited
+                self.stats['max_wait_time'] = \
+                 max(self.stats['max_wait_time'], waited)
+            if self.idle :
+                connection, created = self.idle.pop()
+            else :
+                connection, created = None, None
+            if connection is None :
+                self.opened += 1
+            self.in_use += 1
+            self.stats['borrowed'] += 1
+        try :
+            if connection is not None :
+                if time.time() - created > self.recycle :
+                    self.count('recycled')
+                    self.close(connection)
+                    connection = None
+                elif not self.isAlive(connection) :
+                    self.count('broken')
+                    self.close(connection)
+                    connection = None
+            if connection is None :
+                connection = self.connect()
+                created = time.time()
+                self.count('created')
+        except Exception :
+            with self.condition :
+                self.opened -= 1
+                self.in_use -= 1
+                self.condition.notify()
+            raise
+        with self.condition :
+            self.borrowed[id(connection)] = created
+        return connection
+
+    def release(self, connection, broken=False) :
+        """
+        Gives back a borrowed connection. The pending transaction is rolled
+        back, so the next borrower starts from a clean state.
+        @type connection: connection
+        @param connection: the borrowed connection.
+        @type broken: bool
+        @param broken: True to close the connection instead of reusing it.
+        """
+        if not broken :
+            try :
+                connection.rollback()
+            except Exception :
+                broken = True
+        if broken :
+            self.count('broken')
+            self.close(connection)
+        with self.condition :
+            created = self.borrowed.pop(id(connection))
+            self.in_use -= 1
+            if broken :
+                self.opened -= 1
+            else :
+                self.idle.append((connection, created))
+            self.condition.notify()
+
+    @contextmanager
+    def connection(self) :
+        """
+        Borrows a connection for the block of a with statement. If the block
+        raises an exception, the connection is closed.
+        """
+        connection = self.borrow()
+        try :
+            yield connection
+        except Exception :
+            self.release(connection, broken=True)
+            raise
+        else :
+            self.release(connection)
+
+    def isAlive(self, connection) :
+        """
+        Checks that a connection is still working.
+        @type connection: connection
+        @param connection: the connection to check.
+        @rtype bool
+        @return True if the connection works.
+        """
+        try :
+            if hasattr(connection, 'ping') :
+                connection.ping(reconnect=False)
+            else :
+                cursor = connection.cursor()
+                cursor.execute("SELECT 1")
+                cursor.close()
+            return True
+        except Exception :
+            return False
+
+    def count(self, name) :
+        """
+        Increments a statistic.
+        @type name: String
+        @param name: the name of the statistic.
+        """
+        with self.condition :
+            self.stats[name] += 1
+
+    def close(self, connection) :
+        """
+        Closes a connection ignoring errors.
+        @type connection: connection
+        @param connection: the connection to close.
+        """
+        try :
+            connection.close()
+        except Exception :
+            pass
+
+    def closeAll(self) :
+        """
+        Closes the idle connections.
+        """
+        with self.condition :
+            while self.idle :
+                connection, _ = self.idle.pop()
+                self.close(connection)
+                self.opened -= 1
+
+    def getStats(self) :
+        """
+        Gets the usage statistics of the pool.
+        @rtype dict
+        @return the statistics: the size of the pool, the open, in use and
+        idle connections, the borrowed, created, recycled and broken ones,
+        the number of waits for a free connection and the waited seconds.
+        """
+        with self.condition :
+            stats = dict(self.stats)
+            stats['size'] = self.size
+            stats['opened'] = self.opened
+            stats['in_use'] = self.in_use
+            stats['idle'] = len(self.idle)
+        return stats
@@ -0,0 +1,163 @@
+"""
+Copyright 2018 Dario Russo <dario.russo@isti.cnr.it>
+
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+"""
+Keeps HTTP connections to a REST server open to be reused by the requests.
+"""
+
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+class RestSession :
+    """
+    A session to a REST server.
+    Connections are kept alive and reused, up to a maximum number for the
+    server. Failed calls are retried a bounded number of times waiting
+    longer after each failure. The latency of the calls is measured for
+    each endpoint.
+    """
+
+    def __init__(self, base_url, timeout=(5, 120), retries=3, backoff=0.5,
+                 max_connections=10) :
+        """
+        Creates an instance of the class.
+        @type base_url: String
+        @param base_url: the URL the endpoints are relative to.
+        @type timeout: tuple
+        @param timeout: the seconds to wait to connect and to read a
+        response.
+        @type retries: int
+        @param retries: the maximum number of retries of a failed call.
+        @type backoff: float
+        @param backoff: the factor of the waiting time between retries
+        (backoff, 2 * backoff, 4 * backoff, ... seconds).
+        @type max_connections: int
+        @param max_connections: the maximum number of connections to the
+        server.
+        """
+        self.base_url = base_url
+        self.timeout = timeout
+        retry_params = {'total': retries, 'backoff_factor': backoff,
+                        'status_forcelist': (500, 502, 503, 504),
+                        'raise_on_status': False}
+        # The data are read with POST requests too, so they can be retried
+        try :
+            retry = Retry(allowed_methods=frozenset(['GET', 'POST']),
+                          **retry_params)
+        except TypeError :
+            retry = Retry(method_whitelist=frozenset(['GET', 'POST']),
+                          **retry_params)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections,
+                              pool_block=True, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def get(self, endpoint, name=None, **kwargs) :
+        """
+        Makes a GET call.
+        @type endpoint: String
+        @param endpoint: the path of the endpoint, relative to the base URL.
+        @type name: String
+        @param name: the name the latency is measured with, the endpoint if
+        not given.
+        @rtype Response
+        @return the response of the server.
+        """
+        return self.request('GET', endpoint, name, **kwargs)
+
+    def post(self, endpoint, name=None, **kwargs) :
+        """
+        Makes a POST call.
+        @type endpoint: String
+        @param endpoint: the path of the endpoint, relative to the base URL.
+        @type name: String
+        @param name: the name the latency is measured with, the endpoint if
+        not given.
+        @rtype Response
+        @return the response of the server.
+        """
+        return self.request('POST', endpoint, name, **kwargs)
+
+    def request(self, method, endpoint, name=None, **kwargs) :
+        """
+        Makes a call to the server measuring its latency.
+        @type method: String
+        @param method: the HTTP method.
+        @type endpoint: String
+        @param endpoint: the path of the endpoint, relative to the base URL.
+        @type name: String
+        @param name: the name the latency is measured with, the endpoint if
+        not given.
+        @rtype Response
+        @return the response of the server.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        start = time.time()
+        failed = True
+        try :
+            response = self.session.request(method, self.base_url + endpoint,
+                                            **kwargs)
+            failed = response.status_code >= 400
+            return response
+        finally :
+            self.measure(name or endpoint, time.time() - start, failed)
+
+    def measure(self, name, elapsed, failed) :
+        """
+        Adds a call to the latency statistics.
+        @type name: String
+        @param name: the name of the endpoint.
+        @type elapsed: float
+        @param elapsed: the seconds the call lasted.
+        @type failed: bool
+        @param failed: True if the call failed.
+        """
+        with self.lock :
+            if name not in self.stats :
+                self.stats[name] = {'calls': 0, 'errors': 0,
+                                    'total_time': 0.0, 'max_time': 0.0}
+            stats = self.stats[name]
+            stats['calls'] += 1
+            stats['errors'] += 1 if failed else 0
+            stats['total_time'] += elapsed
+            stats['max_time'] = max(stats['max_time'], elapsed)
+
+    def getStats(self) :
+        """
+        Gets the latency statistics.
+        @rtype dict
+        @return for each endpoint, the number of calls and errors, the total,
+        average and maximum seconds of the calls.
+        """
+        with self.lock :
+            stats = {}
+            for name, endpoint_stats in self.stats.items() :
+                stats[name] = dict(endpoint_stats)
+                stats[name]['average_time'] = \
+                 endpoint_stats['total_time'] / endpoint_stats['calls']
+        return stats
@@ -0,0 +1,231 @@
+"""
+Copyright 2018 Dario Russo <dario.russo@isti.cnr.it>
+
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+"""
+Precomputes every night the sleep activities of the day before.
+"""
+
+import threading
+import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from configuration import Configuration
+
+class NightlyScheduler(threading.Thread) :
+    """
+    Analyzes every night the day before of a list of users, so that the
+    results are already in the cache when they are requested.
+    The users are analyzed concurrently up to a maximum number, the failed
+    ones are retried waiting longer after each failure. Each run ends with
+    a summary of its throughput and latency.
+    """
+
+    def __init__(self, analyze, at=None, users=None, users_file=None,
+                 workers=None, retries=None, backoff=None, clock=None) :
+        """
+        Creates an instance of the class. The parameters not given are
+        taken from the Configuration.
+        @type analyze: function
+        @param analyze: the function taking a user and a day and running the
+        analysis.
+        @type at: String
+        @param at: the time of the runs as HH:MM, None to never run.
+        @type users: list of String
+        @param users: the users to analyze.
+        @type users_file: String
+        @param users_file: the path of a file with a user for line, read at
+        every run; empty lines and lines starting with # are skipped.
+        @type workers: int
+        @param workers: the maximum number of users analyzed at the same
+        time.
+        @type retries: int
+        @param retries: the maximum number of retries of a failed user.
+        @type backoff: float
+        @param backoff: the seconds waited before the first retry, doubled at
+        each retry.
+        @type clock: function
+        @param clock: the function giving the current datetime, 
+        datetime.now if not given.
+        """
+        threading.Thread.__init__(self, name='NightlyScheduler')
+        self.daemon = True
+        self.analyze = analyze
+        self.at = Configuration.NIGHTLY_TIME if at is None else at
+        self.users = Configuration.NIGHTLY_USERS if users is None else users
+        self.users_file = Configuration.NIGHTLY_USERS_FILE \
+                          if users_file is None else users_file
+        self.workers = Configuration.NIGHTLY_WORKERS \
+                       if workers is None else workers
+        self.retries = Configuration.NIGHTLY_RETRIES \
+                       if retries is None else retries
+        self.backoff = Configuration.NIGHTLY_BACKOFF \
+                       if backoff is None else backoff
+        self.clock = dt.datetime.now if clock is None else clock
+        self.stopped = threading.Event()
+        self.last_summary = None
+
+    def loadUsers(self) :
+        """
+        Gets the users to analyze, from the configured list and file.
+        @rtype list of String
+        @return the users, without duplicates.
+        """
+        users = list(self.users)
+        if self.users_file :
+            with open(self.users_file) as users_file :
+                for line in users_file :
+                    line = line.strip()
+                    if line and not line.startswith('#') :
+                        users.append(line)
+        return list(dict.fromkeys(users))
+
+    def run(self) :
+        while self.at is not None and not self.stopped.is_set() :
+            next_run = self.nextRun(self.clock())
+            if self.stopped.wait((next_run - self.clock()).total_seconds()) :
+                break
+            try :
+                self.runOnce()
+            except Exception as e :
+                print("ERROR: nightly precompute: %s" % e)
+
+    def stop(self) :
+        """
+        Stops the scheduler after the current run.
+        """
+        self.stopped.set()
+
+    def nextRun(self, now) :
+        """
+        Gets when the next run starts.
+        @type now: datetime
+        @param now: the current datetime.
+        @rtype datetime
+        @return the first datetime at the configured time after now.
+        """
+        hours, minutes = [int(x) for x in self.at.split(':')]
+        next_run = now.replace(hour=hours, minute=minutes, second=0,
+                               microsecond=0)
+        if next_run <= now :
+            next_run += dt.timedelta(days=1)
+        return next_run
+
+    def runOnce(self, day=None) :
+        """
+        Analyzes a day of all the users.
+        @type day: date
+        @param day: the day to analyze, the day before if not given.
+        @rtype dict
+        @return the summary of the run.
+        """
+        if day is None :
+            day = self.clock().date() - dt.timedelta(days=1)
+        users = self.loadUsers()
+        start = self.clock()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor :
+            results = list(executor.map(lambda user_id :
+                                        self.analyzeUser(user_id, day),
+                                        users))
+        summary = self.summarize(day, results,
+                                 (self.clock() - start).total_seconds())
+        self.last_summary = summary
+        self.printSummary(summary)
+        return summary
+
+    def analyzeUser(self, user_id, day) :
+        """
+        Analyzes a day of a user, retrying when it fails.
+        @type user_id: String
+        @param user_id: the user.
+        @type day: date
+        @param day: the day to analyze.
+        @rtype dict
+        @return the user, the attempts, the seconds of the successful attempt
+        and the last error, None if it succeeded.
+        """
+        attempts = 0
+        while True :
+            attempts += 1
+            start = self.clock()
+            try :
+                self.analyze(user_id, day)
+                return {'user_id': user_id, 'attempts': attempts,
+                        'duration': (self.clock() - start).total_seconds(),
+                        'error': None}
+            except Exception as e :
+                error = e.getMessage() if hasattr(e, 'getMessage') \
+                        else repr(e)
+                print("ERROR: nightly precompute of user %s for %s, attempt"
+                      " %d: %s" % (user_id, day.strftime("%Y-%m-%d"),
+                                   attempts, error))
+                if attempts > self.retries \
+                 or self.stopped.wait(self.backoff * 2 ** (attempts - 1)) :
+                    return {'user_id': user_id, 'attempts': attempts,
+                            'duration': None, 'error': error}
+
+    def summarize(self, day, results, elapsed) :
+        """
+        Summarizes a run.
+        @type day: date
+        @param day: the analyzed day.
+        @type results: list of dict
+        @param results: the results of analyzeUser.
+        @type elapsed: float
+        @param elapsed: the seconds the run lasted.
+        @rtype dict
+        @return the counts of users, the throughput in users per second and
+        the percentiles of the seconds to analyze a user.
+        """
+        durations = [result['duration'] for result in results
+                     if result['error'] is None]
+        summary = {'day': day.strftime("%Y-%m-%d"), 'users': len(results),
+                   'done': len(durations),
+                   'failed': len(results) - len(durations),
+                   'attempts': sum(result['attempts'] for result in results),
+                   'elapsed': elapsed,
+                   'throughput': len(durations) / elapsed if elapsed else 0.0,
+                   'failed_users': [result['user_id'] for result in results
+                                    if result['error'] is not None]}
+        for name, percentile in (('p50', 50), ('p95', 95), ('p99', 99),
+                                 ('max', 100)) :
+            summary[name] = float(np.percentile(durations, percentile)) \
+                            if durations else None
+        return summary
+
+    def printSummary(self, summary) :
+        """
+        Prints the summary of a run.
+        @type summary: dict
+        @param summary: the summary given by summarize.
+        """
+        print("*** Nightly precompute for %s: %d users, %d done, %d failed, "
+              "%d attempts in %.1f seconds (%.2f users/s)."
+              % (summary['day'], summary['users'], summary['done'],
+                 summary['failed'], summary['attempts'], summary['elapsed'],
+                 summary['throughput']))
+        if summary['done'] :
+            print("*** Seconds per user: p50 %.2f, p95 %.2f, p99 %.2f, "
+                  "max %.2f." % (summary['p50'], summary['p95'],
+                                 summary['p99'], summary['max']))
+        if summary['failed_users'] :
+            print("*** Failed users: " + ", ".join(summary['failed_users']))
@@ -0,0 +1,10 @@
+"""
+Makes the modules of the application importable by the tests, as they are
+when the application is run from src.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src'))
@@ -0,0 +1,151 @@
+"""
+Tests of the in-process caches and of the cache of the device maps.
+"""
+
+import json
+import time
+import unittest
+
+from cache import LRUCache
+from cache import SizedLRUCache
+from client import C2KRestClient
+from mapping import C2KEventMapping
+
+class LRUCacheTest(unittest.TestCase) :
+
+    def testLeastRecentlyUsedIsEvicted(self) :
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.get('a'), cache.get('c')), (1, 3))
+        stats = cache.getStats()
+        self.assertEqual((stats['entries'], stats['evictions'], stats['hits'],
+                          stats['misses']), (2, 1, 3, 1))
+
+    def testPutReplacesValue(self) :
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.put('a', 3)
+        cache.put('c', 4)
+        self.assertEqual(cache.get('a'), 3)
+        self.assertIsNone(cache.get('b'))
+
+    def testEntriesExpire(self) :
+        cache = LRUCache(2, ttl=0.01)
+        cache.put('a', 1)
+        cache.put('b', 2, ttl=60)
+        time.sleep(0.02)
+        self.assertEqual(cache.get('a', 'missing'), 'missing')
+        self.assertEqual(cache.get('b'), 2)
+        self.assertEqual(cache.getStats()['expired'], 1)
+
+    def testInvalidate(self) :
+        cache = LRUCache()
+        for key in range(5) :
+            cache.put(key, str(key))
+        cache.invalidate(0)
+        cache.invalidate(10)
+        cache.invalidateIf(lambda key : key % 2 == 1)
+        self.assertEqual([key for key in range(5)
+                          if cache.get(key) is not None], [2, 4])
+        self.assertEqual(cache.getStats()['invalidations'], 3)
+        cache.clear()
+        self.assertEqual(cache.getStats()['entries'], 0)
+
+class SizedLRUCacheTest(unittest.TestCase) :
+
+    def testSizeIsLimited(self) :
+        cache = SizedLRUCache(10, 10)
+        cache.put('a', b'1234')
+        cache.put('b', b'1234')
+        cache.get('a')
+        cache.put('c', b'1234')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.get('a'), cache.get('c')), (b'1234', b'1234'))
+        self.assertEqual(cache.getStats()['bytes'], 8)
+
+    def testLargeValuesAreNotStored(self) :
+        cache = SizedLRUCache(10, 10)
+        cache.put('a', b'1234')
+        cache.put('b', b'1234')
+        cache.put('a', b'12345678901')
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('b'), b'1234')
+        self.assertEqual(cache.getStats()['bytes'], 4)
+
+    def testRemovedValuesAreNotCounted(self) :
+        cache = SizedLRUCache(10, 10, size=lambda value : value['size'])
+        cache.put('a', {'size': 6})
+        cache.put('a', {'size': 3})
+        cache.put('b', {'size': 5})
+        cache.invalidate('b')
+        self.assertEqual(cache.getStats()['bytes'], 3)
+        cache.clear()
+        self.assertEqual(cache.getStats()['bytes'], 0)
+
+class Response :
+
+    def __init__(self, text) :
+        self.text = text
+
+class SensorSession :
+    """
+    A session answering the sensors of the users, counting the requests.
+    """
+
+    def __init__(self) :
+        self.requests = 0
+
+    def get(self, endpoint, name=None, **kwargs) :
+        self.requests += 1
+        return Response(json.dumps({'RESULTS': [
+            {'id': endpoint.split('/')[2] + '-bed', 'sensorTypeId': 4,
+             'name': 'Bed'}]}))
+
+class DeviceMapCacheTest(unittest.TestCase) :
+
+    def setUp(self) :
+        self.rest_session = C2KRestClient.rest_session
+        self.device_map_cache = C2KRestClient.device_map_cache
+        C2KRestClient.rest_session = SensorSession()
+        C2KRestClient.device_map_cache = LRUCache(10, 60)
+
+    def tearDown(self) :
+        C2KRestClient.rest_session = self.rest_session
+        C2KRestClient.device_map_cache = self.device_map_cache
+
+    def client(self, user_id) :
+        params = {'sleep': {'user_id': user_id, 'action': 'activity',
+                            'param_1': '2018-03-01', 'param_2': '2018-03-02',
+                            'param_3': None, 'param_4': None}}
+        return C2KRestClient(params, C2KEventMapping())
+
+    def testDeviceMapIsReadOnce(self) :
+        first = self.client('1')
+        second = self.client('1')
+        self.assertEqual(C2KRestClient.rest_session.requests, 1)
+        self.assertEqual(list(second.mapping.devices), ['1-bed'])
+        # The devices are not shared, so their states are not
+        self.assertIsNot(first.mapping.devices['1-bed'],
+                         second.mapping.devices['1-bed'])
+
+    def testUsersDoNotMixDevices(self) :
+        self.client('1')
+        self.assertEqual(list(self.client('2').mapping.devices), ['2-bed'])
+        self.assertEqual(list(self.client('1').mapping.devices), ['1-bed'])
+        self.assertEqual(C2KRestClient.rest_session.requests, 2)
+
+    def testInvalidateDeviceMap(self) :
+        self.client('1')
+        self.client('2')
+        C2KRestClient.invalidateDeviceMap('1')
+        self.client('1')
+        self.client('2')
+        self.assertEqual(C2KRestClient.rest_session.requests, 3)
+        C2KRestClient.invalidateDeviceMap()
+        self.client('2')
+        self.assertEqual(C2KRestClient.rest_session.requests, 4)
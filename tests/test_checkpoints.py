@@ -0,0 +1,126 @@
+"""
+Tests that the sleep analysis resumed from the states stored at the end of
+the days gives the records of an analysis never interrupted.
+"""
+
+import datetime as dt
+import json
+import unittest
+
+import pandas as pd
+
+from analitics import Analitics
+from configuration import Configuration
+from intelligence import Sleep
+from intelligence import VectorizedSleep
+from test_intelligence import EngineClient
+from test_intelligence import FIRST_DAY
+from test_intelligence import measurements
+
+class CheckpointClient(EngineClient) :
+    """
+    A client storing the checkpoints and the cache, as JSON like the
+    server does, when they are flushed.
+    """
+
+    def __init__(self, rows, checkpoints, cache) :
+        EngineClient.__init__(self, rows)
+        self.checkpoints = checkpoints
+        self.cache = cache
+        self.checkpoint_buffer = []
+        self.sleep_data_buffer = []
+
+    def getSleepCheckpoints(self, start_date, end_date) :
+        return {day: json.loads(state)
+                for day, state in self.checkpoints.items()
+                if start_date <= day <= end_date}
+
+    def bufferSleepCheckpoint(self, day, state) :
+        self.checkpoint_buffer.append((day, json.dumps(state)))
+
+    def getCachedSleepData(self, start_date, end_date) :
+        cached = [sleep_df[sleep_df['date'].map(
+                      lambda date: start_date <= date <= end_date)]
+                  for sleep_df in self.cache]
+        if not cached :
+            return pd.DataFrame(columns=VectorizedSleep.columns)
+        return pd.concat(cached)
+
+    def bufferSleepDataToCache(self, sleep_df) :
+        self.sleep_data_buffer.append(sleep_df)
+
+    def flushSleepDataToCache(self) :
+        self.checkpoints.update(self.checkpoint_buffer)
+        self.cache.extend(self.sleep_data_buffer)
+        self.checkpoint_buffer = []
+        self.sleep_data_buffer = []
+
+def records(sleep_df) :
+    return [list(record) for record in sleep_df.itertuples(index=False)]
+
+class CheckpointTest(unittest.TestCase) :
+
+    DAYS = 10
+
+    def activities(self, engine, rows, first, last, checkpoints, cache) :
+        client = CheckpointClient(rows, checkpoints, cache)
+        return Analitics(client).sleepActivities(
+            engine(client.mapping.devices), FIRST_DAY + dt.timedelta(first),
+            FIRST_DAY + dt.timedelta(last))
+
+    def testDaysAnalyzedOneByOne(self) :
+        for seed in range(5) :
+            rows = measurements(seed, self.DAYS + 1)
+            for engine in (Sleep, VectorizedSleep) :
+                with self.subTest(seed=seed, engine=engine.__name__) :
+                    expected = records(self.activities(
+                        engine, rows, 1, self.DAYS, {}, []))
+                    checkpoints = {}
+                    resumed = []
+                    # Each day is analyzed by a new engine, without the
+                    # cache of the previous days
+                    for day in range(1, self.DAYS + 1) :
+                        resumed += records(self.activities(
+                            engine, rows, day, day, checkpoints, []))
+                    self.assertEqual(resumed, expected)
+                    self.assertEqual(len(checkpoints), self.DAYS)
+
+    def testPeriodAfterCachedDays(self) :
+        for seed in range(5) :
+            rows = measurements(seed, self.DAYS + 1)
+            for engine in (Sleep, VectorizedSleep) :
+                with self.subTest(seed=seed, engine=engine.__name__) :
+                    expected = records(self.activities(
+                        engine, rows, 1, self.DAYS, {}, []))
+                    checkpoints = {}
+                    cache = []
+                    # The activities closed after the last day of a request
+                    # are not in the cache of their day
+                    self.activities(engine, rows, 1, 4, checkpoints, cache)
+                    self.activities(engine, rows, 5, 6, checkpoints, cache)
+                    self.assertEqual(records(self.activities(
+                        engine, rows, 1, self.DAYS, checkpoints, cache)),
+                        expected)
+                    # The activities already cached are not written again
+                    written = [tuple(record[:2]) for sleep_df in cache
+                               for record in records(sleep_df)]
+                    self.assertEqual(len(written), len(set(written)))
+
+    def testStateSurvivesJson(self) :
+        rows = measurements(3, 3)
+        for engine in (Sleep, VectorizedSleep) :
+            client = EngineClient(rows)
+            analitics = Analitics(client)
+            sleep = engine(client.mapping.devices)
+            analitics.sleepActivitiesForDays(
+                sleep, dt.datetime.combine(
+                    FIRST_DAY, dt.time(Configuration.HH_DAY_SLEEP_SEPARATOR,
+                                       Configuration.MM_DAY_SLEEP_SEPARATOR)),
+                2)
+            state = sleep.getState()
+            restored = engine(client.mapping.devices)
+            restored.setState(json.loads(json.dumps(state)))
+            self.assertEqual(restored.getState(), state)
+            for name in engine.state_attributes :
+                self.assertEqual(getattr(restored, name),
+                                 getattr(sleep, name))
@@ -0,0 +1,126 @@
+"""
+Tests of the index of the vectors of the average sleep of the users.
+"""
+
+import datetime as dt
+import unittest
+from contextlib import contextmanager
+
+import numpy as np
+
+from cohort import CohortIndex
+
+class CohortCursor :
+    """
+    Runs the statements of CohortIndex on the rows of a CohortDatabase.
+    """
+
+    def __init__(self, database) :
+        self.database = database
+
+    def __enter__(self) :
+        return self
+
+    def __exit__(self, *args) :
+        pass
+
+    def execute(self, sql_query, params=None) :
+        if sql_query.startswith("SELECT") :
+            self.database.reads += 1
+            return
+        start_date = dt.datetime.strptime(params[1], '%Y-%m-%d').date()
+        end_date = dt.datetime.strptime(params[2], '%Y-%m-%d').date()
+        self.database.rows[params[0]] = (params[0], start_date, end_date) \
+                                        + tuple(params[3:])
+
+    def fetchall(self) :
+        return list(self.database.rows.values())
+
+class CohortDatabase :
+    """
+    The table of the vectors, reached as a ConnectionPool.
+    """
+
+    def __init__(self) :
+        self.rows = {}
+        self.reads = 0
+
+    @contextmanager
+    def connection(self) :
+        yield self
+
+    def cursor(self) :
+        return CohortCursor(self)
+
+    def commit(self) :
+        pass
+
+START_DATE = dt.date(2018, 3, 1)
+END_DATE = dt.date(2018, 3, 30)
+
+def cosine(first, second) :
+    return np.dot(first, second) / np.linalg.norm(first) \
+           / np.linalg.norm(second)
+
+class CohortIndexTest(unittest.TestCase) :
+
+    def setUp(self) :
+        self.database = CohortDatabase()
+        self.index = CohortIndex(self.database, 'cohort')
+        generator = np.random.RandomState(0)
+        self.vectors = dict((str(user), generator.rand(5) * 100)
+                            for user in range(20))
+        for user_id, vector in self.vectors.items() :
+            self.index.update(user_id, START_DATE, END_DATE, vector)
+
+    def expected(self, vector, user_ids, top_k) :
+        similarities = [(user_id, cosine(vector, self.vectors[user_id]))
+                        for user_id in user_ids]
+        similarities.sort(key=lambda similarity : -similarity[1])
+        return similarities[:top_k]
+
+    def assertSimilarities(self, found, expected) :
+        self.assertEqual([user_id for user_id, _ in found],
+                         [user_id for user_id, _ in expected])
+        np.testing.assert_allclose([value for _, value in found],
+                                   [value for _, value in expected])
+
+    def testSearch(self) :
+        vector = self.vectors['3']
+        self.assertSimilarities(
+            self.index.search(vector, top_k=5, exclude='3'),
+            self.expected(vector, [user_id for user_id in self.vectors
+                                   if user_id != '3'], 5))
+        self.assertSimilarities(
+            self.index.search(vector, ['1', '2', '2', 'unknown'], top_k=5),
+            self.expected(vector, ['1', '2'], 5))
+        self.assertEqual(self.index.search(np.zeros(5)), [])
+        self.assertEqual(self.index.search(vector, top_k=0), [])
+        self.assertEqual(self.index.search(vector, ['unknown']), [])
+
+    def testUpdateAfterSearch(self) :
+        vector = self.vectors['0']
+        self.index.search(vector)
+        # A known user is replaced in the matrix, a new one builds it again
+        self.vectors['5'] = vector * 2
+        self.index.update('5', START_DATE, END_DATE, self.vectors['5'])
+        self.vectors['new'] = vector + 1
+        self.index.update('new', START_DATE, END_DATE, self.vectors['new'])
+        self.assertSimilarities(
+            self.index.search(vector, top_k=30),
+            self.expected(vector, list(self.vectors), 30))
+        self.assertEqual(self.index.search(vector, top_k=2)[0][0], '0')
+
+    def testVectorsArePersisted(self) :
+        self.index.update('1', START_DATE + dt.timedelta(days=1),
+                          END_DATE + dt.timedelta(days=1), np.ones(5))
+        index = CohortIndex(self.database, 'cohort')
+        start_date, end_date, vector = index.get('1')
+        self.assertEqual((start_date, end_date),
+                         (START_DATE + dt.timedelta(days=1),
+                          END_DATE + dt.timedelta(days=1)))
+        np.testing.assert_array_equal(vector, np.ones(5))
+        self.assertIsNone(index.get('unknown'))
+        self.assertEqual(index.getStats(), {'users': 20, 'loaded': True})
+        index.search(np.ones(5))
+        self.assertEqual(self.database.reads, 2)
@@ -0,0 +1,197 @@
+"""
+Tests of the index of the periods covered by the data of the users.
+"""
+
+import datetime as dt
+import json
+import unittest
+from contextlib import contextmanager
+
+from cache import LRUCache
+from client import C2KRestClient
+from extent import DataExtentIndex
+from mapping import C2KEventMapping
+
+class ExtentCursor :
+    """
+    Runs the statements of DataExtentIndex on the rows of an
+    ExtentDatabase, with the semantics of MySQL.
+    """
+
+    def __init__(self, database) :
+        self.database = database
+        self.row = None
+
+    def __enter__(self) :
+        return self
+
+    def __exit__(self, *args) :
+        pass
+
+    def execute(self, sql_query, params) :
+        if sql_query.startswith("SELECT") :
+            self.row = self.database.rows.get(params[0])
+            return
+        user_id, first, last, checked = params
+        row = self.database.rows.get(user_id)
+        if row is not None :
+            first = min(first, row[0])
+            last = max(last, row[1])
+            checked = checked or row[2]
+        self.database.rows[user_id] = (first, last, checked)
+        self.database.writes += 1
+
+    def fetchone(self) :
+        return self.row
+
+class ExtentDatabase :
+    """
+    The table of the extents, reached as a ConnectionPool.
+    """
+
+    def __init__(self) :
+        self.rows = {}
+        self.writes = 0
+
+    @contextmanager
+    def connection(self) :
+        yield self
+
+    def cursor(self) :
+        return ExtentCursor(self)
+
+    def commit(self) :
+        pass
+
+def datetime(day, hour=0) :
+    return dt.datetime(2018, 3, day, hour)
+
+class DataExtentIndexTest(unittest.TestCase) :
+
+    def setUp(self) :
+        self.database = ExtentDatabase()
+        self.index = DataExtentIndex(self.database, 'extent')
+
+    def testExtentIsPersisted(self) :
+        self.assertIsNone(self.index.get('1'))
+        self.index.update('1', datetime(2), datetime(5), datetime(6))
+        extent = DataExtentIndex(self.database, 'extent').get('1')
+        self.assertEqual((extent.first, extent.last, extent.checked),
+                         (datetime(2), datetime(5), datetime(6)))
+
+    def testExtentOnlyGrows(self) :
+        self.index.update('1', datetime(2), datetime(5))
+        extent = self.index.update('1', datetime(3), datetime(4))
+        self.assertEqual((extent.first, extent.last),
+                         (datetime(2), datetime(5)))
+        self.assertEqual(self.database.writes, 1)
+        extent = self.index.update('1', datetime(1), datetime(4))
+        self.assertEqual((extent.first, extent.last),
+                         (datetime(1), datetime(5)))
+        self.assertEqual(self.database.rows['1'][:2],
+                         (datetime(1), datetime(5)))
+
+    def testCheckedIsKept(self) :
+        self.index.update('1', datetime(2), datetime(5), datetime(6))
+        extent = self.index.update('1', datetime(2), datetime(7))
+        self.assertEqual(extent.checked, datetime(6))
+        extent = self.index.update('1', datetime(2), datetime(7),
+                                   datetime(8))
+        self.assertEqual(extent.checked, datetime(8))
+
+    def testUpdateWithoutCreate(self) :
+        self.assertIsNone(self.index.update('1', datetime(2), datetime(5),
+                                            create=False))
+        self.assertEqual(self.database.writes, 0)
+        self.index.update('1', datetime(2), datetime(5))
+        extent = self.index.update('1', datetime(2), datetime(9),
+                                   create=False)
+        self.assertEqual(extent.last, datetime(9))
+
+    def testInvalidate(self) :
+        self.index.update('1', datetime(2), datetime(5))
+        self.database.rows['1'] = (datetime(1), datetime(9), None)
+        self.assertEqual(self.index.get('1').first, datetime(2))
+        self.index.invalidate('1')
+        self.assertEqual(self.index.get('1').first, datetime(1))
+
+class Response :
+
+    def __init__(self, text) :
+        self.text = text
+
+    def iter_content(self, chunk_size) :
+        content = self.text.encode('utf-8')
+        for start in range(0, len(content), chunk_size) :
+            yield content[start:start + chunk_size]
+
+    def close(self) :
+        pass
+
+class MeasurementSession :
+    """
+    A session answering the measurements of a bed from a datetime, keeping
+    the datetimes they are asked from.
+    """
+
+    def __init__(self, datetimes) :
+        self.datetimes = datetimes
+        self.asked_from = []
+
+    def get(self, endpoint, name=None, **kwargs) :
+        return Response(json.dumps({'RESULTS': [
+            {'id': 'bed', 'sensorTypeId': 4, 'name': 'Bed'}]}))
+
+    def post(self, endpoint, data=None, **kwargs) :
+        date_from = dt.datetime.strptime(json.loads(data)['dateFrom'],
+                                         '%d-%m-%Y %H:%M')
+        self.asked_from.append(date_from)
+        return Response(json.dumps({'RESULTS': [
+            {'timestamp': {'year': datetime.year,
+                           'monthValue': datetime.month,
+                           'dayOfMonth': datetime.day,
+                           'hour': datetime.hour, 'minute': datetime.minute,
+                           'second': datetime.second},
+             'sensor': {'id': 'bed'}, 'measurementTypeDesc': 'DATA',
+             'value': '1'}
+            for datetime in self.datetimes if datetime >= date_from]}))
+
+class AvailableDayTest(unittest.TestCase) :
+
+    def setUp(self) :
+        self.saved = (C2KRestClient.rest_session,
+                      C2KRestClient.device_map_cache,
+                      C2KRestClient.data_extent_index)
+        self.session = MeasurementSession([datetime(2, 10), datetime(5, 8)])
+        C2KRestClient.rest_session = self.session
+        C2KRestClient.device_map_cache = LRUCache(10, 60)
+        C2KRestClient.data_extent_index = \
+         DataExtentIndex(ExtentDatabase(), 'extent')
+
+    def tearDown(self) :
+        (C2KRestClient.rest_session, C2KRestClient.device_map_cache,
+         C2KRestClient.data_extent_index) = self.saved
+
+    def availableDays(self) :
+        params = {'sleep': {'user_id': '1', 'action': 'activity',
+                            'param_1': None, 'param_2': None,
+                            'param_3': None, 'param_4': None}}
+        C2KRestClient(params, C2KEventMapping())
+        return params['sleep']['param_1'], params['sleep']['param_2']
+
+    def testDataAreScannedOnce(self) :
+        self.assertEqual(self.availableDays(),
+                         (datetime(2).date(), datetime(5).date()))
+        self.assertEqual(self.availableDays(),
+                         (datetime(2).date(), datetime(5).date()))
+        self.assertEqual(self.session.asked_from,
+                         [dt.datetime(2018, 1, 30, 10, 30)])
+
+    def testNewDataAreScannedAfterRefresh(self) :
+        self.availableDays()
+        self.session.datetimes.append(datetime(7, 9))
+        C2KRestClient.data_extent_index.get('1').checked -= \
+         dt.timedelta(seconds=C2KRestClient.EXTENT_REFRESH + 1)
+        self.assertEqual(self.availableDays(),
+                         (datetime(2).date(), datetime(7).date()))
+        self.assertEqual(self.session.asked_from[1:], [datetime(5, 8)])
@@ -0,0 +1,163 @@
+"""
+Tests that the event engine (Sleep) and the vectorized engine
+(VectorizedSleep) recognize the same sleep activities on the same
+measurements.
+"""
+
+import datetime as dt
+import random
+import unittest
+
+from analitics import Analitics
+from configuration import Configuration
+from intelligence import Sleep
+from intelligence import VectorizedSleep
+from mapping import C2KEventMapping
+from measurements import MeasurementDecoder
+
+FIRST_DAY = dt.date(2018, 3, 1)
+
+def measurement(datetime, device_id, value) :
+    """
+    Creates a measurement as sent by the server.
+    """
+    return {'timestamp': {'year': datetime.year, 'monthValue': datetime.month,
+                          'dayOfMonth': datetime.day, 'hour': datetime.hour,
+                          'minute': datetime.minute,
+                          'second': datetime.second},
+            'sensor': {'id': device_id}, 'measurementTypeDesc': 'DATA',
+            'value': value}
+
+def measurements(seed, days) :
+    """
+    Creates random measurements of a bed and a PIR sensor. The bed is
+    pressed and released at intervals from seconds to hours, some
+    measurements have the same time of the previous one and some are taken
+    exactly at the day separators.
+    """
+    generator = random.Random(seed)
+    separator = dt.time(Configuration.HH_DAY_SLEEP_SEPARATOR,
+                        Configuration.MM_DAY_SLEEP_SEPARATOR)
+    datetime = dt.datetime.combine(FIRST_DAY, dt.time(12))
+    end = datetime + dt.timedelta(days=days)
+    present = generator.random() < 0.5
+    rows = []
+    while datetime < end :
+        choice = generator.random()
+        if choice < 0.4 :
+            step = generator.randint(1, 80)
+        elif choice < 0.7 :
+            step = generator.randint(60, 3000)
+        elif choice < 0.9 :
+            step = generator.randint(2000, 4 * 3600)
+        else :
+            step = generator.randint(3600, 10 * 3600)
+        # Some measurements have the time of the previous one
+        if generator.random() >= 0.1 :
+            datetime += dt.timedelta(seconds=step)
+        if generator.random() < 0.05 :
+            datetime = dt.datetime.combine(datetime.date(), separator)
+        if generator.random() < 0.15 :
+            rows.append(measurement(datetime, 'pir', '1'))
+            continue
+        present = not present
+        rows.append(measurement(datetime, 'bed', '1' if present else '0'))
+    return rows
+
+def timestamp(row) :
+    """
+    Gets the time of a measurement, to sort them.
+    """
+    return tuple(row['timestamp'][field] 
+                 for field in ('year', 'monthValue', 'dayOfMonth', 'hour',
+                               'minute', 'second'))
+
+class EngineClient :
+    """
+    A client decoding the same measurements for both the engines. Nothing
+    is cached.
+    """
+
+    def __init__(self, rows) :
+        self.rows = rows
+        self.mapping = C2KEventMapping()
+        self.mapping.mapAndAddDeviceMap({'id': 'bed', 'sensorTypeId': 4,
+                                         'name': 'Bed'})
+        self.mapping.mapAndAddDeviceMap({'id': 'pir', 'sensorTypeId': 1,
+                                         'name': 'PIR'})
+        self.mapping.createDevices()
+
+    def getSleepColumns(self, start_datetime, end_datetime) :
+        return MeasurementDecoder(self.mapping.device_map).decode(
+            self.rows, start_datetime, end_datetime)
+
+    getSleepEvents = getSleepColumns
+
+    def getSleepCheckpoints(self, start_date, end_date) :
+        return {}
+
+    def bufferSleepCheckpoint(self, day, state) :
+        pass
+
+    def bufferSleepDataToCache(self, sleep_df) :
+        pass
+
+class EngineEquivalenceTest(unittest.TestCase) :
+
+    def activities(self, engine, rows, days, fetch_days) :
+        """
+        Calculates the sleep activities of consecutive days, fetching the
+        measurements of fetch_days days at a time.
+        """
+        client = EngineClient(rows)
+        analitics = Analitics(client)
+        sleep = engine(client.mapping.devices)
+        start_datetime = dt.datetime.combine(
+            FIRST_DAY, dt.time(Configuration.HH_DAY_SLEEP_SEPARATOR,
+                               Configuration.MM_DAY_SLEEP_SEPARATOR))
+        records = []
+        for first in range(0, days, fetch_days) :
+            sleep_df = analitics.sleepActivitiesForDays(
+                sleep, start_datetime + dt.timedelta(days=first),
+                min(fetch_days, days - first))
+            records += [list(record)
+                        for record in sleep_df.itertuples(index=False)]
+        return records
+
+    def assertSameRecords(self, rows, days) :
+        expected = self.activities(Sleep, rows, days, 1)
+        self.assertTrue(expected)
+        for engine in (Sleep, VectorizedSleep) :
+            for fetch_days in (1, 3, days) :
+                self.assertEqual(self.activities(engine, rows, days,
+                                                 fetch_days), expected)
+        # The measurements with the same time are kept in the order they
+        # are received
+        unsorted = list(rows)
+        random.Random(days).shuffle(unsorted)
+        expected = self.activities(Sleep, sorted(unsorted, key=timestamp),
+                                   days, 1)
+        for engine in (Sleep, VectorizedSleep) :
+            self.assertEqual(self.activities(engine, unsorted, days, days),
+                             expected)
+
+    def testRandomMeasurements(self) :
+        for seed in range(20) :
+            days = random.Random(seed).randint(2, 8)
+            with self.subTest(seed=seed) :
+                self.assertSameRecords(measurements(seed, days), days)
+
+    def testMeasurementsAtTheSeparator(self) :
+        separator = dt.datetime.combine(
+            FIRST_DAY + dt.timedelta(days=1),
+            dt.time(Configuration.HH_DAY_SLEEP_SEPARATOR,
+                    Configuration.MM_DAY_SLEEP_SEPARATOR))
+        rows = [measurement(separator - dt.timedelta(hours=3), 'bed', '1'),
+                measurement(separator - dt.timedelta(minutes=1), 'bed', '0'),
+                measurement(separator, 'bed', '1'),
+                measurement(separator, 'bed', '0'),
+                measurement(separator, 'bed', '1'),
+                measurement(separator + dt.timedelta(hours=6), 'bed', '0'),
+                measurement(separator + dt.timedelta(hours=30), 'bed', '1'),
+                measurement(separator + dt.timedelta(hours=38), 'bed', '0')]
+        self.assertSameRecords(rows, 4)
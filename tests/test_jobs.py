@@ -0,0 +1,102 @@
+"""
+Tests of the batches of analyses run in background.
+"""
+
+import datetime as dt
+import threading
+import time
+import unittest
+
+import main
+from jobs import Job
+from jobs import JobManager
+
+class JobTest(unittest.TestCase) :
+
+    def testStatusTransitions(self) :
+        started = threading.Event()
+        release = threading.Event()
+        def run(user_id) :
+            if user_id == 'slow' :
+                started.set()
+                release.wait(10)
+            elif user_id == 'bad' :
+                raise ValueError('bad user')
+        job = Job(['slow', 'bad'], run)
+        status = job.getStatus()
+        self.assertEqual((status['status'], status['progress']['queued']),
+                         ('queued', 2))
+        worker = threading.Thread(target=job.runUser, args=('slow',))
+        worker.start()
+        started.wait(10)
+        status = job.getStatus()
+        self.assertEqual(status['status'], 'running')
+        self.assertEqual(status['results']['slow']['status'], 'running')
+        job.runUser('bad')
+        self.assertFalse(job.isFinished())
+        release.set()
+        worker.join(10)
+        status = job.getStatus()
+        self.assertTrue(job.isFinished())
+        self.assertEqual(status['status'], 'failed')
+        self.assertEqual(status['progress'],
+                         {'queued': 0, 'running': 0, 'done': 1, 'failed': 1})
+        self.assertEqual(status['results']['bad']['error'],
+                         "ValueError('bad user')")
+        self.assertIsNone(status['results']['slow']['error'])
+        self.assertIsNotNone(status['results']['slow']['duration'])
+
+    def testAllDone(self) :
+        job = Job(['1', '2'], lambda user_id : None)
+        for user_id in ('1', '2') :
+            job.runUser(user_id)
+        self.assertEqual(job.getStatus()['status'], 'done')
+
+class JobManagerTest(unittest.TestCase) :
+
+    def wait(self, job) :
+        for _ in range(1000) :
+            if job.isFinished() :
+                return
+            time.sleep(0.01)
+        self.fail("the job did not finish")
+
+    def testFinishedJobsAreEvicted(self) :
+        manager = JobManager(workers=2, max_jobs=2)
+        release = threading.Event()
+        running = manager.submit(['1'], lambda user_id : release.wait(10))
+        first = manager.submit(['1'], lambda user_id : None)
+        self.wait(first)
+        second = manager.submit(['1', '2'], lambda user_id : None)
+        self.wait(second)
+        # The oldest finished job is forgotten, the running one is kept
+        self.assertIs(manager.get(running.id), running)
+        self.assertIsNone(manager.get(first.id))
+        self.assertIs(manager.get(second.id), second)
+        third = manager.submit(['1'], lambda user_id : None)
+        self.wait(third)
+        self.assertIs(manager.get(running.id), running)
+        self.assertEqual(manager.getStats()['jobs'], 2)
+        release.set()
+        self.wait(running)
+        stats = manager.getStats()
+        self.assertEqual((stats['done'], stats['running']), (2, 0))
+
+    def testInvalidParamsFailTheUser(self) :
+        saved = main.fixInputParams
+        def fixInputParams(argv) :
+            if argv[1] == 'activity' :
+                raise main.InputParamsException('{"ERROR": "not valid."}')
+            return saved(argv)
+        main.fixInputParams = fixInputParams
+        try :
+            manager = JobManager(workers=1)
+            job = manager.submit(['1'], lambda user_id :
+                                 main.analyzeDay(user_id,
+                                                 dt.date(2018, 3, 1)))
+            self.wait(job)
+        finally :
+            main.fixInputParams = saved
+        result = job.getStatus()['results']['1']
+        self.assertEqual((result['status'], result['error']),
+                         ('failed', '{"ERROR": "not valid."}'))
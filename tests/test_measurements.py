@@ -0,0 +1,89 @@
+"""
+Tests of the parsing of the responses of the server and of the decoding of
+the measurements.
+"""
+
+import datetime as dt
+import json
+import unittest
+
+from mapping import C2KEventMapping
+from measurements import MeasurementDecoder
+from measurements import MeasurementStream
+
+FIRST_DATETIME = dt.datetime(2018, 3, 1)
+
+def measurement(seconds, value='1') :
+    datetime = FIRST_DATETIME + dt.timedelta(seconds=seconds)
+    return {'timestamp': {'year': datetime.year, 'monthValue': datetime.month,
+                          'dayOfMonth': datetime.day, 'hour': datetime.hour,
+                          'minute': datetime.minute,
+                          'second': datetime.second},
+            'sensor': {'id': 'bed'}, 'measurementTypeDesc': 'DATA',
+            'value': value}
+
+def chunks(rows, chunk_size=100) :
+    """
+    Gives a response of the server in chunks of a few bytes.
+    """
+    content = json.dumps({'STATUS': 'OK', 'RESULTS': rows}).encode('utf-8')
+    return [content[start:start + chunk_size]
+            for start in range(0, len(content), chunk_size)]
+
+def lateRows() :
+    """
+    Creates measurements in time order but one, received 2000 rows after
+    its time, with the same time of another.
+    """
+    rows = [measurement(seconds) for seconds in range(3000)]
+    rows.insert(2500, measurement(500, '0'))
+    return rows
+
+class MeasurementStreamTest(unittest.TestCase) :
+
+    def testRowsAcrossChunks(self) :
+        rows = [measurement(seconds) for seconds in range(50)]
+        stream = MeasurementStream(chunks(rows, 7))
+        self.assertEqual(list(stream.rows()), rows)
+        self.assertEqual(MeasurementStream(chunks(rows, 7)).consume(), 50)
+
+    def testFirstAndLast(self) :
+        stream = MeasurementStream(chunks(lateRows()))
+        stream.consume()
+        self.assertEqual((stream.first, stream.last),
+                         (FIRST_DATETIME,
+                          FIRST_DATETIME + dt.timedelta(seconds=2999)))
+
+    def testTruncatedResponse(self) :
+        content = b''.join(chunks([measurement(0)]))[:-20]
+        with self.assertRaises(ValueError) :
+            list(MeasurementStream([content]).rows())
+
+class MeasurementDecoderTest(unittest.TestCase) :
+
+    def decoder(self) :
+        mapping = C2KEventMapping()
+        mapping.mapAndAddDeviceMap({'id': 'bed', 'sensorTypeId': 4,
+                                    'name': 'Bed'})
+        return MeasurementDecoder(mapping.device_map)
+
+    def testLateRowsAreKept(self) :
+        decoder = self.decoder()
+        columns = decoder.decode(
+            MeasurementStream(chunks(lateRows())).rows(),
+            FIRST_DATETIME + dt.timedelta(seconds=10))
+        self.assertEqual(len(columns), 2991)
+        datetimes = [event.datetime for event in columns]
+        self.assertEqual(datetimes, sorted(datetimes))
+        self.assertEqual([columns[490].value_id.name,
+                          columns[491].value_id.name],
+                         ['PRESENT', 'NOT_PRESENT'])
+        self.assertEqual(decoder.stats['sorted'], 1)
+
+    def testUnmappedRowsAreSkipped(self) :
+        decoder = self.decoder()
+        rows = [measurement(0), dict(measurement(1), sensor={'id': 'other'}),
+                dict(measurement(2), measurementTypeDesc='BATTERY')]
+        columns = decoder.decode(rows)
+        self.assertEqual(len(columns), 2)
+        self.assertEqual(decoder.stats['unmapped'], 1)
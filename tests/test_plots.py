@@ -0,0 +1,47 @@
+"""
+Tests of the rendering of the panels of the states of the devices.
+"""
+
+import datetime as dt
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from plots import PlotRenderer
+
+try :
+    import matplotlib
+except ImportError :
+    matplotlib = None
+
+def panels(count) :
+    """
+    Creates panels of an hour of the states of two devices.
+    """
+    random = np.random.RandomState(0)
+    start = dt.datetime(2018, 3, 1)
+    return [pd.DataFrame(random.randint(0, 2, (61, 2)), columns=['bed', 'pir'],
+                         index=pd.date_range(start + dt.timedelta(hours=hour),
+                                             periods=61, freq='T'))
+            for hour in range(count)]
+
+@unittest.skipIf(matplotlib is None, "matplotlib is not installed")
+class PlotRendererTest(unittest.TestCase) :
+
+    def setUp(self) :
+        self.renderer = PlotRenderer(workers=2)
+
+    def tearDown(self) :
+        self.renderer.close()
+
+    def testPoolRendersAsTheProcess(self) :
+        expected = PlotRenderer(workers=0).render(panels(3))
+        self.assertEqual(self.renderer.render(panels(3)), expected)
+        self.assertEqual(self.renderer.getStats()['rendered'], 3)
+
+    def testRenderedPanelsAreCached(self) :
+        self.renderer.render(panels(2))
+        images = self.renderer.render(panels(3))
+        self.assertEqual(len(images), 3)
+        self.assertEqual(self.renderer.getStats()['rendered'], 3)
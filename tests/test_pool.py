@@ -0,0 +1,106 @@
+"""
+Tests of the pool of database connections, with sqlite3 connections.
+"""
+
+import sqlite3
+import threading
+import time
+import unittest
+
+from pool import ConnectionPool
+from pool import PoolException
+
+def connect() :
+    return sqlite3.connect(':memory:', check_same_thread=False)
+
+class ConnectionPoolTest(unittest.TestCase) :
+
+    def testBorrowAndRelease(self) :
+        pool = ConnectionPool(connect, size=2)
+        connection = pool.borrow()
+        self.assertEqual(pool.getStats()['in_use'], 1)
+        pool.release(connection)
+        self.assertIs(pool.borrow(), connection)
+        stats = pool.getStats()
+        self.assertEqual((stats['borrowed'], stats['created'],
+                          stats['opened'], stats['idle']), (2, 1, 1, 0))
+
+    def testReleaseRollsBack(self) :
+        pool = ConnectionPool(connect, size=1)
+        connection = pool.borrow()
+        connection.execute("CREATE TABLE t (x INTEGER)")
+        connection.commit()
+        connection.execute("INSERT INTO t VALUES (1)")
+        pool.release(connection)
+        connection = pool.borrow()
+        self.assertEqual(
+            connection.execute("SELECT COUNT(*) FROM t").fetchone()[0], 0)
+
+    def testStaleConnectionsAreRecycled(self) :
+        pool = ConnectionPool(connect, size=1, recycle=0.01)
+        connection = pool.borrow()
+        pool.release(connection)
+        time.sleep(0.02)
+        recycled = pool.borrow()
+        self.assertIsNot(recycled, connection)
+        self.assertRaises(sqlite3.ProgrammingError, connection.execute,
+                          "SELECT 1")
+        stats = pool.getStats()
+        self.assertEqual((stats['recycled'], stats['created'],
+                          stats['opened']), (1, 2, 1))
+
+    def testBrokenConnectionsAreReplaced(self) :
+        pool = ConnectionPool(connect, size=1)
+        connection = pool.borrow()
+        pool.release(connection)
+        connection.close()
+        replaced = pool.borrow()
+        self.assertIsNot(replaced, connection)
+        self.assertEqual(replaced.execute("SELECT 1").fetchone()[0], 1)
+        self.assertEqual(pool.getStats()['broken'], 1)
+
+    def testExhaustionTimeout(self) :
+        pool = ConnectionPool(connect, size=1, timeout=0.05)
+        connection = pool.borrow()
+        start = time.time()
+        self.assertRaises(PoolException, pool.borrow)
+        self.assertGreaterEqual(time.time() - start, 0.05)
+        stats = pool.getStats()
+        self.assertEqual((stats['waits'], stats['in_use'], stats['opened']),
+                         (1, 1, 1))
+        pool.release(connection)
+        self.assertIs(pool.borrow(), connection)
+
+    def testWaitForReleasedConnection(self) :
+        pool = ConnectionPool(connect, size=1, timeout=5)
+        connection = pool.borrow()
+        timer = threading.Timer(0.05, pool.release, (connection,))
+        timer.start()
+        self.assertIs(pool.borrow(), connection)
+        timer.join()
+        self.assertGreater(pool.getStats()['max_wait_time'], 0)
+
+    def testExceptionClosesConnection(self) :
+        pool = ConnectionPool(connect, size=1)
+        with self.assertRaises(ValueError) :
+            with pool.connection() as connection :
+                raise ValueError()
+        self.assertRaises(sqlite3.ProgrammingError, connection.execute,
+                          "SELECT 1")
+        stats = pool.getStats()
+        self.assertEqual((stats['broken'], stats['opened'], stats['in_use']),
+                         (1, 0, 0))
+        with pool.connection() as replaced :
+            self.assertIsNot(replaced, connection)
+            self.assertEqual(replaced.execute("SELECT 1").fetchone()[0], 1)
+        self.assertEqual(pool.getStats()['idle'], 1)
+
+    def testCloseAll(self) :
+        pool = ConnectionPool(connect, size=2)
+        first = pool.borrow()
+        second = pool.borrow()
+        pool.release(first)
+        pool.closeAll()
+        stats = pool.getStats()
+        self.assertEqual((stats['opened'], stats['idle']), (1, 0))
+        pool.release(second)
@@ -0,0 +1,188 @@
+"""
+Tests of the cache of the responses and of the conditional requests.
+"""
+
+import datetime as dt
+import unittest
+from contextlib import contextmanager
+
+import main
+from cache import SizedLRUCache
+from client import C2KRestClient
+from configuration import Configuration
+
+class ResponseCacheTest(unittest.TestCase) :
+
+    def setUp(self) :
+        self.response_cache = C2KRestClient.response_cache
+        self.main = main.main
+        C2KRestClient.response_cache = SizedLRUCache(
+            100, 1024 * 1024, size=lambda response : len(response['body']))
+        self.calls = []
+        self.result = '[{"duration":1}]'
+        main.main = self.analyze
+        self.app = main.app.test_client()
+
+    def tearDown(self) :
+        C2KRestClient.response_cache = self.response_cache
+        main.main = self.main
+
+    def analyze(self, argv) :
+        self.calls.append(argv)
+        return self.result
+
+    def testResponseIsCached(self) :
+        first = self.app.get('/1/activity/2018-03-01/2018-03-05')
+        second = self.app.get('/1/activity/2018-03-01/2018-03-05')
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.data, self.result.encode('utf-8'))
+        self.assertEqual(second.headers['ETag'], first.headers['ETag'])
+        self.assertIn('Last-Modified', second.headers)
+        self.assertEqual(len(self.calls), 1)
+        self.app.get('/2/activity/2018-03-01/2018-03-05')
+        self.app.get('/1/activity/2018-03-01/2018-03-06')
+        self.assertEqual(len(self.calls), 3)
+
+    def testConditionalRequests(self) :
+        first = self.app.get('/1/activity/2018-03-01/2018-03-05')
+        response = self.app.get('/1/activity/2018-03-01/2018-03-05',
+                                headers={'If-None-Match': 
+                                         first.headers['ETag']})
+        self.assertEqual((response.status_code, response.data), (304, b''))
+        response = self.app.get('/1/activity/2018-03-01/2018-03-05',
+                                headers={'If-Modified-Since': 
+                                         first.headers['Last-Modified']})
+        self.assertEqual(response.status_code, 304)
+        response = self.app.get('/1/activity/2018-03-01/2018-03-05',
+                                headers={'If-None-Match': '"other"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.calls), 1)
+
+    def testChangedDaysInvalidate(self) :
+        first = self.app.get('/1/activity/2018-03-01/2018-03-05')
+        C2KRestClient.invalidateResponses('1', '2018-03-06', '2018-03-07')
+        C2KRestClient.invalidateResponses('2', '2018-03-01', '2018-03-07')
+        self.app.get('/1/activity/2018-03-01/2018-03-05')
+        self.assertEqual(len(self.calls), 1)
+        self.result = '[{"duration":2}]'
+        C2KRestClient.invalidateResponses('1', '2018-03-05', '2018-03-06')
+        second = self.app.get('/1/activity/2018-03-01/2018-03-05',
+                              headers={'If-None-Match': 
+                                       first.headers['ETag']})
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.data, self.result.encode('utf-8'))
+        self.assertNotEqual(second.headers['ETag'], first.headers['ETag'])
+        self.assertEqual(len(self.calls), 2)
+
+    def testUnboundedResponsesAreInvalidated(self) :
+        self.app.get('/1/activity')
+        C2KRestClient.invalidateResponses('1', '2030-01-01', '2030-01-01')
+        self.app.get('/1/activity')
+        self.assertEqual(len(self.calls), 2)
+
+    def testErrorsAreNotCached(self) :
+        self.result = None
+        self.app.get('/1/activity/2018-03-01/2018-03-05')
+        self.app.get('/1/activity/2018-03-01/2018-03-05')
+        self.assertEqual(len(self.calls), 2)
+
+    def testResponseKey(self) :
+        self.assertEqual(main.responseKey(['1', 'activity', '2018-03-05',
+                                           '2018-03-01', None, None])[:3],
+                         ('1', '2018-03-01', '2018-03-05'))
+        self.assertEqual(main.responseKey(['1', 'activity', '2018-03-05',
+                                           None, None, None])[1:3],
+                         (None, None))
+
+    def testResponseDays(self) :
+        days = lambda *argv : main.responseDays(list(argv) 
+                                                + [None] * (6 - len(argv)))
+        self.assertEqual(days('1', 'analyze', '2018-03-05', '2018-03-10'),
+                         ('2018-03-05', '2018-03-10'))
+        self.assertEqual(days('1', 'analyze', '2018-03-05', '2018-03-10', 
+                              '2018-02-01', 'None'),
+                         ('2018-02-01', '2018-03-10'))
+        self.assertEqual(days('1', 'cosine', '2018-03-05', '2018-03-01'),
+                         ('2018-03-01', '2018-03-05'))
+        self.assertEqual(days('1', 'cosine', '2018-03-01', '2018-03-05', '7'),
+                         ('2018-03-01', '2018-03-11'))
+        self.assertEqual(days('1', 'cosine', '2018-03-01', '2018-03-05', 
+                              '2018-04-01', '2018-04-03'),
+                         ('2018-03-01', '2018-04-03'))
+        self.assertEqual(days('1', 'rolling', '2018-03-10', '2018-03-12', 
+                              '3'),
+                         ('2018-03-07', '2018-03-12'))
+        first_day = dt.date(2018, 3, 10) \
+                    - dt.timedelta(days=Configuration.ROLLING_NIGHTS)
+        self.assertEqual(days('1', 'rolling', '2018-03-10', '2018-03-12'),
+                         (first_day.strftime('%Y-%m-%d'), '2018-03-12'))
+        self.assertEqual(days('1', 'cosine', '2018-03-01', '2018-03-05', 'x'),
+                         (None, None))
+        self.assertEqual(days('1', 'average', '2018-03-01'), (None, None))
+
+    def testReadDaysInvalidate(self) :
+        self.app.get('/1/cosine/2018-03-01/2018-03-05/7')
+        self.app.get('/1/rolling/2018-03-10/2018-03-12/3')
+        C2KRestClient.invalidateResponses('1', '2018-03-11', '2018-03-11')
+        self.app.get('/1/cosine/2018-03-01/2018-03-05/7')
+        self.assertEqual(len(self.calls), 3)
+        C2KRestClient.invalidateResponses('1', '2018-03-07', '2018-03-07')
+        self.app.get('/1/rolling/2018-03-10/2018-03-12/3')
+        self.assertEqual(len(self.calls), 4)
+
+class CacheConnection :
+    """
+    A connection to the cache checking that the responses depending on the
+    written days are still cached when the write is committed.
+    """
+
+    def __init__(self, test) :
+        self.test = test
+        self.commits = 0
+
+    @contextmanager
+    def connection(self) :
+        yield self
+
+    @contextmanager
+    def cursor(self) :
+        yield self
+
+    def execute(self, sql_query, params) :
+        pass
+
+    def executemany(self, sql_query, rows) :
+        pass
+
+    def commit(self) :
+        self.test.assertEqual(
+            C2KRestClient.response_cache.getStats()['entries'], 2)
+        self.commits += 1
+
+class CacheWriteTest(unittest.TestCase) :
+
+    def setUp(self) :
+        self.saved = (C2KRestClient.response_cache,
+                      C2KRestClient.connection_pool)
+        C2KRestClient.response_cache = SizedLRUCache(
+            100, 1024 * 1024, size=lambda response : len(response['body']))
+        C2KRestClient.connection_pool = CacheConnection(self)
+        for user_id in ('1', '2') :
+            C2KRestClient.response_cache.put(
+                (user_id, '2018-03-01', '2018-03-05', ()), {'body': b'[]'})
+
+    def tearDown(self) :
+        (C2KRestClient.response_cache, 
+         C2KRestClient.connection_pool) = self.saved
+
+    def testResponsesAreInvalidatedAfterCommit(self) :
+        C2KRestClient.upsertSleepData(
+            [('1', '2018-03-05', '2018-03-05 01:00:00', '2018-03-05 07:00:00',
+              1, 10.0, 0, 0.0),
+             ('2', '2018-03-06', '2018-03-06 01:00:00', '2018-03-06 07:00:00',
+              1, 10.0, 0, 0.0)])
+        self.assertEqual(C2KRestClient.connection_pool.commits, 1)
+        self.assertIsNone(C2KRestClient.response_cache.get(
+            ('1', '2018-03-01', '2018-03-05', ())))
+        self.assertIsNotNone(C2KRestClient.response_cache.get(
+            ('2', '2018-03-01', '2018-03-05', ())))
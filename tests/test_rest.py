@@ -0,0 +1,119 @@
+"""
+Tests of the session to the REST server, with a local HTTP server.
+"""
+
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+
+import requests
+
+from rest import RestSession
+
+class Handler(BaseHTTPRequestHandler) :
+    """
+    Answers with the next of the statuses of the server, after its delay,
+    keeping the connection open.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def answer(self) :
+        server = self.server
+        with server.lock :
+            server.requests.append((self.command, self.path,
+                                    self.client_address))
+            status = server.statuses.pop(0) if server.statuses else 200
+        length = int(self.headers.get('Content-Length') or 0)
+        self.rfile.read(length)
+        time.sleep(server.delay)
+        body = b'{"STATUS": "OK"}'
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = answer
+    do_POST = answer
+
+    def log_message(self, *args) :
+        pass
+
+class RestSessionTest(unittest.TestCase) :
+
+    def setUp(self) :
+        self.server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.statuses = []
+        self.server.delay = 0
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+        self.base_url = 'http://127.0.0.1:%d' % self.server.server_port
+
+    def tearDown(self) :
+        self.server.shutdown()
+        self.server.server_close()
+
+    def testRetryConfiguration(self) :
+        session = RestSession(self.base_url, retries=4, backoff=0.25,
+                              max_connections=7)
+        adapter = session.session.get_adapter(self.base_url)
+        retry = adapter.max_retries
+        self.assertEqual((retry.total, retry.backoff_factor),
+                         (4, 0.25))
+        self.assertEqual(set(retry.status_forcelist),
+                         {500, 502, 503, 504})
+        methods = getattr(retry, 'allowed_methods', None) \
+                  or getattr(retry, 'method_whitelist')
+        self.assertEqual(set(methods), {'GET', 'POST'})
+        self.assertEqual((adapter._pool_maxsize, adapter._pool_block),
+                         (7, True))
+        # The waits double at each retry
+        retry = retry.increment('POST', '/measurements')
+        retry = retry.increment('POST', '/measurements')
+        retry = retry.increment('POST', '/measurements')
+        self.assertEqual(retry.get_backoff_time(), 1.0)
+
+    def testServerErrorsAreRetried(self) :
+        self.server.statuses = [503, 502, 200]
+        session = RestSession(self.base_url, retries=3, backoff=0)
+        response = session.post('/measurements', data='{}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(session.getStats()['/measurements']['errors'], 0)
+
+    def testRetriesAreBounded(self) :
+        self.server.statuses = [500] * 5
+        session = RestSession(self.base_url, retries=2, backoff=0)
+        response = session.get('/patients/1/sensors', name='sensors')
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(len(self.server.requests), 3)
+        stats = session.getStats()['sensors']
+        self.assertEqual((stats['calls'], stats['errors']), (1, 1))
+
+    def testClientErrorsAreNotRetried(self) :
+        self.server.statuses = [404, 200]
+        session = RestSession(self.base_url, retries=3, backoff=0)
+        self.assertEqual(session.get('/missing').status_code, 404)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def testTimeout(self) :
+        self.server.delay = 0.5
+        session = RestSession(self.base_url, timeout=(1, 0.1), retries=0)
+        with self.assertRaises(requests.exceptions.RequestException) :
+            session.get('/slow')
+        self.assertEqual(session.getStats()['/slow']['errors'], 1)
+
+    def testConnectionsAreReused(self) :
+        session = RestSession(self.base_url, retries=0)
+        for _ in range(5) :
+            session.get('/sensors').content
+        self.assertEqual(len(set(client_address for _, _, client_address
+                                 in self.server.requests)), 1)
+        stats = session.getStats()['/sensors']
+        self.assertEqual(stats['calls'], 5)
+        self.assertAlmostEqual(stats['average_time'],
+                               stats['total_time'] / 5)
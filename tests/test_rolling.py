@@ -0,0 +1,105 @@
+"""
+Tests that the rolling analysis compares each night with the direct
+average of the nights of the days before it.
+"""
+
+import datetime as dt
+import math
+import unittest
+
+import numpy as np
+
+from configuration import Configuration
+from test_similarity import FIRST_DAY
+from test_similarity import analitics
+from test_similarity import nightRows
+from test_similarity import vectors
+
+MEASURES = ['duration', 'count_micro_awakenings', 'time_micro_awakenings',
+            'count_awakenings', 'time_awakenings']
+
+def differences() :
+    return [Configuration.DIFFERENCE_DURATION,
+            Configuration.DIFFERENCE_COUNT_MICRO_AWAKENING,
+            Configuration.DIFFERENCE_TIME_MICRO_AWAKENING,
+            Configuration.DIFFERENCE_COUNT_AWAKENING,
+            Configuration.DIFFERENCE_TIME_AWAKENING]
+
+class RollingAnalysisTest(unittest.TestCase) :
+
+    def expected(self, rows, start_date, end_date, nights) :
+        """
+        Averages the nights of the window of each night one by one.
+        """
+        vectors_of_days = vectors(rows)
+        expected = []
+        day = start_date
+        while day <= end_date :
+            window = [vector for window_day, vector 
+                      in vectors_of_days.items()
+                      if day - dt.timedelta(days=nights) <= window_day < day]
+            if day in vectors_of_days and window :
+                averages = [sum(values) / len(window) 
+                            for values in zip(*window)]
+                for what, detected, average, difference in zip(
+                        MEASURES, vectors_of_days[day], averages,
+                        differences()) :
+                    if abs(detected - average) > average * difference :
+                        expected.append([day, what, detected, average,
+                                         math.nan if average == 0 else
+                                         (detected - average) * 100 
+                                         / average])
+            day += dt.timedelta(days=1)
+        return expected
+
+    def assertRolling(self, result, expected) :
+        self.assertEqual([list(row[:2]) 
+                          for row in result.itertuples(index=False)],
+                         [row[:2] for row in expected])
+        for i, name in enumerate(['detected', 'average', 'deviation'], 2) :
+            np.testing.assert_allclose(result[name].values.astype(float),
+                                       [row[i] for row in expected])
+
+    def testWindows(self) :
+        rows = nightRows(8, 40)
+        start_date = FIRST_DAY + dt.timedelta(days=2)
+        end_date = FIRST_DAY + dt.timedelta(days=35)
+        for nights in (1, 3, 7, 20) :
+            with self.subTest(nights=nights) :
+                result = analitics(rows).rolling_analysis(start_date,
+                                                          end_date, nights)
+                expected = self.expected(rows, start_date, end_date, nights)
+                self.assertTrue(expected)
+                self.assertRolling(result, expected)
+
+    def testDefaultWindow(self) :
+        rows = nightRows(9, 30)
+        end_date = FIRST_DAY + dt.timedelta(days=29)
+        self.assertRolling(
+            analitics(rows).rolling_analysis(FIRST_DAY, end_date),
+            self.expected(rows, FIRST_DAY, end_date, 
+                          Configuration.ROLLING_NIGHTS))
+
+    def testSmallDifferencesAreNormal(self) :
+        # Nights differing by less than the thresholds are not reported
+        rows = nightRows(10, 20)
+        for row in rows :
+            row[1] = dt.datetime.combine(row[0], dt.time(0))
+            row[2] = row[1] + dt.timedelta(hours=7)
+            row[3:] = [2, 100.0, 1, 1000.0]
+        rows[-1][2] += dt.timedelta(hours=2)
+        result = analitics(rows).rolling_analysis(
+            FIRST_DAY, FIRST_DAY + dt.timedelta(days=19), 5)
+        self.assertEqual(list(result['date']), [rows[-1][0]])
+        self.assertEqual(list(result['what']), ['duration'])
+
+    def testEmptyInterval(self) :
+        rows = nightRows(11, 10)
+        for start, end, nights in ((5, 4, 3), (0, 5, 0)) :
+            result = analitics(rows).rolling_analysis(
+                FIRST_DAY + dt.timedelta(days=start),
+                FIRST_DAY + dt.timedelta(days=end), nights)
+            self.assertTrue(result.empty)
+            self.assertEqual(list(result.columns), 
+                             ['date', 'what', 'detected', 'average',
+                              'deviation'])
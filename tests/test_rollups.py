@@ -0,0 +1,324 @@
+"""
+Tests of the weekly and monthly rollups written with the cache and of the
+averages of long intervals summed from them.
+"""
+
+import datetime as dt
+import os
+import random
+import re
+import sqlite3
+import unittest
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from analitics import Analitics
+from cache import SizedLRUCache
+from client import C2KRestClient
+from configuration import Configuration
+from measurements import MeasurementColumns
+from measurements import MeasurementDecoder
+
+SQL_DIR = os.path.join(os.path.dirname(__file__), '..', 'sql')
+
+COLUMNS = ['date', 'start_datetime', 'end_datetime', 
+           'count_micro_awakenings', 'time_micro_awakenings', 
+           'count_awakenings', 'time_awakenings']
+
+class Mapping :
+    devices = {}
+
+class RollupClient :
+    """
+    A client whose nights are in the cache, with the rollups calculated
+    from the cached rows as updateSleepRollups does. The days not in the
+    cache have no events.
+    """
+
+    mapping = Mapping()
+    periodStart = C2KRestClient.periodStart
+    nextPeriod = C2KRestClient.nextPeriod
+
+    def __init__(self, rows) :
+        self.rows = rows
+
+    def getCachedSleepData(self, start_date, end_date) :
+        start_date = start_date.date() \
+         if isinstance(start_date, dt.datetime) else start_date
+        end_date = end_date.date() \
+         if isinstance(end_date, dt.datetime) else end_date
+        return pd.DataFrame([row for row in self.rows 
+                             if start_date <= row[0] <= end_date],
+                            columns=COLUMNS)
+
+    def getSleepRollups(self, period, first_start, last_start) :
+        rollups = {}
+        period_start = first_start
+        while period_start <= last_start :
+            period_end = self.nextPeriod(period, period_start)
+            days = {}
+            for row in self.rows :
+                if period_start <= row[0] < period_end :
+                    sums = days.setdefault(row[0], np.zeros(5))
+                    sums += [(row[2] - row[1]).total_seconds()] + row[3:]
+            with_duration = sorted(day for day, sums in days.items() 
+                                   if sums[0] != 0)
+            rollup = {'cached_days': len(days), 'days': len(with_duration),
+                      'first_date': min(with_duration, default=None),
+                      'last_date': max(with_duration, default=None)}
+            for i, measure in enumerate(C2KRestClient.ROLLUP_MEASURES) :
+                rollup[measure] = sum(days[day][i] for day in with_duration)
+            rollups[period_start] = rollup
+            period_start = period_end
+        return rollups
+
+    def getSleepEvents(self, start_datetime, end_datetime) :
+        empty = np.zeros(0, dtype=np.int32)
+        return MeasurementColumns(empty.astype(np.int64), empty, empty, 
+                                  empty, MeasurementDecoder({}))
+
+    def getSleepCheckpoints(self, start_date, end_date) :
+        return {}
+
+    def bufferSleepCheckpoint(self, day, state) :
+        pass
+
+    def bufferSleepDataToCache(self, sleep_df) :
+        pass
+
+    def flushSleepDataToCache(self) :
+        pass
+
+def nights(first_day, count, seed, without_duration=()) :
+    """
+    Creates the cached sleep activities of consecutive nights.
+    """
+    generator = random.Random(seed)
+    rows = []
+    for i in range(count) :
+        day = first_day + dt.timedelta(days=i)
+        start = dt.datetime.combine(day, dt.time()) \
+                - dt.timedelta(minutes=generator.randint(0, 180))
+        end = start if day in without_duration \
+              else start + dt.timedelta(minutes=generator.randint(300, 600))
+        rows.append([day, start, end, generator.randint(0, 5), 
+                     float(generator.randint(0, 300)), 
+                     generator.randint(0, 3), 
+                     float(generator.randint(0, 3000))])
+    return rows
+
+class SleepAverageForDaysTest(unittest.TestCase) :
+
+    def setUp(self) :
+        self.first_day = dt.date(2018, 3, 1)
+        self.rollup_min_days = Configuration.ROLLUP_MIN_DAYS
+
+    def tearDown(self) :
+        Configuration.ROLLUP_MIN_DAYS = self.rollup_min_days
+
+    def average(self, rows, days, rollup_min_days=28) :
+        Configuration.ROLLUP_MIN_DAYS = rollup_min_days
+        analitics = Analitics(RollupClient(rows))
+        analitics.sleep = analitics.createSleep()
+        return analitics.sleepAverageForDays(
+            self.first_day, self.first_day + dt.timedelta(days=days - 1))
+
+    def assertSameAverage(self, first, second) :
+        self.assertEqual(list(first.columns), list(second.columns))
+        self.assertEqual(len(first), len(second))
+        if len(first) :
+            self.assertEqual(list(first.iloc[0, :2]), 
+                             list(second.iloc[0, :2]))
+            np.testing.assert_allclose(first.iloc[0, 2:].astype(float),
+                                       second.iloc[0, 2:].astype(float))
+
+    def testRollupsAsDays(self) :
+        rows = nights(self.first_day, 70, 1)
+        for days in (27, 28, 40, 66) :
+            average = self.average(rows, days, rollup_min_days=1)
+            self.assertEqual(len(average), 1)
+            self.assertEqual(average.iloc[0]['end_date'],
+                             self.first_day + dt.timedelta(days=days - 1))
+            self.assertSameAverage(average, 
+                                   self.average(rows, days, 
+                                                rollup_min_days=1000))
+
+    def testSameNightsAtBothLengths(self) :
+        # The 28th day has no nights: the 27 days are averaged from the
+        # days, the 28 days from the rollups of their weeks and the days
+        rows = nights(self.first_day, 27, 2)
+        short = self.average(rows, 27)
+        self.assertEqual(len(short), 1)
+        self.assertSameAverage(short, self.average(rows, 28))
+
+    def testDayWithoutDurationAtBothLengths(self) :
+        for stop in (0, 9, 26) :
+            rows = nights(self.first_day, 40, stop, 
+                          [self.first_day + dt.timedelta(days=stop)])
+            for days in (27, 28, 40) :
+                for rollup_min_days in (1, 28, 1000) :
+                    self.assertTrue(self.average(rows, days, 
+                                                 rollup_min_days).empty)
+
+    def testDayWithoutDurationInsideRollup(self) :
+        # The day is inside a full month and a full week of the cache
+        rows = nights(self.first_day, 70, 3, [dt.date(2018, 4, 18)])
+        self.assertTrue(self.average(rows, 70).empty)
+        self.assertFalse(self.average(rows, 40).empty)
+
+class SqliteCursor :
+    """
+    Runs the MySQL statements of C2KRestClient on sqlite3, translating the
+    parameters, TIMESTAMPDIFF and ON DUPLICATE KEY UPDATE.
+    """
+
+    def __init__(self, connection) :
+        self.cursor = connection.cursor()
+
+    def __enter__(self) :
+        return self
+
+    def __exit__(self, *args) :
+        self.cursor.close()
+
+    def translate(self, sql_query) :
+        sql_query = sql_query.replace("%s", "?").replace(
+            "TIMESTAMPDIFF(SECOND,", "TIMESTAMPDIFF('SECOND',")
+        if " ON DUPLICATE KEY UPDATE " in sql_query :
+            insert, update = sql_query.split(" ON DUPLICATE KEY UPDATE ")
+            # An INSERT ... SELECT needs a WHERE before the upsert
+            sql_query = insert + (" WHERE 1" if " SELECT " in insert 
+                                  else "") \
+                        + " ON CONFLICT DO UPDATE SET " \
+                        + re.sub(r"VALUES\((\w+)\)", r"excluded.\1", update)
+        return sql_query
+
+    def execute(self, sql_query, params=()) :
+        self.cursor.execute(self.translate(sql_query), params)
+
+    def executemany(self, sql_query, rows) :
+        self.cursor.executemany(self.translate(sql_query), rows)
+
+    def fetchall(self) :
+        return self.cursor.fetchall()
+
+class SqliteDatabase :
+    """
+    A database of sqlite3 reached as a ConnectionPool, with the tables 
+    created by the scripts in sql/.
+    """
+
+    def __init__(self) :
+        self.database = sqlite3.connect(':memory:')
+        self.database.create_function(
+            'TIMESTAMPDIFF', 3, lambda unit, start, end : int(
+                (dt.datetime.fromisoformat(end) 
+                 - dt.datetime.fromisoformat(start)).total_seconds()))
+        self.database.execute(
+            "CREATE TABLE sleep_cache (user_id VARCHAR(64) NOT NULL,"
+            " date DATE NOT NULL, start_datetime DATETIME NOT NULL,"
+            " end_datetime DATETIME NOT NULL, count_micro_awakenings INT,"
+            " time_micro_awakenings DOUBLE, count_awakenings INT,"
+            " time_awakenings DOUBLE,"
+            " UNIQUE (user_id, date, start_datetime))")
+        for script in ('002_rollups.sql', '003_checkpoints.sql') :
+            with open(os.path.join(SQL_DIR, script)) as sql_file :
+                self.database.executescript(sql_file.read())
+
+    @contextmanager
+    def connection(self) :
+        yield self
+
+    def cursor(self) :
+        return SqliteCursor(self.database)
+
+    def commit(self) :
+        self.database.commit()
+
+class UpdateSleepRollupsTest(unittest.TestCase) :
+
+    TABLES = {'DB_TABLE_CACHE': 'sleep_cache',
+              'DB_TABLE_CHECKPOINT': 'sleep_checkpoint',
+              'DB_TABLE_ROLLUP_WEEK': 'sleep_rollup_week',
+              'DB_TABLE_ROLLUP_MONTH': 'sleep_rollup_month'}
+
+    def setUp(self) :
+        self.saved = dict((name, getattr(C2KRestClient, name))
+                          for name in list(self.TABLES) 
+                          + ['connection_pool', 'response_cache'])
+        for name, table in self.TABLES.items() :
+            setattr(C2KRestClient, name, table)
+        C2KRestClient.connection_pool = SqliteDatabase()
+        C2KRestClient.response_cache = SizedLRUCache(
+            10, 1024, size=lambda response : len(response['body']))
+
+    def tearDown(self) :
+        for name, value in self.saved.items() :
+            setattr(C2KRestClient, name, value)
+
+    def write(self, user_id, rows) :
+        C2KRestClient.upsertSleepData(
+            [(user_id, row[0].strftime('%Y-%m-%d'),
+              row[1].strftime('%Y-%m-%d %H:%M:%S'),
+              row[2].strftime('%Y-%m-%d %H:%M:%S')) + tuple(row[3:])
+             for row in rows])
+
+    def rollups(self, user_id, period, first_start, last_start) :
+        client = C2KRestClient.__new__(C2KRestClient)
+        client.user_id = user_id
+        rollups = client.getSleepRollups(period, first_start, last_start)
+        # sqlite3 gives the dates as text
+        return dict((dt.datetime.strptime(period_start, '%Y-%m-%d').date(),
+                     rollup) for period_start, rollup in rollups.items())
+
+    def expected(self, rows, period, first_start, last_start) :
+        rollups = RollupClient(rows).getSleepRollups(period, first_start,
+                                                     last_start)
+        for period_start in list(rollups) :
+            if rollups[period_start]['cached_days'] == 0 :
+                del rollups[period_start]
+            else :
+                for name in ('first_date', 'last_date') :
+                    day = rollups[period_start][name]
+                    rollups[period_start][name] = \
+                     None if day is None else day.strftime('%Y-%m-%d')
+        return rollups
+
+    def assertRollups(self, rows, user_id) :
+        for period, first_start, last_start in (
+                ('week', dt.date(2018, 2, 26), dt.date(2018, 4, 30)),
+                ('month', dt.date(2018, 2, 1), dt.date(2018, 5, 1))) :
+            stored = self.rollups(user_id, period, first_start, last_start)
+            expected = self.expected(rows, period, first_start, last_start)
+            self.assertEqual(sorted(stored), sorted(expected))
+            for period_start, rollup in expected.items() :
+                self.assertEqual(
+                    [stored[period_start][name] for name in rollup],
+                    list(rollup.values()))
+
+    def testRollupsOfTheWrittenDays(self) :
+        first_day = dt.date(2018, 3, 1)
+        rows = nights(first_day, 40, 4, [dt.date(2018, 3, 14)])
+        others = nights(first_day, 10, 5)
+        self.write('1', rows[:25])
+        self.write('2', others)
+        self.write('1', rows[25:])
+        self.assertRollups(rows, '1')
+        self.assertRollups(others, '2')
+
+    def testRollupsOfRewrittenDays(self) :
+        rows = nights(dt.date(2018, 3, 1), 20, 6)
+        self.write('1', rows)
+        # The days written again replace their sums, a new night of a 
+        # cached day is added to them
+        rewritten = [row[:3] + [row[3] + 1, row[4] + 10.0, row[5], 0.0]
+                     for row in rows[5:9]]
+        extra = [rows[12][0], rows[12][2], 
+                 rows[12][2] + dt.timedelta(hours=1), 1, 5.0, 0, 0.0]
+        self.write('1', rewritten + [extra])
+        self.assertRollups(rows[:5] + rewritten + rows[9:] + [extra], '1')
+
+if __name__ == '__main__' :
+    unittest.main()
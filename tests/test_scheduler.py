@@ -0,0 +1,152 @@
+"""
+Tests of the nightly precompute, driven by a fake clock.
+"""
+
+import datetime as dt
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from scheduler import NightlyScheduler
+
+class Clock :
+    """
+    A clock moved forward only by the waits and the analyses.
+    """
+
+    def __init__(self, now) :
+        self.now = now
+
+    def __call__(self) :
+        return self.now
+
+    def advance(self, seconds) :
+        self.now += dt.timedelta(seconds=seconds)
+
+class StopEvent :
+    """
+    The stop event of the scheduler, whose waits move the clock forward
+    without waiting.
+    """
+
+    def __init__(self, clock) :
+        self.clock = clock
+        self.waits = []
+        self.stopped = False
+
+    def wait(self, seconds) :
+        self.waits.append(seconds)
+        if not self.stopped :
+            self.clock.advance(seconds)
+        return self.stopped
+
+    def set(self) :
+        self.stopped = True
+
+    def is_set(self) :
+        return self.stopped
+
+class NightlySchedulerTest(unittest.TestCase) :
+
+    def setUp(self) :
+        self.clock = Clock(dt.datetime(2018, 3, 2, 1, 0))
+        self.analyzed = []
+        self.failures = {}
+
+    def analyze(self, user_id, day) :
+        self.analyzed.append((user_id, day, self.clock()))
+        if self.failures.get(user_id, 0) > 0 :
+            self.failures[user_id] -= 1
+            raise ValueError(user_id)
+        self.clock.advance(int(user_id) if user_id.isdigit() else 1)
+
+    def scheduler(self, users, **kwargs) :
+        kwargs.setdefault('workers', 1)
+        scheduler = NightlyScheduler(self.analyze, at='02:00', users=users,
+                                     users_file='', retries=3, backoff=30,
+                                     clock=self.clock, **kwargs)
+        scheduler.stopped = StopEvent(self.clock)
+        return scheduler
+
+    def testNextRun(self) :
+        scheduler = self.scheduler([])
+        for now, expected in (
+                (dt.datetime(2018, 3, 2, 1, 59), dt.datetime(2018, 3, 2, 2)),
+                (dt.datetime(2018, 3, 2, 2), dt.datetime(2018, 3, 3, 2)),
+                (dt.datetime(2018, 3, 2, 23), dt.datetime(2018, 3, 3, 2))) :
+            self.assertEqual(scheduler.nextRun(now), expected)
+
+    def testRunsAtTheConfiguredTime(self) :
+        scheduler = self.scheduler(['a'])
+        runs = []
+        def analyze(user_id, day) :
+            runs.append((day, self.clock()))
+            self.clock.advance(600)
+            if len(runs) == 2 :
+                scheduler.stop()
+        scheduler.analyze = analyze
+        scheduler.run()
+        self.assertEqual(runs, [(dt.date(2018, 3, 1),
+                                 dt.datetime(2018, 3, 2, 2)),
+                                (dt.date(2018, 3, 2),
+                                 dt.datetime(2018, 3, 3, 2))])
+        self.assertEqual(scheduler.stopped.waits, [3600, 24 * 3600 - 600])
+        self.assertEqual(scheduler.last_summary['day'], '2018-03-02')
+
+    def testRetriesWithBackoff(self) :
+        self.failures = {'flaky': 2, 'bad': 10}
+        scheduler = self.scheduler(['ok', 'flaky', 'bad'])
+        summary = scheduler.runOnce(dt.date(2018, 3, 1))
+        self.assertEqual(scheduler.stopped.waits, [30, 60, 30, 60, 120])
+        self.assertEqual([user_id for user_id, _, _ in self.analyzed],
+                         ['ok'] + ['flaky'] * 3 + ['bad'] * 4)
+        self.assertEqual((summary['users'], summary['done'],
+                          summary['failed'], summary['attempts'],
+                          summary['failed_users']),
+                         (3, 2, 1, 8, ['bad']))
+        self.assertIs(scheduler.last_summary, summary)
+
+    def testStopInterruptsRetries(self) :
+        self.failures = {'bad': 10}
+        scheduler = self.scheduler(['bad', 'ok'])
+        scheduler.stop()
+        summary = scheduler.runOnce()
+        self.assertEqual(self.analyzed[0][:2], ('bad', dt.date(2018, 3, 1)))
+        self.assertEqual((summary['done'], summary['failed'],
+                          summary['attempts']), (1, 1, 2))
+
+    def testSummaryPercentiles(self) :
+        users = [str(seconds) for seconds in range(1, 101)]
+        summary = self.scheduler(users).runOnce(dt.date(2018, 3, 1))
+        durations = np.arange(1, 101)
+        self.assertEqual(summary['elapsed'], durations.sum())
+        self.assertAlmostEqual(summary['throughput'], 100 / durations.sum())
+        for name, percentile in (('p50', 50), ('p95', 95), ('p99', 99),
+                                 ('max', 100)) :
+            self.assertAlmostEqual(summary[name],
+                                   np.percentile(durations, percentile))
+        self.failures = {'1': 10}
+        summary = self.scheduler(['1']).runOnce(dt.date(2018, 3, 1))
+        self.assertEqual((summary['done'], summary['p50'], summary['max'],
+                          summary['throughput']), (0, None, None, 0.0))
+
+    def testUsersFromListAndFile(self) :
+        users_file, path = tempfile.mkstemp()
+        with os.fdopen(users_file, 'w') as users_file :
+            users_file.write("b\n\n# a comment\n a \nc\nb\n")
+        try :
+            scheduler = self.scheduler(['a', 'd'])
+            scheduler.users_file = path
+            self.assertEqual(scheduler.loadUsers(), ['a', 'd', 'b', 'c'])
+        finally :
+            os.remove(path)
+
+    def testConcurrentUsers(self) :
+        users = [str(user) for user in range(20)]
+        summary = NightlyScheduler(lambda user_id, day : None, at='02:00',
+                                   users=users, users_file='', workers=4,
+                                   retries=0).runOnce(dt.date(2018, 3, 1))
+        self.assertEqual((summary['users'], summary['done'],
+                          summary['attempts']), (20, 20, 20))
@@ -0,0 +1,189 @@
+"""
+Tests that the similarities between nights and periods are the ones of
+the vectors of the nights calculated one by one.
+"""
+
+import datetime as dt
+import math
+import unittest
+
+import numpy as np
+
+from analitics import Analitics
+from configuration import Configuration
+from test_rollups import RollupClient
+from test_rollups import nights
+
+FIRST_DAY = dt.date(2018, 3, 1)
+
+def nightRows(seed, days) :
+    """
+    Creates the cached nights of an interval of days, with a night without
+    duration and some days without nights.
+    """
+    rows = nights(FIRST_DAY, days, seed, [FIRST_DAY + dt.timedelta(days=3)])
+    return [row for i, row in enumerate(rows) if i % 5 != 2]
+
+def vectors(rows) :
+    """
+    Sums the measures of the nights of each day, the days without a
+    duration left out.
+    """
+    days = {}
+    for row in rows :
+        vector = days.setdefault(row[0], [0.0] * 5)
+        vector[0] += math.floor((row[2] - row[1]).total_seconds())
+        for i in range(1, 5) :
+            vector[i] += row[i + 2]
+    return dict((day, vector) for day, vector in sorted(days.items())
+                if vector[0] != 0)
+
+def cosine(first, second) :
+    return sum(x * y for x, y in zip(first, second)) \
+           / math.sqrt(sum(x * x for x in first)) \
+           / math.sqrt(sum(y * y for y in second))
+
+def analitics(rows) :
+    analitics = Analitics(RollupClient(rows))
+    analitics.sleep = analitics.createSleep()
+    return analitics
+
+class CosineMatrixTest(unittest.TestCase) :
+
+    DAYS = 30
+
+    def setUp(self) :
+        self.block_size = Configuration.SIMILARITY_BLOCK_SIZE
+
+    def tearDown(self) :
+        Configuration.SIMILARITY_BLOCK_SIZE = self.block_size
+
+    def matrix(self, rows, top_k=None) :
+        return analitics(rows).cosine_matrix(
+            FIRST_DAY, FIRST_DAY + dt.timedelta(days=self.DAYS - 1), top_k)
+
+    def assertMatrix(self, matrix, expected) :
+        self.assertEqual([list(row[:2]) + list(row[3:]) 
+                          for row in matrix.itertuples(index=False)],
+                         [row[:2] + row[3:] for row in expected])
+        np.testing.assert_allclose(matrix['similarity'].values.astype(float),
+                                   [row[2] for row in expected])
+
+    def testAllCouples(self) :
+        rows = nightRows(1, self.DAYS)
+        nights = vectors(rows)
+        expected = [[day_1, day_2, cosine(nights[day_1], nights[day_2])]
+                    for day_1 in nights for day_2 in nights]
+        for block_size in (1, 7, 512) :
+            Configuration.SIMILARITY_BLOCK_SIZE = block_size
+            with self.subTest(block_size=block_size) :
+                self.assertMatrix(self.matrix(rows), expected)
+
+    def testMostSimilarNights(self) :
+        rows = nightRows(2, self.DAYS)
+        nights = vectors(rows)
+        for top_k in (1, 3, 100) :
+            expected = []
+            for day_1 in nights :
+                similar = sorted(((cosine(nights[day_1], nights[day_2]), 
+                                   day_2) for day_2 in nights 
+                                  if day_2 != day_1), reverse=True)
+                expected += [[day_1, day_2, similarity, rank] 
+                             for rank, (similarity, day_2) 
+                             in enumerate(similar[:top_k], 1)]
+            for block_size in (1, 7, 512) :
+                Configuration.SIMILARITY_BLOCK_SIZE = block_size
+                with self.subTest(top_k=top_k, block_size=block_size) :
+                    self.assertMatrix(self.matrix(rows, top_k), expected)
+
+    def testWithoutNights(self) :
+        matrix = self.matrix([])
+        self.assertTrue(matrix.empty)
+        self.assertEqual(list(matrix.columns), 
+                         ['date_1', 'date_2', 'similarity'])
+        self.assertTrue(self.matrix(nightRows(3, 1), 2).empty)
+
+class CosineForDaysTest(unittest.TestCase) :
+
+    def day(self, day) :
+        return FIRST_DAY + dt.timedelta(days=day)
+
+    def assertSimilarities(self, result, expected) :
+        self.assertEqual([list(row[:4]) 
+                          for row in result.itertuples(index=False)],
+                         [row[:4] for row in expected])
+        np.testing.assert_allclose(result['similarity'].values.astype(float),
+                                   [row[4] for row in expected])
+
+    def testDayByDay(self) :
+        rows = nightRows(4, 40)
+        nights = vectors(rows)
+        # Overlapping, consecutive and distant periods, in both orders
+        for first, second, days in ((0, 3, 10), (10, 0, 10), (0, 10, 10),
+                                    (25, 2, 12), (6, 6, 1)) :
+            expected = []
+            for i in range(days) :
+                day_1 = self.day(first + i)
+                day_2 = self.day(second + i)
+                if day_1 in nights and day_2 in nights :
+                    expected.append([day_1, day_1, day_2, day_2,
+                                     cosine(nights[day_1], nights[day_2])])
+            with self.subTest(first=first, second=second, days=days) :
+                self.assertSimilarities(
+                    analitics(rows).cosine_for_days(self.day(first), 
+                                                    self.day(second), days,
+                                                    None), expected)
+
+    def testTwoDays(self) :
+        rows = nightRows(5, 20)
+        nights = vectors(rows)
+        self.assertSimilarities(
+            analitics(rows).cosine_for_days(self.day(1), self.day(9), None,
+                                            None),
+            [[self.day(1), self.day(1), self.day(9), self.day(9),
+              cosine(nights[self.day(1)], nights[self.day(9)])]])
+        # The 3rd day has no nights, the 4th has no duration
+        for day in (2, 3) :
+            self.assertTrue(analitics(rows).cosine_for_days(
+                self.day(1), self.day(day), None, None).empty)
+
+    def testIntervals(self) :
+        rows = nightRows(6, 40)
+        nights = vectors(rows)
+        for first, second in (((5, 14), (15, 25)), ((5, 20), (10, 30)),
+                              ((20, 30), (5, 11))) :
+            averages = [np.mean([vector for day, vector in nights.items()
+                                 if self.day(start) <= day <= self.day(end)],
+                                axis=0) for start, end in (first, second)]
+            with self.subTest(first=first, second=second) :
+                self.assertSimilarities(
+                    analitics(rows).cosine_for_days(
+                        self.day(first[0]), self.day(first[1]),
+                        self.day(second[0]), self.day(second[1])),
+                    [[self.day(first[0]), self.day(first[1]),
+                      self.day(second[0]), self.day(second[1]),
+                      cosine(*averages)]])
+
+    def testIntervalsAsSeparatePeriods(self) :
+        # The periods taken at once are averaged as the periods taken
+        # one by one; a period with a night without duration has no average
+        rows = nightRows(7, 40)
+        for first, second in (((4, 12), (8, 30)), ((20, 33), (5, 9)),
+                              ((0, 12), (8, 30)), ((5, 9), (2, 9))) :
+            expected = analitics(rows)
+            averages = [expected.sleepAverage(expected.sleepActivities(
+                            expected.sleep, self.day(start), self.day(end)))
+                        for start, end in (first, second)]
+            result = analitics(rows).cosine_for_days(
+                self.day(first[0]), self.day(first[1]), 
+                self.day(second[0]), self.day(second[1]))
+            with self.subTest(first=first, second=second) :
+                if any(average.empty for average in averages) :
+                    self.assertTrue(result.empty)
+                    continue
+                self.assertAlmostEqual(
+                    result['similarity'][0], 
+                    expected.cosine_similarity(*[
+                        average.loc[0, expected.measures].values
+                        .astype(float) for average in averages])
+                    ['similarity'][0])
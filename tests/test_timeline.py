@@ -0,0 +1,152 @@
+"""
+Tests of the states of the devices given as intervals of time and as
+steps of a minute.
+"""
+
+import datetime as dt
+import random
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from analitics import Analitics
+from test_intelligence import EngineClient
+from test_intelligence import FIRST_DAY
+from test_intelligence import measurement
+from test_intelligence import measurements
+
+def datetime(hour, minute=0, second=0) :
+    return dt.datetime.combine(FIRST_DAY, dt.time(hour, minute, second))
+
+def intervals(timeline) :
+    return [(device, state, start.to_pydatetime(), end.to_pydatetime(),
+             value)
+            for device, state, start, end, value
+            in timeline.itertuples(index=False)]
+
+class TimelineTest(unittest.TestCase) :
+
+    def timeline(self, rows, first_day, last_day) :
+        return Analitics(EngineClient(rows)).timeline(first_day, last_day)
+
+    def testIntervals(self) :
+        rows = [measurement(datetime(1), 'pir', '1'),
+                measurement(datetime(2), 'bed', '1'),
+                measurement(datetime(3), 'bed', '1'),
+                measurement(datetime(3), 'pir', '0'),
+                measurement(datetime(4, 30), 'bed', '0'),
+                measurement(datetime(4, 30), 'bed', '1'),
+                measurement(datetime(6), 'pir', '1')]
+        end = datetime(0) + dt.timedelta(days=1)
+        self.assertEqual(intervals(self.timeline(rows, FIRST_DAY, FIRST_DAY)),
+            [('pir', 'PRESENCE', datetime(1), datetime(3), 'PRESENT'),
+             ('pir', 'PRESENCE', datetime(3), datetime(6), 'NOT_PRESENT'),
+             ('pir', 'PRESENCE', datetime(6), end, 'PRESENT'),
+             ('bed', 'PRESENCE', datetime(2), datetime(4, 30), 'PRESENT'),
+             ('bed', 'PRESENCE', datetime(4, 30), datetime(4, 30),
+              'NOT_PRESENT'),
+             ('bed', 'PRESENCE', datetime(4, 30), end, 'PRESENT')])
+
+    def testNoMeasurements(self) :
+        timeline = self.timeline([measurement(datetime(1), 'bed', '1')],
+                                 FIRST_DAY + dt.timedelta(days=1),
+                                 FIRST_DAY + dt.timedelta(days=2))
+        self.assertTrue(timeline.empty)
+        self.assertEqual(list(timeline.columns),
+                         ['device', 'state', 'start_datetime',
+                          'end_datetime', 'value'])
+
+    def testRunsOfEqualValues(self) :
+        for seed in range(10) :
+            rows = measurements(seed, 4)
+            last_day = FIRST_DAY + dt.timedelta(
+                days=random.Random(seed).randint(0, 3))
+            end = dt.datetime.combine(last_day, dt.time()) \
+                  + dt.timedelta(days=1)
+            # The intervals are the runs of equal values of each timeline,
+            # in the order of the first measurement of the device
+            expected = {}
+            for event in EngineClient(rows).getSleepColumns(
+                datetime(0), end) :
+                runs = expected.setdefault(
+                    (event.device_id, event.name_id.name), [])
+                if runs and runs[-1][4] == event.value_id.name :
+                    continue
+                if runs :
+                    runs[-1][3] = event.datetime
+                runs.append([event.device_id, event.name_id.name,
+                             event.datetime, end, event.value_id.name])
+            devices = list(dict.fromkeys(device for device, _ in expected))
+            expected = [tuple(run) for key in sorted(
+                            expected, key=lambda key : devices.index(key[0]))
+                        for run in expected[key]]
+            with self.subTest(seed=seed) :
+                self.assertEqual(intervals(self.timeline(rows, FIRST_DAY,
+                                                         last_day)),
+                                 expected)
+
+class DeviceTimelinesTest(unittest.TestCase) :
+
+    def expected(self, columns, start_datetime, end_datetime) :
+        """
+        Fills the minutes of the states one change at a time, from the
+        minute of the change to the end.
+        """
+        time_range = pd.date_range(start_datetime, end_datetime, freq='min')
+        devices = {}
+        for event in columns :
+            active = int(event.value_id not in Analitics.inactive_values)
+            states = devices.setdefault(event.device_id, {})
+            name = event.device_id + "-" + str(event.name_id)
+            if name not in states :
+                states[name] = np.full(len(time_range), 1 - active)
+            minute = int((event.datetime - start_datetime).total_seconds()
+                         // 60)
+            states[name][minute:] = active
+        steps = dict((name, values) for states in devices.values()
+                     for name, values in states.items())
+        expected = pd.DataFrame(steps, index=time_range, 
+                                columns=list(steps))
+        expected.index.name = 'datetime'
+        return expected
+
+    def testRandomPeriods(self) :
+        for seed in range(12) :
+            generator = random.Random(seed)
+            rows = measurements(seed, 5)
+            first_day = FIRST_DAY + dt.timedelta(days=generator.randint(0, 2))
+            last_day = first_day + dt.timedelta(days=generator.randint(0, 2))
+            start_datetime = dt.datetime.combine(first_day, dt.time.min)
+            end_datetime = dt.datetime.combine(last_day, dt.time.max)
+            analitics = Analitics(EngineClient(rows))
+            columns = analitics.client.getSleepColumns(start_datetime,
+                                                       end_datetime)
+            with self.subTest(seed=seed) :
+                pd.testing.assert_frame_equal(
+                    analitics.deviceTimelines(columns, start_datetime,
+                                              end_datetime),
+                    self.expected(columns, start_datetime, end_datetime),
+                    check_dtype=False)
+
+    def testChangesInAMinute(self) :
+        rows = [measurement(datetime(1, 0, 10), 'bed', '1'),
+                measurement(datetime(1, 0, 50), 'bed', '0'),
+                measurement(datetime(1, 2, 5), 'pir', '0'),
+                measurement(datetime(1, 3), 'bed', '1'),
+                measurement(datetime(1, 3, 30), 'pir', '1'),
+                measurement(datetime(1, 3, 40), 'pir', '0')]
+        start_datetime = datetime(1)
+        end_datetime = datetime(1, 5)
+        analitics = Analitics(EngineClient(rows))
+        columns = analitics.client.getSleepColumns(start_datetime,
+                                                   end_datetime)
+        timelines = analitics.deviceTimelines(columns, start_datetime,
+                                              end_datetime)
+        self.assertEqual([name.split('-')[0] for name in timelines.columns],
+                         ['bed', 'pir'])
+        self.assertEqual(timelines.iloc[:, 0].tolist(), [0, 0, 0, 1, 1, 1])
+        self.assertEqual(timelines.iloc[:, 1].tolist(), [1, 1, 0, 0, 0, 0])
+        pd.testing.assert_frame_equal(
+            timelines, self.expected(columns, start_datetime, end_datetime),
+            check_dtype=False)